@@ -0,0 +1,145 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Size of an asset hash in protocol messages (SHA-256 digest).
+HASH_SIZE = 32
+
+# Default size of a collaborator's asset cache, in bytes.
+CACHE_SIZE = 64 * 1024 * 1024
+
+
+def asset_hash(data: bytes) -> str:
+    """
+    Identify an asset by its content.
+    :param data: The asset's data.
+    :return: SHA-256 digest of the data, as a hexadecimal string.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def key_to_bytes(key: str) -> bytes:
+    """
+    Convert an asset hash to the form used in protocol messages.
+    :param key: The hexadecimal asset hash.
+    :return: The digest bytes.
+    """
+    return bytes.fromhex(key)
+
+
+def key_from_bytes(data: bytes) -> str:
+    """
+    Read an asset hash from the start of a protocol message.
+    :param data: The message payload.
+    :return: The hexadecimal asset hash.
+    """
+    return bytes(data[0:HASH_SIZE]).hex()
+
+
+class AssetStore:
+    """
+    Assets (such as images) used by pages, stored by content hash.
+    Pages refer to an asset with an 'asset' attribute holding its hash, so each asset only has to be sent to a
+    collaborator once, however many pages use it.
+    Assets are kept until they are released with retain. Safe to use from many threads at once (pages are loaded on
+    worker threads).
+    """
+
+    def __init__(self):
+        # Asset hash -> data
+        self.assets = dict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.assets
+
+    def __len__(self):
+        return len(self.assets)
+
+    def add(self, data: bytes) -> str:
+        """
+        Add an asset to the store.
+        :param data: The asset's data.
+        :return: The asset hash.
+        """
+        key = asset_hash(data)
+        with self.lock:
+            self.assets[key] = data
+        return key
+
+    def get(self, key: str) -> bytes | None:
+        """
+        Find an asset.
+        :param key: The asset hash.
+        :return: The asset's data, or None if it isn't in the store.
+        """
+        return self.assets.get(key)
+
+    def retain(self, keys) -> list:
+        """
+        Release every asset except those given, eg. those used by the pages which can still be shown.
+        :param keys: Set of the asset hashes to keep.
+        :return: List of hashes of the assets which were released.
+        """
+        with self.lock:
+            released = [key for key in self.assets if key not in keys]
+            for key in released:
+                del self.assets[key]
+        return released
+
+
+class AssetCache(AssetStore):
+    """
+    Size-bounded store of assets, which forgets the least recently used assets first.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        """
+        Create an empty cache.
+        :param size: Maximum total size of the cached assets, in bytes.
+        """
+        super().__init__()
+        self.assets = OrderedDict()
+        self.size = size
+        self.used = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self.lock:
+            data = self.assets.get(key)
+            if data is not None:
+                self.assets.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes) -> list:
+        """
+        Add an asset to the cache, making room for it if necessary.
+        The newest asset is always kept, even if it is larger than the cache.
+        :param key: The asset hash.
+        :param data: The asset's data.
+        :return: List of hashes of the assets which were removed to make room.
+        """
+        with self.lock:
+            if key in self.assets:
+                self.assets.move_to_end(key)
+                return []
+
+            self.assets[key] = data
+            self.used += len(data)
+
+            evicted = list()
+            while self.used > self.size and len(self.assets) > 1:
+                old_key, old_data = self.assets.popitem(last=False)
+                self.used -= len(old_data)
+                evicted.append(old_key)
+        return evicted
+
+    def retain(self, keys) -> list:
+        released = super().retain(keys)
+        with self.lock:
+            self.used = sum(len(data) for data in self.assets.values())
+        return released
+
+    def add(self, data: bytes) -> str:
+        key = asset_hash(data)
+        self.put(key, data)
+        return key
@@ -1,15 +1,22 @@
 from context import Context
 
 import dom
+import delta
+import serialiser
+import assets
+import os
 
 import socket
-import select
+import struct
 import tkinter as tk
 import tkinter.ttk as ttk
 import tkinter.messagebox as messagebox
 import re
 
-from messageProtocol import MessageProtocol
+from eventLoop import TkEventLoop
+from messageProtocol import MessageProtocol, PAGE_START, NO_PAGE
+from pageCache import PageCache, CACHE_DIRECTORY
+from relay import Relay
 from messageType import *
 
 
@@ -23,13 +30,16 @@ class Collaborator(Context):
     Collaborator class connects to a Conductor and displays the same content as the Conductor.
     """
 
-    def __init__(self, cid, host, port):
+    def __init__(self, cid, host, port, cache_directory=CACHE_DIRECTORY, session=None, relay_port=None):
         """
         Create a new collaborator connected to the given Conductor.
-        Conductor periodically checks for messages from the Conductor and responds appropriately .
+        Collaborator responds to messages from the Conductor as soon as they arrive.
         :param cid: The Context Name
         :param host: The remote server to connect to (ip / dns name)
         :param port: The port to connect on
+        :param cache_directory: Where pages and images are kept between sessions
+        :param session: Session to join, if the Conductor is a SessionServer hosting several (optional)
+        :param relay_port: Port on which to accept collaborators of our own, and pass pages on to them (optional)
         """
         # styleDefaults.dark_mode = True
         # Call Context initialiser to create window.
@@ -42,42 +52,70 @@ class Collaborator(Context):
         # Connect to Conductor
         self.connection = socket.create_connection((host, port))
         self.connection.setblocking(False)
-        self.conductor = MessageProtocol(self.connection, self.cid)
         self.current_page_data = None
 
-        # Setup network check.
-        self.window.after(10, lambda: self.check_network())
+        # Images received from the Conductor, by hash.
+        self.assets = assets.AssetCache()
+
+        # Pages and images saved on disk, so that they don't have to be sent again.
+        self.page_files = PageCache(os.path.join(cache_directory, 'pages'))
+        self.asset_files = PageCache(os.path.join(cache_directory, 'assets'))
+
+        # Page being streamed: its hash, length, and the chunks received so far.
+        self.stream = None
+
+        # Check for messages as soon as they arrive. Network events are handled by the Tk main loop.
+        self.loop = TkEventLoop(self.window)
+        self.conductor = MessageProtocol(self.connection, self.cid, loop=self.loop, session=session)
+        self.loop.add_reader(self.connection, self.check_network)
+
+        # Pass pages on to collaborators connected to us, so the Conductor only has to send them once.
+        self.relay = None
+        if relay_port is not None:
+            self.relay = Relay(self.cid, self.loop, self.conductor, self.find_asset)
+            self.relay.listen(port=relay_port)
 
         # Start the application!
-        self.window.mainloop()
+        self.loop.run_forever()
 
     def check_network(self):
         """
-        Check for messages from the Conductor and process them.
-        This is currently limited to sending page data.
+        Process messages from the Conductor.
+        Called by the event loop as soon as the connection is ready.
         """
 
-        # Check for incoming data from the conductor.
-        ready = select.select([self.connection], [], [], 0)
-
-        if self.connection in ready[0]:
-            messages = self.conductor.receive()
-            for m in messages:
-                if m.message_type == MESSAGE_DISCONNECTED:
-                    disconnect()
-                if m.message_type == MESSAGE_INVALID:
-                    disconnect()
-                elif m.message_type == MESSAGE_TIMEOUT:
-                    disconnect()
-                elif m.message_type == MESSAGE_NAVIGATION:
-                    self.set_address(m.data.decode('utf-8'))
-                elif m.message_type == MESSAGE_PAGEDATA:
-                    self.visit_page(m.data)
-                else:
-                    disconnect()
-
-        # Schedule next network check one second later
-        self.window.after(1000, lambda: self.check_network())
+        messages = self.conductor.receive()
+        if not self.conductor.active:
+            # Stop watching the connection before it goes away.
+            self.loop.remove_reader(self.connection)
+
+        for m in messages:
+            if m.message_type == MESSAGE_DISCONNECTED:
+                disconnect()
+            if m.message_type == MESSAGE_INVALID:
+                disconnect()
+            elif m.message_type == MESSAGE_TIMEOUT:
+                disconnect()
+            elif m.message_type == MESSAGE_NAVIGATION:
+                self.set_address(m.text())
+                if self.relay is not None:
+                    self.relay.navigation_received(m.text())
+            elif m.message_type == MESSAGE_PAGEDATA:
+                self.visit_page(m.data)
+            elif m.message_type == MESSAGE_PAGEDELTA:
+                self.visit_page(m.data, is_delta=True)
+            elif m.message_type == MESSAGE_PAGESTART:
+                self.start_page_stream(m.data)
+            elif m.message_type == MESSAGE_PAGECHUNK:
+                self.continue_page_stream(m.data)
+            elif m.message_type == MESSAGE_PAGEEND:
+                self.finish_page_stream()
+            elif m.message_type == MESSAGE_ASSET:
+                self.receive_asset(m.data)
+            elif m.message_type == MESSAGE_PAGEAVAILABLE:
+                self.page_available(m.data)
+            else:
+                disconnect()
 
     def make_ui_frame(self):
         """
@@ -121,21 +159,31 @@ class Collaborator(Context):
         """
         return self.page
 
-    def visit_page(self, page_data):
+    def visit_page(self, page_data, is_delta=False):
         """
         Load a page from serialised data.
         Uses the dom and serialiser modules.
         :param page_data: Serialised page data
+        :param is_delta: True if page_data is a delta against the current page data.
         """
         try:
+            if is_delta:
+                try:
+                    page_data = delta.apply(self.current_page_data, page_data)
+                except delta.DeltaError as e:
+                    # The Conductor thinks we are showing a page we aren't. Ask for the whole page instead.
+                    print(e)
+                    self.conductor.pagerequest(delta.target_hash(page_data), NO_PAGE)
+                    return
 
             # Setup page frame
             page_frame = ttk.Frame(self.root)
             page_frame.grid(row=1, column=0, sticky=tk.NSEW)
 
             # Create page from serialised data
-            self.page = dom.deserialise_page(page_data, page_frame)
+            self.page = dom.deserialise_page(page_data, page_frame, self.assets)
             self.current_page_data = page_data
+            self.page_files.put(serialiser.page_hash(page_data).hex(), page_data)
 
             # Set window title, address, and layout labels.
             self.window.title(self.current_page().title)
@@ -143,8 +191,144 @@ class Collaborator(Context):
 
             self.page.render()
             self.page.renderer.bind_links(self)
-        except ValueError as e:
+
+            if self.relay is not None:
+                self.relay.page_received(self.page, page_data)
+        except (ValueError, delta.DeltaError) as e:
+            print(e)
+
+    def start_page_stream(self, start_data):
+        """
+        Start loading a page which will arrive in chunks. The page is drawn as each chunk arrives.
+        Any page which was still being streamed is abandoned.
+        :param start_data: Hash and length of the whole page.
+        """
+        try:
+            page_hash, length = PAGE_START.unpack(start_data)
+        except struct.error as e:
             print(e)
+            self.stream = None
+            return
+
+        # Setup page frame
+        page_frame = ttk.Frame(self.root)
+        page_frame.grid(row=1, column=0, sticky=tk.NSEW)
+
+        self.page = dom.HtmlPage(page_frame, self.assets)
+        self.page.start_stream()
+        self.stream = (page_hash, length, list())
+
+    def continue_page_stream(self, chunk):
+        """
+        Load and draw the next chunk of a streamed page.
+        :param chunk: Serialised page data following the previous chunk.
+        """
+        if self.stream is None:
+            # The start of the page was bad, ignore the rest of it.
+            return
+        try:
+            self.stream[2].append(chunk)
+            self.page.feed(chunk)
+            self.window.title(self.current_page().title)
+            self.set_address(self.current_page().address)
+        except (ValueError, serialiser.SerialisationError) as e:
+            print(e)
+            # Ask for the whole page instead.
+            self.conductor.pagerequest(self.stream[0], NO_PAGE)
+            self.stream = None
+
+    def finish_page_stream(self):
+        """
+        Finish loading a streamed page, once all of its chunks have arrived.
+        """
+        if self.stream is None:
+            return
+        page_hash, length, chunks = self.stream
+        self.stream = None
+        try:
+            self.page.finish_stream()
+            page_data = b''.join(chunks)
+            if len(page_data) != length or serialiser.page_hash(page_data) != page_hash:
+                # Ask for the whole page, as the Conductor will otherwise send deltas against a page we don't have.
+                self.conductor.pagerequest(page_hash, NO_PAGE)
+                raise ValueError('Streamed page does not match its hash')
+            self.current_page_data = page_data
+            self.page_files.put(page_hash.hex(), page_data)
+
+            self.window.title(self.current_page().title)
+            self.set_address(self.current_page().address)
+            self.page.renderer.bind_links(self)
+
+            if self.relay is not None:
+                self.relay.page_received(self.page, page_data)
+        except (ValueError, serialiser.SerialisationError) as e:
+            print(e)
+
+    def receive_asset(self, asset_data):
+        """
+        Store an asset for pages to use, and let the Conductor know it doesn't need to be sent again.
+        :param asset_data: The asset hash followed by the asset.
+        """
+        key = assets.key_from_bytes(asset_data)
+        data = bytes(asset_data[assets.HASH_SIZE:])
+        if assets.asset_hash(data) != key:
+            print('Asset does not match its hash')
+            return
+
+        self.asset_files.put(key, data)
+        self.store_asset(key, data)
+
+    def store_asset(self, key, data):
+        """
+        Keep an asset in memory, and let the Conductor know it doesn't need to be sent again.
+        :param key: The asset hash.
+        :param data: The asset.
+        """
+        # Tell the Conductor about assets which were forgotten to make room, so that they are sent again if needed.
+        for evicted in self.assets.put(key, data):
+            self.conductor.assetrelease(evicted)
+        self.conductor.assetack(key)
+
+    def find_asset(self, key):
+        """
+        Find an asset in memory or on disk.
+        :param key: The asset hash.
+        :return: The asset, or None if it has never been received (or has been forgotten).
+        """
+        data = self.assets.get(key)
+        if data is None:
+            data = self.asset_files.get(key)
+        return data
+
+    def find_assets(self, keys):
+        """
+        Make sure assets are in memory, loading them from disk if necessary.
+        :param keys: The asset hashes.
+        :return: True if every asset was found.
+        """
+        for key in keys:
+            if key not in self.assets:
+                data = self.asset_files.get(key)
+                if data is None:
+                    return False
+                self.store_asset(key, data)
+        return True
+
+    def page_available(self, page_hash):
+        """
+        Show a page offered by the Conductor, using the copy saved on disk if there is one. Otherwise ask for it.
+        :param page_hash: Hash of the page.
+        """
+        page_hash = bytes(page_hash)
+        page_data = self.page_files.get(page_hash.hex())
+        if page_data is not None and self.find_assets(serialiser.asset_keys(page_data)):
+            self.stream = None
+            self.visit_page(page_data)
+        else:
+            current_hash = NO_PAGE
+            if self.current_page_data is not None:
+                current_hash = serialiser.page_hash(self.current_page_data)
+            self.conductor.pagerequest(page_hash, current_hash)
 
     def go(self, url):
         print(url)
@@ -0,0 +1,106 @@
+import bz2
+import lzma
+import zlib
+
+# Payloads smaller than this are not worth compressing.
+COMPRESSION_THRESHOLD = 1024
+
+# Default compression level (0-9 for every codec).
+DEFAULT_LEVEL = 6
+
+
+class Codec:
+    """
+    A compression method that can be negotiated with a remote Conductor or Collaborator.
+    """
+
+    def __init__(self, codec_id: int, name: str, compress, decompress):
+        """
+        Create a Codec.
+        :param codec_id: Identifier sent in the message header flags. Must be between 1 and 15.
+        :param name: Name used when advertising the codec in the greeting.
+        :param compress: Function taking data and a level, returning compressed data.
+        :param decompress: Function taking compressed data and the largest size the original data may have, returning
+            the original data.
+        """
+        self.codec_id = codec_id
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+class DecompressionLimitError(ValueError):
+    """
+    Thrown when compressed data would decompress to more than the limit allowed.
+    """
+    pass
+
+
+def decompress_limited(decompressor, data, limit: int) -> bytes:
+    """
+    Decompress data, without ever holding more than limit bytes of the result. This stops a small payload made to
+    decompress to an enormous size from using up memory.
+    :param decompressor: A new zlib, bz2 or lzma decompressor object.
+    :param data: The compressed data.
+    :param limit: Largest size, in bytes, the original data may have.
+    :return: The original data.
+    """
+    result = decompressor.decompress(data, limit + 1)
+    if len(result) > limit:
+        raise DecompressionLimitError(f'Decompressed data is larger than {limit} bytes')
+    if not decompressor.eof:
+        raise EOFError('Compressed data is incomplete')
+    return result
+
+
+CODECS = [
+    Codec(1, 'zlib', lambda data, level: zlib.compress(data, level),
+          lambda data, limit: decompress_limited(zlib.decompressobj(), data, limit)),
+    Codec(2, 'bz2', lambda data, level: bz2.compress(data, max(level, 1)),
+          lambda data, limit: decompress_limited(bz2.BZ2Decompressor(), data, limit)),
+    Codec(3, 'lzma', lambda data, level: lzma.compress(data, preset=level),
+          lambda data, limit: decompress_limited(lzma.LZMADecompressor(), data, limit)),
+]
+
+# Exceptions raised by the codecs when given corrupt data (or data which decompresses to more than the limit).
+DECOMPRESSION_ERRORS = (zlib.error, lzma.LZMAError, OSError, ValueError, EOFError)
+
+# Codec names, best compression first.
+PREFERENCE = ('lzma', 'bz2', 'zlib')
+
+
+def by_name(name: str) -> Codec | None:
+    """
+    Find a codec by name.
+    :param name: The codec name.
+    :return: The Codec, or None if there is no such codec.
+    """
+    for codec in CODECS:
+        if codec.name == name:
+            return codec
+    return None
+
+
+def by_id(codec_id: int) -> Codec | None:
+    """
+    Find a codec by identifier.
+    :param codec_id: The identifier from a message header.
+    :return: The Codec, or None if there is no such codec.
+    """
+    for codec in CODECS:
+        if codec.codec_id == codec_id:
+            return codec
+    return None
+
+
+def choose(local: tuple, remote: list) -> Codec | None:
+    """
+    Choose the best codec supported by both ends of a connection.
+    :param local: Names of codecs this end supports, best first.
+    :param remote: Names of codecs the other end supports.
+    :return: The chosen Codec, or None if there is no codec in common.
+    """
+    for name in local:
+        if name in remote:
+            return by_name(name)
+    return None
@@ -1,19 +1,13 @@
 from context import Context
-import serialiser
-import dom
-
-import socket
-import select
-import re
+from session import Session
 
 import tkinter as tk
 import tkinter.ttk as ttk
 
-from messageProtocol import MessageProtocol
-from messageType import *
+from eventLoop import TkEventLoop
 
 
-class Conductor(Context):
+class Conductor(Context, Session):
     """
     Conductor class loads pages from the internet and sends them to collaborators.
     """
@@ -25,86 +19,24 @@ class Conductor(Context):
         """
 
         # Call Context initialiser to create window
-        super().__init__(cid)
+        Context.__init__(self, cid)
 
         # Setup user interface
         self.address_bar = None
         ui = self.make_ui_frame()
 
-        # Setup navigation history
-        self.pages = [None]
-        self.page_history = list()
-        self.back_history = list()
-        self.collaborators = list()
-        self.current_page_data = None
+        # Network events are dispatched from the Tk main loop
+        Session.__init__(self, cid, TkEventLoop(self.window))
 
         # Navigate to the homepage
         self.go_to_page(home)
 
         # Prepare to accept collaborators.
-        self.server_socket = socket.create_server(('0.0.0.0', 10000))
-        self.server_socket.setblocking(False)
-        self.window.after(10, lambda: self.check_network())
+        # Network events are handled by the Tk main loop as soon as they happen.
+        self.listen()
 
         # Start the application
-        self.window.mainloop()
-
-    def check_network(self):
-        """
-        Accept connections from collaborators and add them to a list to be updated when the page changes.
-        """
-
-        # Check for collaborators waiting to connect
-        ready = select.select([self.server_socket], [], [], 0)
-
-        while self.server_socket in ready[0]:
-            # Accept a new collaborator
-            connection, address = self.server_socket.accept()
-            connection.setblocking(False)
-            collaborator = MessageProtocol(connection, self.cid)
-            self.collaborators.append((collaborator, address, connection))
-
-            # Send current page data to the collaborator
-            collaborator.navigate(self.current_page().address)
-            collaborator.pagedata(self.current_page_data)
-
-            # Check for another collaborator
-            ready = select.select([self.server_socket], [], [], 0)
-
-        sockets = [c[2] for c in self.collaborators]
-        if len(sockets) == 0:
-            ready = ([], [], [])
-        else:
-            ready = select.select([c[2] for c in self.collaborators], [], [], 0)
-        for c in self.collaborators:
-            if c[2] in ready[0]:
-                print('ready')
-                collaborator = c[0]
-                messages = collaborator.receive()
-                for m in messages:
-                    if m.message_type == MESSAGE_DISCONNECTED:
-                        collaborator.active = False
-                    if m.message_type == MESSAGE_INVALID:
-                        collaborator.active = False
-                    elif m.message_type == MESSAGE_TIMEOUT:
-                        collaborator.active = False
-                    elif m.message_type == MESSAGE_NAVIGATION:
-                        self.go(m.data.decode('utf-8'))
-                    elif m.message_type == MESSAGE_PAGEDATA:
-                        collaborator.active = False
-                    elif m.message_type == MESSAGE_BACK:
-                        self.back()
-                    elif m.message_type == MESSAGE_FORWARD:
-                        self.forward()
-                    else:
-                        collaborator.active = False
-
-        for c in self.collaborators:
-            if not c[0].active:
-                self.collaborators.remove(c)
-
-        # Schedule next check after another second.
-        self.window.after(1000, lambda: self.check_network())
+        self.loop.run_forever()
 
     def current_page(self):
         """
@@ -161,19 +93,18 @@ class Conductor(Context):
 
         return ui_frame
 
-    def go(self, url):
+    def make_page_frame(self):
         """
-        Update the navigation history and load a new page.
-        :param url: The URL of the page to load
+        Create a frame to contain page components.
+        :return: The new frame
         """
-        self.page_history.append((self.current_page().address, self.current_page_data))
-        print(url)
-        self.go_to_page(url)
+        page_frame = ttk.Frame(self.root)
+        page_frame.grid(row=1, column=0, sticky=tk.NSEW)
+        return page_frame
 
-    def finish_going(self):
+    def show_page(self):
         """
-        Perform miscellaneous tasks required after a page has been loaded by go_to_page() or revisit().
-
+        Draw the current page in the window, after it has been loaded by go_to_page() or revisit().
         """
 
         # Set the window title.
@@ -183,131 +114,6 @@ class Conductor(Context):
 
         # Make links clickable
         self.current_page().renderer.bind_links(self)
-        # Find all '<a>' tags
-        for anchor in self.current_page().find_nodes('a'):
-            children = list()
-            # Get the 'data' nodes from the anchor
-            anchor.find_nodes(children, 'data')
-            for child in children:
-                # Bind the primary mouse click action on each label to activate the link.
-                # This whole expression is wrapped in a lambda to force the binding of the child variable.
-                # Without this ALL links on the page will go to the same place.
-                # This is because the child reference is changed, with the nested lambda using the same binding.
-                # If you know a better way to do this, please tell Stuart :)
-                (lambda c=child, a=anchor: c.tk_object.bind("<Button-1>",
-                                                            lambda event: self.go(
-                                                                self.make_path(a.get_attr('href')))))()
-
-        # Send the page data to each collaborator
-        for collaborator in self.collaborators:
-            try:
-                collaborator[0].pagedata(self.current_page_data)
-            except IOError:
-                collaborator[0].disconnect()
-
-    def go_to_page(self, url):
-        """
-        Load a page from the internet.
-        :param url: The url of the page to load.
-        """
-
-        # Clear the forward navigation history
-        self.back_history = list()
-
-        # Set the url in the address bar
-        # Needed for non-user initiated navigation (e.g. homepage loaded).
-        self.set_address(url)
-
-        # Send a navigation message to each collaborator
-        for collaborator in self.collaborators:
-            try:
-                collaborator[0].navigate(url)
-            except IOError:
-                collaborator[0].disconnect()
-
-        try:
-            # Destroy previous page (if any)
-            if self.current_page() is not None:
-                self.current_page().delete()
-
-            # Create frame to contain page components
-            page_frame = ttk.Frame(self.root)
-            page_frame.grid(row=1, column=0, sticky=tk.NSEW)
-
-            # Load the page!
-            self.pages[self.focused_page] = dom.create_page_from_url(url, page_frame)
-
-            # Save serialised page data
-            self.current_page_data = serialiser.bytes_from_html(self.current_page())
-
-            # Finalise loading
-            self.finish_going()
-
-        except ValueError as e:
-            print(e)
-
-    def revisit(self, page_data):
-        """
-        Reload a previously visited page
-        :param page_data: Serialised page data
-        """
-
-        # Set the address bar to the page's url
-        self.set_address(page_data[0])
-
-        # Send a navigation message to each collaborator
-        for collaborator in self.collaborators:
-            try:
-                collaborator[0].navigate(page_data[0])
-            except IOError:
-                collaborator[0].disconnect()
-
-        try:
-            # Destroy the current page (if any)
-            if self.current_page() is not None:
-                self.current_page().delete()
-
-            # Create frame to contain page components
-            page_frame = ttk.Frame(self.root)
-            page_frame.grid(row=1, column=0, sticky=tk.NSEW)
-
-            # Rebuild the page from serialised data
-            self.pages[self.focused_page] = dom.deserialise_page(page_data[1], page_frame)
-            self.current_page_data = page_data[1]
-
-            # Finalise loading
-            self.finish_going()
-
-        except ValueError as e:
-            print(e)
-
-    def back(self):
-        """
-        Navigate backward through navigation history.
-        """
-        if len(self.page_history) > 0:
-            # Get previous page
-            prev = self.page_history.pop()
-
-            # Store current page for future 'forward' navigation
-            self.back_history.append((self.current_page().address, self.current_page_data))
-
-            # Load the previous page
-            self.revisit(prev)
-
-    def forward(self):
-        """
-        Navigate forward through navigation history.
-        """
-        if len(self.back_history) > 0:
-            # Get next page
-            prev = self.back_history.pop()
-
-            # Store current page for future 'back' navigation
-            self.page_history.append((self.current_page().address, self.current_page_data))
-
-            # Load the next page
-            self.revisit(prev)
 
     def display_collaboration_options(self):
         """
@@ -0,0 +1,263 @@
+import struct
+from bisect import bisect_left
+
+import serialiser
+
+# Delta operations
+COPY = b'C'  # Copy a range of bytes from the base page
+INSERT = b'I'  # Insert new bytes
+
+COPY_OP = struct.Struct('!II')  # offset, length
+INSERT_OP = struct.Struct('!I')  # length
+
+# Size of the base and target page hashes at the start of a delta.
+HASH_SIZE = 32
+
+# Pages are matched a serialised object at a time. When an object appears several times in the base page, only
+# this many places are tried, and a match must continue for at least MIN_RUN objects to be used.
+MAX_CANDIDATES = 8
+MIN_RUN = 2
+
+
+class DeltaError(Exception):
+    """
+    Thrown when a delta cannot be applied.
+    """
+    pass
+
+
+def common_prefix(a: bytes, b: bytes) -> int:
+    """
+    Find the length of the common start of two byte strings.
+    :param a: The first byte string.
+    :param b: The second byte string.
+    :return: The number of leading bytes which are the same.
+    """
+    low = 0
+    high = min(len(a), len(b))
+    # Binary search, so that comparisons happen in large blocks.
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix(a: bytes, b: bytes) -> int:
+    """
+    Find the length of the common end of two byte strings.
+    :param a: The first byte string.
+    :param b: The second byte string.
+    :return: The number of trailing bytes which are the same.
+    """
+    low = 0
+    high = min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def tokens(data: bytes, start: int, end: int) -> tuple[list, list]:
+    """
+    Split serialised page data into objects. Each token begins with an OBJECT sequence.
+    :param data: The serialised data.
+    :param start: Offset to start from.
+    :param end: Offset to finish at.
+    :return: List of tokens and list of their offsets in data.
+    """
+    result = list()
+    offsets = list()
+    position = start
+    while position < end:
+        following = data.find(serialiser.OBJECT, position + 1, end)
+        if following == -1:
+            following = end
+        result.append(data[position:following])
+        offsets.append(position)
+        position = following
+    return result, offsets
+
+
+def match_tokens(base_tokens: list, target_tokens: list) -> list:
+    """
+    Greedily match target tokens against base tokens, preferring to continue the current run of matches.
+    :param base_tokens: Tokens from the base page.
+    :param target_tokens: Tokens from the target page.
+    :return: For each target token, the index of the matching base token, or None.
+    """
+    positions = dict()
+    for i, token in enumerate(base_tokens):
+        positions.setdefault(token, []).append(i)
+
+    def run_length(i, j):
+        length = 0
+        while (i + length < len(base_tokens) and j + length < len(target_tokens) and length < MAX_CANDIDATES * MIN_RUN
+               and base_tokens[i + length] == target_tokens[j + length]):
+            length += 1
+        return length
+
+    matches = list()
+    i = 0
+    for j, token in enumerate(target_tokens):
+        if i < len(base_tokens) and base_tokens[i] == token:
+            # Continue the current run.
+            matches.append(i)
+            i += 1
+            continue
+
+        # Look for the longest run starting with this token, trying places after the current position first.
+        candidates = positions.get(token, [])
+        start = bisect_left(candidates, i)
+        best = None
+        best_length = MIN_RUN - 1
+        tried = candidates[start:start + MAX_CANDIDATES]
+        tried += candidates[:min(start, MAX_CANDIDATES - len(tried))]
+        for candidate in tried:
+            length = run_length(candidate, j)
+            if length > best_length:
+                best = candidate
+                best_length = length
+
+        if best is None:
+            matches.append(None)
+        else:
+            matches.append(best)
+            i = best + 1
+    return matches
+
+
+def diff(base: bytes, target: bytes) -> list:
+    """
+    Describe target as a list of copy and insert operations on base.
+    :param base: The page the remote already has.
+    :param target: The page the remote should end up with.
+    :return: List of (COPY, offset, length) and (INSERT, offset, length) tuples. Insert offsets refer to target.
+    """
+    ops = list()
+
+    def copy(offset, length):
+        if length == 0:
+            return
+        # Merge with the previous copy if the ranges are contiguous.
+        if len(ops) > 0 and ops[-1][0] == COPY and ops[-1][1] + ops[-1][2] == offset:
+            ops[-1] = (COPY, ops[-1][1], ops[-1][2] + length)
+        else:
+            ops.append((COPY, offset, length))
+
+    def insert(offset, length):
+        if length == 0:
+            return
+        if len(ops) > 0 and ops[-1][0] == INSERT and ops[-1][1] + ops[-1][2] == offset:
+            ops[-1] = (INSERT, ops[-1][1], ops[-1][2] + length)
+        else:
+            ops.append((INSERT, offset, length))
+
+    prefix = common_prefix(base, target)
+    suffix = common_suffix(base[prefix:], target[prefix:])
+    base_end = len(base) - suffix
+    target_end = len(target) - suffix
+
+    copy(0, prefix)
+
+    # Match the differing middle section of the pages object by object.
+    base_tokens, base_offsets = tokens(base, prefix, base_end)
+    target_tokens, target_offsets = tokens(target, prefix, target_end)
+    base_offsets.append(base_end)
+    target_offsets.append(target_end)
+
+    for j, i in enumerate(match_tokens(base_tokens, target_tokens)):
+        if i is None:
+            insert(target_offsets[j], target_offsets[j + 1] - target_offsets[j])
+        else:
+            copy(base_offsets[i], base_offsets[i + 1] - base_offsets[i])
+
+    copy(base_end, suffix)
+    return ops
+
+
+def encode(base: bytes, target: bytes) -> bytes:
+    """
+    Create a delta which turns base into target.
+    :param base: The serialised page the remote already has.
+    :param target: The serialised page the remote should end up with.
+    :return: The hashes of both pages, followed by the encoded operations.
+    """
+    base = bytes(base)
+    target = bytes(target)
+    result = bytearray()
+    result.extend(serialiser.page_hash(base))
+    result.extend(serialiser.page_hash(target))
+    for op, offset, length in diff(base, target):
+        if op == COPY:
+            result.extend(COPY)
+            result.extend(COPY_OP.pack(offset, length))
+        else:
+            result.extend(INSERT)
+            result.extend(INSERT_OP.pack(length))
+            result.extend(target[offset:offset + length])
+    return bytes(result)
+
+
+def base_hash(data: bytes) -> bytes:
+    """
+    Get the hash of the page a delta must be applied to.
+    :param data: The delta.
+    :return: The base page hash.
+    """
+    return bytes(data[0:HASH_SIZE])
+
+
+def target_hash(data: bytes) -> bytes:
+    """
+    Get the hash of the page a delta produces.
+    :param data: The delta.
+    :return: The target page hash.
+    """
+    return bytes(data[HASH_SIZE:2 * HASH_SIZE])
+
+
+def apply(base: bytes, data: bytes) -> bytes:
+    """
+    Apply a delta created by encode.
+    :param base: The serialised page the delta was made against.
+    :param data: The delta.
+    :return: The new serialised page.
+    """
+    if base is None or serialiser.page_hash(base) != base_hash(data):
+        raise DeltaError('Delta does not apply to the current page')
+
+    data = memoryview(data)
+    result = bytearray()
+    index = 2 * HASH_SIZE
+    try:
+        while index < len(data):
+            op = bytes(data[index:index + 1])
+            index += 1
+            if op == COPY:
+                offset, length = COPY_OP.unpack_from(data, index)
+                index += COPY_OP.size
+                if offset + length > len(base):
+                    raise DeltaError('Copy outside the base page')
+                result.extend(base[offset:offset + length])
+            elif op == INSERT:
+                length, = INSERT_OP.unpack_from(data, index)
+                index += INSERT_OP.size
+                if index + length > len(data):
+                    raise DeltaError('Insert past the end of the delta')
+                result.extend(data[index:index + length])
+                index += length
+            else:
+                raise DeltaError('Unknown delta operation')
+    except struct.error as error:
+        raise DeltaError('Truncated delta') from error
+
+    result = bytes(result)
+    if serialiser.page_hash(result) != target_hash(data):
+        raise DeltaError('Delta produced the wrong page')
+    return result
@@ -1,50 +1,239 @@
 import sys
-from urllib import request
-from urllib.error import URLError, HTTPError
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from html.parser import HTMLParser
 
 import base64
 import re as re
 
 import serialiser
-from src import renderer
+import selector
+import httpClient
+import httpCache
+
+# Images are downloaded in parallel by up to IMAGE_THREADS threads, with at most HOST_CONNECTIONS downloads from any one
+# server at a time (matching the number of connections httpClient keeps open to each server).
+IMAGE_THREADS = 8
+HOST_CONNECTIONS = httpClient.POOL_SIZE
+
+
+# Shared by nodes which have no children or attributes (most nodes are text or images), until they are given some.
+NO_CHILDREN = ()
+NO_ATTRIBUTES = dict()
+
+# Documents larger than this (in bytes of HTML, or of serialised data) are kept in a DomArena instead of as HtmlNodes.
+ARENA_THRESHOLD = 1024 * 1024
+
+# Index used in a DomArena's arrays where there is no node (eg. the parent of the root).
+NO_NODE = -1
+
+# Attributes which a DomIndex finds nodes by, as well as their tags.
+INDEXED_ATTRIBUTES = ('id', 'class')
+
+# Events from walk_events: a node is entered before the nodes inside it, and left after them. These are the same events
+# as the serialiser's HtmlStreamDeserialiser gives, so both can be drawn the same way (see HtmlPage.render_events).
+ENTER = serialiser.NODE_START
+LEAVE = serialiser.NODE_END
+
+
+def walk(root):
+    """
+    Visit a node and every node inside it, in document order (each node before the nodes inside it).
+    An explicit stack is used rather than recursion, so there is no limit on how deeply pages can be nested.
+    :param root: The node to start from.
+    :return: Generator of nodes.
+    """
+    if isinstance(root, ArenaNode):
+        # A DomArena can be followed without a stack at all.
+        arena = root.arena
+        return (arena.node(index) for index in arena.walk(root.index))
+    return walk_stack(root)
+
+
+def walk_stack(root):
+    stack = [root]
+    pop = stack.pop
+    while len(stack) > 0:
+        node = pop()
+        yield node
+        inside = node.children
+        if inside:
+            if len(inside) == 1:
+                # Most nodes with children have only one (eg. the text of a <p>).
+                stack.append(inside[0])
+            else:
+                # Pushed last child first, so that the first child is visited next.
+                stack.extend(reversed(inside))
+
+
+def collect(root, tag=None):
+    """
+    Find a node and every node inside it, in document order, as for walk. This is quicker than walk when every node is
+    needed at once.
+    :param root: The node to start from.
+    :param tag: Tag of the nodes to find, or None for every node.
+    :return: List of nodes.
+    """
+    result = list()
+    found = result.append
+    stack = [root]
+    pop = stack.pop
+    while len(stack) > 0:
+        node = pop()
+        if tag is None or node.tag == tag:
+            found(node)
+        inside = node.children
+        if inside:
+            if len(inside) == 1:
+                stack.append(inside[0])
+            else:
+                stack.extend(reversed(inside))
+    return result
+
+
+def walk_events(root):
+    """
+    Visit a node and every node inside it, in document order, as for walk. Each node is both entered (before the nodes
+    inside it) and left (after them), which is what is needed to write a node's start and end.
+    :param root: The node to start from.
+    :return: Generator of (ENTER, node) and (LEAVE, node) pairs.
+    """
+    yield ENTER, root
+    # Nodes entered but not yet left, innermost last, with their children which haven't been visited yet.
+    stack = [(root, iter(root.children))]
+    while len(stack) > 0:
+        node, remaining = stack[-1]
+        for child in remaining:
+            yield ENTER, child
+            inside = child.children
+            if len(inside) > 0:
+                # Visit the child's children before the rest of node's.
+                stack.append((child, iter(inside)))
+                break
+            yield LEAVE, child
+        else:
+            stack.pop()
+            yield LEAVE, node
+
+
+def is_inside(node, scopes, known):
+    """
+    Check whether a node is one of a set of nodes, or inside one of them. The answer for each ancestor on the way is
+    remembered, so checking every node on a page visits each node only once.
+    :param node: The node.
+    :param scopes: Set of nodes.
+    :param known: Answers already found by this search, by node.
+    :return: True if the node or one of its ancestors is in scopes.
+    """
+    visited = list()
+    result = False
+    while node is not None:
+        result = known.get(node)
+        if result is None and node in scopes:
+            result = True
+        if result is not None:
+            break
+        visited.append(node)
+        node = node.parent
+    else:
+        result = False
+    for ancestor in visited:
+        known[ancestor] = result
+    return result
+
+
+def attribute_dict(attrs):
+    """
+    Convert a list of attributes to a dictionary. As in HTML, if an attribute appears more than once, the first value is
+    used.
+    :param attrs: List of key-value pairs of attributes.
+    :return: Dictionary of attribute values, by name.
+    """
+    if len(attrs) == 0:
+        return NO_ATTRIBUTES
+    result = dict()
+    for name, value in attrs:
+        result.setdefault(name, value)
+    return result
 
 
 class HtmlNode:
     """
     Represents a tag or text element in a HTML document.
+    Pages can have tens of thousands of nodes, so nodes have no __dict__: every attribute a node can have is listed in
+    __slots__.
     """
 
-    parent = None
-    children = None
-    tag = None
-    attrs = None
+    __slots__ = ('parent', 'children', 'tag', 'attrs')
 
     def __init__(self, parent, tag, attrs):
         """
         Create a new node
         :param parent: Containing node - None for top-level <html> tag
         :param tag: Name of tag. Special value 'data' used for text nodes.
-        :param attrs: List of key-value pairs of attributes.
+        :param attrs: List of key-value pairs of attributes, or a dictionary of attribute values by name.
         """
         self.parent = parent
-        self.tag = tag
-        self.attrs = attrs
-        self.children = list()
+        # Pages use the same few tag names many times, so share one copy of each.
+        self.tag = sys.intern(tag)
+        self.attrs = attrs if isinstance(attrs, dict) else attribute_dict(attrs)
+        self.children = NO_CHILDREN
 
     def __str__(self):
-        text = "<" + self.tag + ">"
-        for child in self.children:
-            text += str(child)
-        text += "</" + self.tag + ">"
-        return text
+        # The pieces of the text are added to a list and joined once at the end. The stack holds nodes still to be
+        # written, and the end tags of nodes which have been started, which are written once they are popped.
+        text = list()
+        add = text.append
+        stack = [self]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node = pop()
+            if node.__class__ is str:
+                add(node)
+                continue
+            tag = node.tag
+            inside = node.children
+            if inside:
+                add(f"<{tag}>")
+                push(f"</{tag}>")
+                if len(inside) == 1:
+                    push(inside[0])
+                else:
+                    stack.extend(reversed(inside))
+            else:
+                # Most nodes (eg. text) have no children, so both tags are written at once.
+                add(f"<{tag}></{tag}>")
+        return "".join(text)
+
+    def walk_events(self):
+        """
+        Visit this node and every node inside it, in document order. Modules which dom uses (eg. the renderer) walk
+        nodes with this, rather than importing dom.
+        :return: Generator of (ENTER, node) and (LEAVE, node) pairs, as for walk_events.
+        """
+        return walk_events(self)
 
     def add_child(self, node):
         """
         Add a child node to this tag.
         :param node: The child to add
         """
-        self.children.append(node)
+        if self.children is NO_CHILDREN:
+            self.children = [node]
+        else:
+            self.children.append(node)
+
+    def remove_child(self, node):
+        """
+        Remove a child node from this tag.
+        :param node: The child to remove
+        """
+        if self.children is NO_CHILDREN:
+            raise ValueError('not a child of this node')
+        self.children.remove(node)
 
     def find_nodes(self, result, selector):
         """
@@ -54,10 +243,7 @@ class HtmlNode:
         :param result: The list where matches are added
         :param selector: The tag type to search for.
         """
-        if selector is None or self.tag == selector:
-            result.append(self)
-        for child in self.children:
-            child.find_nodes(result, selector)
+        result.extend(collect(self, selector))
 
     def get_attr(self, attr):
         """
@@ -65,43 +251,61 @@ class HtmlNode:
         :param attr: The attribute to retrieve
         :return: The value of the attribute, or None if not found
         """
-        for a in self.attrs:
-            if a[0] == attr:
-                return a[1]
-        return None
+        return self.attrs.get(attr)
+
+    def set_attr(self, attr, value):
+        if self.attrs is NO_ATTRIBUTES:
+            self.attrs = dict()
+        self.attrs[attr] = value
 
     def clear_attr(self, attr):
-        for a in self.attrs:
-            if a[0] == attr:
-                self.attrs.remove(a)
+        if attr in self.attrs:
+            self.attrs.pop(attr)
 
     def delete(self):
         """
-        Remove all children recursively, allowing nodes to be freed by the garbage collector.
+        Remove all children (and their children), allowing nodes to be freed by the garbage collector.
         """
-        self.parent = None
-        for child in self.children:
-            child.delete()
-        self.children = list()
+        for node in collect(self):
+            node.parent = None
+            node.children = NO_CHILDREN
 
 
 # Following are specialisations of HtmlNode
 
 class ImgNode(HtmlNode):
 
-    def __init__(self, parent, tag, attrs, url):
+    __slots__ = ('image', 'url', 'assets', 'source')
+
+    def __init__(self, parent, tag, attrs, url, assets=None):
+        """
+        Create an image node. If the page was loaded from a url, the image is downloaded afterwards by fetch_images.
+        :param parent: Containing node
+        :param tag: Name of tag
+        :param attrs: List of key-value pairs of attributes, or a dictionary of attribute values by name.
+        :param url: Url of the page, or None if the page is being deserialised.
+        :param assets: AssetStore to add the image to. The node's 'asset' attribute is set to the image's hash. If this
+            is None the image is stored in the node's 'data' attribute instead.
+        """
         super().__init__(parent, tag, attrs)
         self.image = None
         self.url = url
-        if self.url is not None:
-            src = self.get_attr('src')
-            path = self.make_path(src)
-            try:
-                response = request.urlopen(path)
-                data = response.read()
-                self.attrs.append(('data', base64.b64encode(data).decode('utf-8')))
-            except (HTTPError or URLError) as e:
-                print(path, e)
+        self.assets = assets
+
+        # Where the image is downloaded from, or None if it isn't.
+        self.source = None
+        if self.url is not None and self.get_attr('src'):
+            self.source = self.make_path(self.get_attr('src'))
+
+    def set_image(self, data):
+        """
+        Store a downloaded image in the node (or in the page's AssetStore).
+        :param data: The image.
+        """
+        if self.assets is not None:
+            self.set_attr('asset', self.assets.add(data))
+        else:
+            self.set_attr('data', base64.b64encode(data).decode('utf-8'))
 
     def make_path(self, image_path):
         proto, _, path = self.url.partition('://')
@@ -123,6 +327,432 @@ class ImgNode(HtmlNode):
             return proto + '://' + before + '/' + image_path
 
 
+class DomArena:
+    """
+    Keeps a whole tree of nodes in a few parallel arrays, instead of one HtmlNode (with its own list of children and
+    dictionary of attributes) per node. For node n:
+    - strings[tags[n]] is its tag,
+    - parents[n] is its parent, and its children are first_children[n] followed by each child's next_siblings,
+    - attributes[attribute_starts[n]:attribute_ends[n]] are the offsets in strings of its attribute names and values,
+      in pairs.
+    Building, walking and deleting the tree are then simple operations on these arrays. Callers see nodes through
+    ArenaNode views, which can be used wherever an HtmlNode can.
+    """
+
+    def __init__(self, url=None, assets=None):
+        """
+        Create an empty arena.
+        :param url: Url of the page, or None if the page is being deserialised (as for ImgNode).
+        :param assets: AssetStore where the page's images are kept (optional, as for ImgNode).
+        """
+        self.url = url
+        self.assets = assets
+
+        self.tags = array('i')
+        self.parents = array('i')
+        self.first_children = array('i')
+        self.next_siblings = array('i')
+        self.attribute_starts = array('i')
+        self.attribute_ends = array('i')
+        self.attributes = array('i')
+
+        # Last child of each node, so that adding a child doesn't have to follow the siblings before it.
+        self.last_children = array('i')
+
+        # Shared string table. Tag and attribute names are stored once each (see name), and values as they are added.
+        self.strings = list()
+        self.names = dict()
+
+        # Images drawn by the renderer, by node.
+        self.images = dict()
+
+    def __len__(self):
+        return len(self.tags)
+
+    def name(self, text):
+        """
+        Find a tag or attribute name in the string table, adding it if it isn't there yet.
+        :param text: The name.
+        :return: Its offset in the string table.
+        """
+        offset = self.names.get(text)
+        if offset is None:
+            offset = self.string(sys.intern(text))
+            self.names[text] = offset
+        return offset
+
+    def string(self, text):
+        """
+        Add a string to the string table.
+        :param text: The string.
+        :return: Its offset in the string table.
+        """
+        self.strings.append(text)
+        return len(self.strings) - 1
+
+    def add(self, parent, tag, attrs):
+        """
+        Create a node. As for HtmlNode, it isn't one of its parent's children until it is added with add_child.
+        :param parent: Containing ArenaNode - None for top-level <html> tag
+        :param tag: Name of tag. Special value 'data' used for text nodes.
+        :param attrs: List of key-value pairs of attributes, or a dictionary of attribute values by name.
+        :return: ArenaNode for the new node.
+        """
+        index = len(self.tags)
+        self.tags.append(self.name(tag))
+        self.parents.append(NO_NODE if parent is None else parent.index)
+        self.first_children.append(NO_NODE)
+        self.next_siblings.append(NO_NODE)
+        self.last_children.append(NO_NODE)
+
+        self.attribute_starts.append(len(self.attributes))
+        for name, value in (attrs if isinstance(attrs, dict) else attribute_dict(attrs)).items():
+            self.attributes.append(self.name(name))
+            self.attributes.append(self.string(value))
+        self.attribute_ends.append(len(self.attributes))
+        return self.node(index)
+
+    def node(self, index):
+        """
+        Make a view of a node.
+        :param index: The node.
+        :return: An ArenaNode (or ArenaImgNode for images), or None if index is NO_NODE.
+        """
+        if index == NO_NODE:
+            return None
+        if self.tags[index] == self.names.get('img'):
+            return ArenaImgNode(self, index)
+        return ArenaNode(self, index)
+
+    def add_child(self, parent, child):
+        self.parents[child] = parent
+        last = self.last_children[parent]
+        if last == NO_NODE:
+            self.first_children[parent] = child
+        else:
+            self.next_siblings[last] = child
+        self.last_children[parent] = child
+
+    def remove_child(self, parent, child):
+        previous = NO_NODE
+        for sibling in self.children(parent):
+            if sibling == child:
+                break
+            previous = sibling
+        else:
+            raise ValueError('not a child of this node')
+        following = self.next_siblings[child]
+        if previous == NO_NODE:
+            self.first_children[parent] = following
+        else:
+            self.next_siblings[previous] = following
+        if self.last_children[parent] == child:
+            self.last_children[parent] = previous
+        self.next_siblings[child] = NO_NODE
+
+    def children(self, index):
+        """
+        :param index: A node.
+        :return: Generator of the node's children.
+        """
+        child = self.first_children[index]
+        while child != NO_NODE:
+            yield child
+            child = self.next_siblings[child]
+
+    def walk(self, index):
+        """
+        Visit a node and every node inside it, in document order. No recursion (or stack) is needed, since every node
+        knows its parent and next sibling.
+        :param index: The node to start from.
+        :return: Generator of nodes.
+        """
+        first_children = self.first_children
+        next_siblings = self.next_siblings
+        parents = self.parents
+        node = index
+        while True:
+            yield node
+            if first_children[node] != NO_NODE:
+                node = first_children[node]
+                continue
+            # Go back up until there is a next sibling, stopping at the node we started from.
+            while node != index and next_siblings[node] == NO_NODE:
+                node = parents[node]
+            if node == index:
+                return
+            node = next_siblings[node]
+
+    def find_attr(self, index, attr):
+        """
+        :param index: A node.
+        :param attr: An attribute name.
+        :return: The position of the attribute in the attributes array, or None if the node doesn't have it.
+        """
+        offset = self.names.get(attr)
+        if offset is not None:
+            for position in range(self.attribute_starts[index], self.attribute_ends[index], 2):
+                if self.attributes[position] == offset:
+                    return position
+        return None
+
+    def get_attr(self, index, attr):
+        position = self.find_attr(index, attr)
+        if position is None:
+            return None
+        return self.strings[self.attributes[position + 1]]
+
+    def get_attrs(self, index):
+        """
+        :param index: A node.
+        :return: Dictionary of the node's attribute values, by name.
+        """
+        strings = self.strings
+        attributes = self.attributes
+        return {strings[attributes[position]]: strings[attributes[position + 1]]
+                for position in range(self.attribute_starts[index], self.attribute_ends[index], 2)}
+
+    def set_attr(self, index, attr, value):
+        position = self.find_attr(index, attr)
+        if position is not None:
+            self.attributes[position + 1] = self.string(value)
+            return
+        if self.attribute_ends[index] != len(self.attributes):
+            # Another node's attributes follow this node's, so move this node's to the end where there is room.
+            self.move_attributes(index, self.attributes[self.attribute_starts[index]:self.attribute_ends[index]])
+        self.attributes.append(self.name(attr))
+        self.attributes.append(self.string(value))
+        self.attribute_ends[index] = len(self.attributes)
+
+    def clear_attr(self, index, attr):
+        position = self.find_attr(index, attr)
+        if position is not None:
+            self.move_attributes(index, self.attributes[self.attribute_starts[index]:position] +
+                                 self.attributes[position + 2:self.attribute_ends[index]])
+
+    def move_attributes(self, index, attributes):
+        """
+        Replace a node's attributes with a copy at the end of the attributes array. The old copy is left unused.
+        :param index: The node.
+        :param attributes: The node's new attributes (an array of offsets, in pairs).
+        """
+        self.attribute_starts[index] = len(self.attributes)
+        self.attributes.extend(attributes)
+        self.attribute_ends[index] = len(self.attributes)
+
+    def clear(self):
+        """
+        Delete every node, by replacing the arrays.
+        """
+        self.__init__(self.url, self.assets)
+
+
+class ArenaNode:
+    """
+    View of a node in a DomArena, with the same properties and methods as HtmlNode. Views are made as they are needed:
+    two views of the same node are equal, and changes made through one are seen through the other.
+    """
+
+    __slots__ = ('arena', 'index')
+
+    def __init__(self, arena, index):
+        """
+        :param arena: The DomArena holding the node.
+        :param index: The node's index in the arena.
+        """
+        self.arena = arena
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaNode) and self.arena is other.arena and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+    __str__ = HtmlNode.__str__
+    walk_events = HtmlNode.walk_events
+
+    @property
+    def tag(self):
+        return self.arena.strings[self.arena.tags[self.index]]
+
+    @property
+    def parent(self):
+        return self.arena.node(self.arena.parents[self.index])
+
+    @property
+    def children(self):
+        return [self.arena.node(child) for child in self.arena.children(self.index)]
+
+    @property
+    def attrs(self):
+        """
+        A copy of the node's attributes. Use set_attr and clear_attr to change them.
+        """
+        return self.arena.get_attrs(self.index)
+
+    def add_child(self, node):
+        """
+        Add a child node to this tag.
+        :param node: The child to add, an ArenaNode in the same arena.
+        """
+        self.arena.add_child(self.index, node.index)
+
+    def remove_child(self, node):
+        """
+        Remove a child node from this tag.
+        :param node: The child to remove
+        """
+        self.arena.remove_child(self.index, node.index)
+
+    def find_nodes(self, result, selector):
+        """
+        Add nodes matching the given selector to the result list, as for HtmlNode.
+        :param result: The list where matches are added
+        :param selector: The tag type to search for.
+        """
+        arena = self.arena
+        if selector is None:
+            result.extend(arena.node(index) for index in arena.walk(self.index))
+            return
+        offset = arena.names.get(selector)
+        if offset is not None:
+            tags = arena.tags
+            result.extend(arena.node(index) for index in arena.walk(self.index) if tags[index] == offset)
+
+    def get_attr(self, attr):
+        return self.arena.get_attr(self.index, attr)
+
+    def set_attr(self, attr, value):
+        self.arena.set_attr(self.index, attr, value)
+
+    def clear_attr(self, attr):
+        self.arena.clear_attr(self.index, attr)
+
+    def delete(self):
+        """
+        Deleting the root (the first node added to the arena) deletes every node in the arena at once. Other nodes are
+        cut off from their parent and children, as for HtmlNode. Deleting a node again does nothing.
+        """
+        arena = self.arena
+        if self.index >= len(arena):
+            # Already deleted
+            return
+        if self.index == 0:
+            arena.clear()
+        else:
+            arena.parents[self.index] = NO_NODE
+            arena.first_children[self.index] = NO_NODE
+            arena.last_children[self.index] = NO_NODE
+
+
+class ArenaImgNode(ArenaNode):
+    """
+    View of an image node in a DomArena, with the same properties and methods as ImgNode.
+    """
+
+    __slots__ = ()
+
+    @property
+    def image(self):
+        return self.arena.images.get(self.index)
+
+    @image.setter
+    def image(self, image):
+        self.arena.images[self.index] = image
+
+    @property
+    def url(self):
+        return self.arena.url
+
+    @property
+    def assets(self):
+        return self.arena.assets
+
+    @property
+    def source(self):
+        if self.url is not None and self.get_attr('src'):
+            return self.make_path(self.get_attr('src'))
+        return None
+
+    set_image = ImgNode.set_image
+    make_path = ImgNode.make_path
+
+
+class ImageLoader:
+    """
+    Downloads images in parallel. One ImageLoader is shared by every page being loaded, so that pages loaded at the
+    same time (see Session) share its threads, and together download at most host_connections images at once from any
+    one server.
+    """
+
+    def __init__(self, threads=IMAGE_THREADS, host_connections=HOST_CONNECTIONS):
+        """
+        :param threads: Maximum number of images to download at once.
+        :param host_connections: Maximum number of images to download at once from any one server.
+        """
+        self.host_connections = host_connections
+        # Threads are only started when images are downloaded, and are then kept for later pages.
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='ImageLoader')
+        # Server (host:port) -> BoundedSemaphore limiting downloads from it.
+        self.host_limits = dict()
+        self.lock = threading.Lock()
+
+    def host_limit(self, source):
+        """
+        :param source: URL of an image.
+        :return: The BoundedSemaphore limiting downloads from the image's server.
+        """
+        netloc = urlsplit(source).netloc
+        with self.lock:
+            limit = self.host_limits.get(netloc)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.host_connections)
+                self.host_limits[netloc] = limit
+            return limit
+
+    def fetch(self, source):
+        """
+        Download an image, waiting if host_connections images are already being downloaded from its server.
+        :param source: URL of the image.
+        :return: The image's data, or None if it couldn't be downloaded.
+        """
+        with self.host_limit(source):
+            try:
+                return httpCache.get(source).body
+            except (OSError, ValueError) as e:
+                print(source, e)
+                return None
+
+    def fetch_images(self, images):
+        """
+        Download images, and store each in its node. Images used more than once are only downloaded once.
+        Images which can't be downloaded are left out, as before.
+        :param images: List of ImgNodes.
+        """
+        sources = list(dict.fromkeys(image.source for image in images if image.source is not None))
+        if len(sources) == 0:
+            return
+        downloaded = dict(zip(sources, self.pool.map(self.fetch, sources)))
+
+        # Stored in page order, on this thread.
+        for image in images:
+            data = downloaded.get(image.source)
+            if data is not None:
+                image.set_image(data)
+
+
+default_image_loader = ImageLoader()
+
+
+def fetch_images(images):
+    """
+    Download images in parallel with the default ImageLoader, and store each in its node.
+    :param images: List of ImgNodes.
+    """
+    default_image_loader.fetch_images(images)
+
+
 def is_void(tag):
     """
     Void tags are those that are not permitted to have children.
@@ -134,6 +764,164 @@ def is_void(tag):
                    'input', 'link', 'meta', 'param', 'source', 'track', 'wbr']
 
 
+class DomIndex:
+    """
+    Finds a page's nodes by tag, id or class without walking the page. GaudyParser adds each node as it is created, so
+    the nodes with each tag (or class) are kept in document order.
+    Nodes removed from the page are removed from the index straight away. Nodes added once the page has loaded can go
+    anywhere in the document, so the index is marked stale and rebuilt (with one walk of the page) when next used.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Tag -> list of nodes with that tag, in document order.
+        self.tags = dict()
+
+        # Id -> first node with that id, in document order. Ids which more than one node has are also kept in
+        # duplicate_ids, since removing the first node then means looking for the next.
+        self.ids = dict()
+        self.duplicate_ids = set()
+
+        # Class -> list of nodes with that class, in document order.
+        self.classes = dict()
+
+        # True if the index no longer matches the page, and must be rebuilt before it is used.
+        self.stale = False
+
+    def entry(self, node):
+        """
+        :param node: A node.
+        :return: What the index keeps for the node (the node itself, but see ArenaIndex).
+        """
+        return node
+
+    def node(self, entry):
+        """
+        :param entry: What the index keeps for a node.
+        :return: The node.
+        """
+        return entry
+
+    def new_list(self):
+        return list()
+
+    def add(self, node):
+        """
+        Add a node which comes after every node already in the index.
+        :param node: The new node.
+        """
+        self.add_to(self.tags, node.tag, node)
+        classes = node.get_attr('class')
+        if classes is not None:
+            for name in set(classes.split()):
+                self.add_to(self.classes, name, node)
+
+        node_id = node.get_attr('id')
+        if node_id is not None:
+            if node_id in self.ids:
+                self.duplicate_ids.add(node_id)
+            else:
+                self.ids[node_id] = self.entry(node)
+
+    def add_to(self, nodes_by_key, key, node):
+        nodes = nodes_by_key.get(key)
+        if nodes is None:
+            nodes = nodes_by_key[key] = self.new_list()
+        nodes.append(self.entry(node))
+
+    def remove(self, node):
+        """
+        Remove a node, and every node inside it.
+        :param node: The node being removed from the page.
+        """
+        removed = list()
+        node.find_nodes(removed, None)
+        gone = set(self.entry(old) for old in removed)
+        self.remove_from(self.tags, set(old.tag for old in removed), gone)
+        self.remove_from(self.classes, set(name for old in removed for name in (old.get_attr('class') or '').split()),
+                         gone)
+        for old in removed:
+            node_id = old.get_attr('id')
+            if node_id is not None and self.ids.get(node_id) == self.entry(old):
+                del self.ids[node_id]
+                if node_id in self.duplicate_ids:
+                    self.stale = True
+
+    def remove_from(self, nodes_by_key, keys, gone):
+        """
+        Remove nodes from some of the lists in tags or classes.
+        :param nodes_by_key: tags or classes.
+        :param keys: The tags or classes the nodes might be listed under.
+        :param gone: Set of entries for the nodes being removed.
+        """
+        for key in keys:
+            nodes = self.new_list()
+            nodes.extend(other for other in nodes_by_key.get(key, ()) if other not in gone)
+            if len(nodes) > 0:
+                nodes_by_key[key] = nodes
+            else:
+                nodes_by_key.pop(key, None)
+
+    def rebuild(self, root):
+        """
+        Index every node in a page again.
+        :param root: The page's root node, or None if the page is empty.
+        """
+        self.clear()
+        if root is not None:
+            nodes = list()
+            root.find_nodes(nodes, None)
+            for node in nodes:
+                self.add(node)
+
+    def find(self, tag):
+        """
+        :param tag: A tag name.
+        :return: List of nodes with the tag, in document order.
+        """
+        return [self.node(entry) for entry in self.tags.get(tag, ())]
+
+    def find_class(self, name):
+        """
+        :param name: A class name.
+        :return: List of nodes with the class, in document order.
+        """
+        return [self.node(entry) for entry in self.classes.get(name, ())]
+
+    def find_id(self, node_id):
+        """
+        :param node_id: A value of the id attribute.
+        :return: The first node with that id, or None.
+        """
+        entry = self.ids.get(node_id)
+        return None if entry is None else self.node(entry)
+
+
+class ArenaIndex(DomIndex):
+    """
+    DomIndex for a page kept in a DomArena. Only node indices are kept (in arrays), and views are made for the nodes
+    which are found.
+    """
+
+    def __init__(self, arena):
+        """
+        :param arena: The DomArena holding the page.
+        """
+        self.arena = arena
+        super().__init__()
+
+    def entry(self, node):
+        return node.index
+
+    def node(self, entry):
+        return self.arena.node(entry)
+
+    def new_list(self):
+        return array('i')
+
+
 class GaudyParser(HTMLParser):
     """
     Specialisation of Python's built-in HTMLParser to convert Html document into an internal representation. This
@@ -147,9 +935,21 @@ class GaudyParser(HTMLParser):
     # Current parent node to which children are being added.
     parent = None
 
-    def __init__(self, url):
+    def __init__(self, url, assets=None):
+        """
+        Create a parser.
+        :param url: Url of the page being parsed, or None if the page is being deserialised.
+        :param assets: AssetStore where images are kept (optional).
+        """
         super().__init__()
         self.url = url
+        self.assets = assets
+
+        # Image nodes, whose images are downloaded once the page has been parsed.
+        self.images = list()
+
+        # Every node, by tag and id.
+        self.index = DomIndex()
 
     def last_child(self):
         if len(self.parent.children) == 0:
@@ -160,23 +960,33 @@ class GaudyParser(HTMLParser):
     def match_last_child(self, tag):
         return self.last_child() is not None and self.last_child().tag == tag
 
-    def handle_starttag(self, tag, attrs):
+    def make_node(self, tag, attrs):
         """
-        Create a tag.
+        Create a node, without adding it to its parent.
         :param tag: Name of tag
         :param attrs: List of key-value pairs of attributes
+        :return: The new node
         """
-        node = None
-
         # Choose which specialisation of HtmlNode to create
         # Unrecognised tags use the base HtmlNode.
         if tag == 'img':
-            node = ImgNode(self.parent, tag, attrs, self.url)
+            return ImgNode(self.parent, tag, attrs, self.url, self.assets)
         else:
-            node = HtmlNode(self.parent, tag, attrs)
+            return HtmlNode(self.parent, tag, attrs)
 
+    def handle_starttag(self, tag, attrs):
+        """
+        Create a tag.
+        :param tag: Name of tag
+        :param attrs: List of key-value pairs of attributes
+        :return: The new node
+        """
+        node = self.make_node(tag, attrs)
         if node is None:
-            return
+            return None
+        if tag == 'img':
+            self.images.append(node)
+        self.index.add(node)
 
         # Add the new node to the parent (if it is not the top-level node)
         if self.parent is not None:
@@ -190,6 +1000,8 @@ class GaudyParser(HTMLParser):
         if self.root is None:
             self.root = node
 
+        return node
+
     def handle_endtag(self, tag):
         """
         Close a tag.
@@ -223,28 +1035,70 @@ class GaudyParser(HTMLParser):
                 self.handle_endtag("data")
 
 
+class ArenaParser(GaudyParser):
+    """
+    GaudyParser which keeps the page in a DomArena, for very large pages.
+    """
+
+    def __init__(self, url, assets=None):
+        super().__init__(url, assets)
+        self.arena = DomArena(url, assets)
+        self.index = ArenaIndex(self.arena)
+
+    def make_node(self, tag, attrs):
+        return self.arena.add(self.parent, tag, attrs)
+
+    def last_child(self):
+        # ArenaNode.children makes a list of every child, so look up the last one directly.
+        return self.arena.node(self.arena.last_children[self.parent.index])
+
+
 class HtmlPage:
     """
     Represents a Html Document.
     """
 
-    def __init__(self, tk_frame):
+    def __init__(self, tk_frame, assets=None, arena=None):
         """
         Create a new HtmlPage. Call load_url or load_data to set the page content.
-        :param tk_frame: The frame to create components and draw in.
+        :param tk_frame: The frame to create components and draw in, or None if the page won't be drawn.
+        :param assets: AssetStore holding the page's images (optional). Images are stored in the page itself if this is
+            None.
+        :param arena: True to keep the page's nodes in a DomArena, False to use HtmlNodes, or None to use a DomArena
+            only for documents larger than ARENA_THRESHOLD.
         """
 
         self.root = None
+        self.index = DomIndex()
         self.title = ""
         self.address = ""
         self.tk_frame = tk_frame
+        self.assets = assets
+        self.arena = arena
 
-        self.renderer = renderer.Renderer(tk_frame)
+        # Used while a page is loaded a piece at a time (see start_stream)
+        self.stream = None
+        self.stream_parser = None
 
+        # Pages without a frame (eg. in a HeadlessConductor) are never drawn, so don't need Tk.
+        self.renderer = None
+        if tk_frame is not None:
+            self.attach(tk_frame)
+
+    def attach(self, tk_frame):
+        """
+        Give a page which was created without a frame somewhere to be drawn. Pages can be loaded on any thread, but
+        must be attached (and drawn) on the Tk thread.
+        :param tk_frame: The frame to create components and draw in.
+        """
+        from src import renderer
+        self.tk_frame = tk_frame
+        self.renderer = renderer.Renderer(tk_frame, self.assets)
         self.setup_mouse_wheel()
 
     def render(self):
-        self.renderer.render(self.root)
+        if self.renderer is not None:
+            self.renderer.render(self.root)
 
     def setup_mouse_wheel(self):
         # Bet you didn't expect this to be so hard.
@@ -260,6 +1114,19 @@ class HtmlPage:
             top.bind_class('scrolly', '<MouseWheel>',
                            lambda e: self.renderer.canvas.yview_scroll(int(e.delta / -60), 'units'))
 
+    def make_parser(self, size, url=None, assets=None):
+        """
+        Create the parser which will build the page.
+        :param size: Size of the document in bytes (0 if it isn't known yet).
+        :param url: As for GaudyParser.
+        :param assets: As for GaudyParser.
+        :return: An ArenaParser or a GaudyParser.
+        """
+        arena = self.arena if self.arena is not None else size > ARENA_THRESHOLD
+        if arena:
+            return ArenaParser(url, assets)
+        return GaudyParser(url, assets)
+
     def finish_loading(self, parser):
         """
         Finalise page loading after a call to load_url or load_data
@@ -268,6 +1135,7 @@ class HtmlPage:
 
         # Set the page root element
         self.root = parser.root
+        self.index = parser.index
 
         # Set the page title. This will be the text of any <title> tags, or the page url if there are none Although
         # multiple <title> tags in one document aren't permitted by the HTML Specification, we handle it by
@@ -287,15 +1155,16 @@ class HtmlPage:
         :param url: The url to fetch the document from.
         """
 
-        # Download the page
-        self.address = url
-        req = request.Request(url, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36 Edg/122.0.0.0'})
-        response = request.urlopen(req)
+        # Download the page. If it was redirected, its images are found relative to where it ended up.
+        response = httpCache.get(url)
+        self.address = response.url
 
         # Create Html Node structure
-        parser = GaudyParser(url)
-        parser.feed(response.read().decode("utf-8"))
+        parser = self.make_parser(len(response.body), response.url, self.assets)
+        parser.feed(response.body.decode("utf-8"))
+
+        # Download the images, all at once
+        fetch_images(parser.images)
 
         # Finalise loading
         self.finish_loading(parser)
@@ -307,74 +1176,215 @@ class HtmlPage:
         """
 
         # Use the deserialiser to recreate the page.
-        parser = GaudyParser(None)
+        parser = self.make_parser(len(data))
         hd = serialiser.HtmlDeserialiser(parser, data)
         self.address = hd.address
 
         # Finalise loading
         self.finish_loading(parser)
 
+    def start_stream(self):
+        """
+        Prepare to load a Html Document from serialised data which arrives a piece at a time. Pass each piece to feed,
+        then call finish_stream. Nodes are drawn as soon as they have been read.
+        """
+        self.stream_parser = self.make_parser(0)
+        self.stream = serialiser.HtmlStreamDeserialiser(self.stream_parser)
+        if self.renderer is not None:
+            self.renderer.begin()
+
+    def feed(self, data):
+        """
+        Load and draw the next piece of a page started with start_stream.
+        :param data: The next piece of serialised data.
+        """
+        self.render_events(self.stream.feed(data))
+        self.root = self.stream_parser.root
+        self.index = self.stream_parser.index
+        if self.stream.address is not None:
+            self.address = self.stream.address
+        if self.stream.title is not None:
+            self.title = self.stream.title
+
+    def finish_stream(self):
+        """
+        Finalise a page loaded with start_stream and feed.
+        """
+        self.render_events(self.stream.close())
+        self.address = self.stream.address
+        self.finish_loading(self.stream_parser)
+        self.stream = None
+        self.stream_parser = None
+
+    def render_events(self, events):
+        """
+        Draw nodes as they are read by a HtmlStreamDeserialiser.
+        :param events: List of (NODE_START or NODE_END, node) pairs
+        """
+        if self.renderer is None:
+            return
+        for event, node in events:
+            if event == serialiser.NODE_START:
+                self.renderer.start_node(node)
+            else:
+                self.renderer.end_node(node)
+        if len(events) > 0:
+            self.renderer.reconfigure_canvas()
+
+    def asset_keys(self):
+        """
+        Find the assets used by the page.
+        :return: List of asset hashes, in page order, without duplicates.
+        """
+        images = list()
+        if self.root is not None:
+            self.root.find_nodes(images, 'img')
+        keys = [image.get_attr('asset') for image in images]
+        return list(dict.fromkeys(key for key in keys if key is not None))
 
     def __str__(self):
         return "[" + str(self.title) + "](" + str(self.address) + ")"
 
+    def get_index(self):
+        """
+        :return: The page's DomIndex, rebuilt first if nodes have been added since it was last used.
+        """
+        if self.index.stale:
+            self.index.rebuild(self.root)
+        return self.index
+
     def find_nodes(self, selector):
         """
         Find all nodes on the page matching selector.
         Selector is a tag name, or None for all nodes
         :param selector: The selector to match
-        :return: A list of matching nodes.
+        :return: A list of matching nodes, in document order.
         """
-        result = list()
-        #self.root.find_nodes(result, selector)
-        return result
+        if selector is None:
+            result = list()
+            if self.root is not None:
+                self.root.find_nodes(result, None)
+            return result
+        return self.get_index().find(selector)
+
+    def find_id(self, node_id):
+        """
+        Find the node with the given id.
+        :param node_id: The id to match
+        :return: The first node with the id, or None.
+        """
+        return self.get_index().find_id(node_id)
+
+    def select(self, text):
+        """
+        Find the nodes on the page matching a CSS selector (see the selector module).
+        :param text: The selector, eg. 'div#content > p a[href]'.
+        :return: List of matching nodes, in document order.
+        """
+        return selector.select(self, text)
 
     def find_children(self, *selectors):
         """
-        Find nodes matching a chain of selectors.
+        Find nodes matching a chain of selectors. Each selector matches nodes inside (or the same as) nodes matching the
+        one before it.
         :param selectors: The selectors to match
-        :return: List of nodes matching the chain.
-        """
-        # result = [self.root]
-        result = []
-        for selector in selectors:
-            scratch = list()
-            for node in result:
-                node.find_nodes(scratch, selector)
-            result = scratch
+        :return: List of nodes matching the chain, in document order.
+        """
+        result = [self.root] if self.root is not None else []
+        for position, selector in enumerate(selectors):
+            if len(result) == 0:
+                break
+            if position == 0:
+                # Every node is inside the root, so the index can be used.
+                result = self.find_nodes(selector)
+                continue
+
+            # Keep the nodes from the index which are inside one matching the selector before, as
+            # ComplexSelector.matches_before does for ancestors.
+            scopes = set(result)
+            known = dict()
+            result = [node for node in self.find_nodes(selector) if is_inside(node, scopes, known)]
         return result
 
+    def add_node(self, parent, node):
+        """
+        Add a node (and any nodes inside it) to the page, after its parent's other children.
+        :param parent: The node to add it to.
+        :param node: The new node, created with parent as its parent.
+        """
+        parent.add_child(node)
+        self.index.stale = True
+
+    def remove_node(self, node):
+        """
+        Remove a node (and every node inside it) from the page, and delete it.
+        :param node: The node to remove.
+        """
+        if node == self.root:
+            self.root = None
+            self.index = DomIndex()
+        else:
+            node.parent.remove_child(node)
+            self.index.remove(node)
+        node.delete()
+
+    def set_attr(self, node, attr, value):
+        """
+        Set an attribute of a node on the page, keeping the index up to date.
+        :param node: The node.
+        :param attr: The attribute's name.
+        :param value: Its new value.
+        """
+        node.set_attr(attr, value)
+        if attr in INDEXED_ATTRIBUTES:
+            self.index.stale = True
+
+    def clear_attr(self, node, attr):
+        """
+        Remove an attribute from a node on the page, keeping the index up to date.
+        :param node: The node.
+        :param attr: The attribute's name.
+        """
+        node.clear_attr(attr)
+        if attr in INDEXED_ATTRIBUTES:
+            self.index.stale = True
+
     def delete(self):
         """
         HtmlNodes contain a reference to their pointer, preventing them from being cleaned up by Python's garbage
         collector (which uses reference counting). Call this to clear this parent reference. Likewise destroy the Tk
-        elements associated with the page. :return:
+        elements associated with the page. Pages kept in a DomArena simply drop its arrays. :return:
         """
         if self.tk_frame is not None:
             self.tk_frame.destroy()
         if self.root is not None:
             self.root.delete()
+        self.index = DomIndex()
 
 
-def create_page_from_url(url, frame):
+def create_page_from_url(url, frame, assets=None, arena=None):
     """
     Create a page object from the given url, in the given frame.
     :param url: The url to access the page data.
     :param frame: The Tk frame to draw the page into.
+    :param assets: AssetStore to keep the page's images in (optional).
+    :param arena: Whether to keep the page in a DomArena (see HtmlPage).
     :return: An HtmlPage object.
     """
-    page = HtmlPage(frame)
+    page = HtmlPage(frame, assets, arena)
     page.load_url(url)
     return page
 
 
-def deserialise_page(data, frame):
+def deserialise_page(data, frame, assets=None, arena=None):
     """
     Recreate a html page from serialised data.
     :param data: The saved page data.
     :param frame: The Tk frame to draw the page into.
+    :param assets: AssetStore holding the images the page refers to (optional).
+    :param arena: Whether to keep the page in a DomArena (see HtmlPage).
     :return: An HtmlPage object.
     """
-    page = HtmlPage(frame)
+    page = HtmlPage(frame, assets, arena)
     page.load_data(data)
     return page
\ No newline at end of file
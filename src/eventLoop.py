@@ -0,0 +1,239 @@
+import selectors
+import socket
+import sys
+from collections import deque
+
+# Milliseconds between checks when Tk can't watch sockets directly.
+POLL_INTERVAL = 5
+
+
+class EventLoop:
+    """
+    Calls handlers as soon as sockets are ready, using the selectors module.
+    Use this when there is no Tk window, and call run_forever (or run_once) to process events.
+    """
+
+    def __init__(self):
+        # Socket -> [file descriptor, reader callback, writer callback]
+        # The descriptor is saved because closed sockets no longer report it.
+        self.handlers = dict()
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+
+        # Callbacks waiting to be called once the sockets which are ready have been handled.
+        self.callbacks = list()
+
+        # Callbacks added by other threads, and a pair of connected sockets used to wake the loop when one is added.
+        self.thread_callbacks = deque()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.add_reader(self.wake_reader, self.woken)
+
+    def add_reader(self, sock, callback) -> None:
+        """
+        Call callback() whenever sock has data to read (or has been closed by the remote).
+        :param sock: The socket to watch.
+        :param callback: Function taking no arguments.
+        """
+        self.set_handler(sock, 1, callback)
+
+    def remove_reader(self, sock) -> None:
+        """
+        Stop watching a socket for data to read. It is safe to call this after the socket has been closed.
+        :param sock: The socket to stop watching.
+        """
+        self.set_handler(sock, 1, None)
+
+    def add_writer(self, sock, callback) -> None:
+        """
+        Call callback() whenever more data can be written to sock.
+        :param sock: The socket to watch.
+        :param callback: Function taking no arguments.
+        """
+        self.set_handler(sock, 2, callback)
+
+    def remove_writer(self, sock) -> None:
+        """
+        Stop watching a socket for space to write. It is safe to call this after the socket has been closed.
+        :param sock: The socket to stop watching.
+        """
+        self.set_handler(sock, 2, None)
+
+    def call_soon(self, callback) -> None:
+        """
+        Call callback() once the handlers for every socket which is ready now have been called.
+        :param callback: Function taking no arguments.
+        """
+        self.callbacks.append(callback)
+
+    def call_soon_threadsafe(self, callback) -> None:
+        """
+        Call callback() from the event loop's thread. Unlike the other methods, this may be called from any thread.
+        :param callback: Function taking no arguments.
+        """
+        self.thread_callbacks.append(callback)
+        try:
+            self.wake_writer.send(b'\x00')
+        except OSError:
+            # The socket is full, so the loop will be woken anyway.
+            pass
+
+    def woken(self) -> None:
+        """
+        Call the callbacks added by other threads. Called by the event loop when it has been woken.
+        """
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while len(self.thread_callbacks) > 0:
+            self.call_soon(self.thread_callbacks.popleft())
+
+    def run_callbacks(self) -> None:
+        """
+        Call the callbacks added by call_soon. Callbacks added while these run wait for the next time.
+        """
+        callbacks = self.callbacks
+        self.callbacks = list()
+        for callback in callbacks:
+            callback()
+
+    def set_handler(self, sock, index, callback) -> None:
+        """
+        Change the reader or writer for a socket, and update what is being watched.
+        :param sock: The socket.
+        :param index: 1 for the reader, 2 for the writer.
+        :param callback: The new handler, or None to remove it.
+        """
+        if sock not in self.handlers:
+            if callback is None:
+                return
+            self.handlers[sock] = [sock.fileno(), None, None]
+        else:
+            self.unwatch(sock)
+
+        handler = self.handlers[sock]
+        handler[index] = callback
+        if handler[1] is None and handler[2] is None:
+            del self.handlers[sock]
+        else:
+            self.watch(sock)
+
+    def watch(self, sock) -> None:
+        events = 0
+        if self.handlers[sock][1] is not None:
+            events |= selectors.EVENT_READ
+        if self.handlers[sock][2] is not None:
+            events |= selectors.EVENT_WRITE
+        self.selector.register(sock, events)
+
+    def unwatch(self, sock) -> None:
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def dispatch(self, sock, readable: bool, writable: bool) -> None:
+        """
+        Call the handlers for a socket which is ready.
+        :param sock: The ready socket.
+        :param readable: True if there is data to read.
+        :param writable: True if there is space to write.
+        """
+        # Handlers may remove each other, so look them up each time.
+        if writable and sock in self.handlers and self.handlers[sock][2] is not None:
+            self.handlers[sock][2]()
+        if readable and sock in self.handlers and self.handlers[sock][1] is not None:
+            self.handlers[sock][1]()
+
+    def run_once(self, timeout: float = None) -> None:
+        """
+        Wait for sockets to be ready and call their handlers.
+        :param timeout: Maximum time to wait in seconds, or None to wait indefinitely.
+        """
+        if len(self.handlers) > 0:
+            # Don't wait if there are callbacks to call.
+            for key, events in self.selector.select(0 if len(self.callbacks) > 0 else timeout):
+                self.dispatch(key.fileobj, bool(events & selectors.EVENT_READ), bool(events & selectors.EVENT_WRITE))
+        self.run_callbacks()
+
+    def run_forever(self) -> None:
+        """
+        Process events until stop() is called.
+        """
+        self.running = True
+        while self.running:
+            self.run_once(POLL_INTERVAL / 1000 if len(self.handlers) == 0 else None)
+
+    def stop(self) -> None:
+        self.running = False
+
+
+class TkEventLoop(EventLoop):
+    """
+    Calls handlers from the Tk main loop as soon as sockets are ready.
+    Tk watches the sockets itself where it can (not on Windows). Otherwise the sockets are checked every few
+    milliseconds.
+    """
+
+    def __init__(self, window):
+        """
+        Create an event loop attached to a Tk window.
+        :param window: The top-level Tk window, whose mainloop will run the handlers.
+        """
+        # Imported here so that EventLoop can be used on machines without Tk.
+        import tkinter
+
+        # Set before EventLoop starts watching its own sockets.
+        self.window = window
+        self.readable = tkinter.READABLE
+        self.writable = tkinter.WRITABLE
+        self.file_handlers = sys.platform != 'win32' and hasattr(window.tk, 'createfilehandler')
+        self.polling = False
+        super().__init__()
+
+    def watch(self, sock) -> None:
+        if self.file_handlers:
+            mask = 0
+            if self.handlers[sock][1] is not None:
+                mask |= self.readable
+            if self.handlers[sock][2] is not None:
+                mask |= self.writable
+            self.window.tk.createfilehandler(self.handlers[sock][0], mask,
+                                             lambda file, ready: self.dispatch(sock, bool(ready & self.readable),
+                                                                               bool(ready & self.writable)))
+        else:
+            super().watch(sock)
+            if not self.polling:
+                self.polling = True
+                self.window.after(POLL_INTERVAL, self.poll)
+
+    def call_soon(self, callback) -> None:
+        # Tk calls idle callbacks once it has handled the events which are waiting.
+        if len(self.callbacks) == 0:
+            self.window.after_idle(self.run_callbacks)
+        super().call_soon(callback)
+
+    def unwatch(self, sock) -> None:
+        if self.file_handlers:
+            self.window.tk.deletefilehandler(self.handlers[sock][0])
+        else:
+            super().unwatch(sock)
+
+    def poll(self) -> None:
+        """
+        Check the sockets without waiting, then schedule another check.
+        """
+        self.run_once(0)
+        if len(self.handlers) > 0:
+            self.window.after(POLL_INTERVAL, self.poll)
+        else:
+            self.polling = False
+
+    def run_forever(self) -> None:
+        self.window.mainloop()
+
+    def stop(self) -> None:
+        self.window.quit()
@@ -0,0 +1,47 @@
+import argparse
+
+from eventLoop import EventLoop
+from session import Session, HOST, PORT
+
+
+class HeadlessConductor(Session):
+    """
+    A Conductor without a window, for running sessions on servers and driving them from scripts.
+    Pages are loaded, serialised and sent to collaborators exactly as by Conductor, but are never drawn, and Tk is not
+    needed. Navigate with go, back and forward, and call run (or loop.run_once) to handle network events.
+    """
+
+    def __init__(self, cid='Conductor', home=None, host=HOST, port=PORT, loop=None):
+        """
+        Create a HeadlessConductor and start accepting collaborators.
+        :param cid: The session name, sent to collaborators in the greeting.
+        :param home: Url of the first page to load (optional).
+        :param host: Address to listen on.
+        :param port: Port to listen on (0 to choose any free port).
+        :param loop: EventLoop to use. A new one is created if this is None.
+        """
+        super().__init__(cid, loop if loop is not None else EventLoop())
+        if home is not None:
+            self.go_to_page(home)
+        self.address = self.listen(host, port)
+
+    def run(self):
+        """
+        Handle network events until stop() is called.
+        """
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a Gaudy conductor without a window.')
+    parser.add_argument('home', help='url of the first page')
+    parser.add_argument('--host', default=HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on')
+    arguments = parser.parse_args()
+
+    conductor = HeadlessConductor('Conductor', arguments.home, arguments.host, arguments.port)
+    print('Listening on', conductor.address)
+    conductor.run()
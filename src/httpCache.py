@@ -0,0 +1,333 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from http.client import HTTPMessage
+
+import httpClient
+from pageCache import PageCache
+
+# Default maximum size of the responses kept in memory, and on disk, in bytes.
+MEMORY_SIZE = 32 * 1024 * 1024
+DISK_SIZE = 256 * 1024 * 1024
+
+# Response headers kept with cached responses.
+KEPT_HEADERS = ('Content-Type', 'Cache-Control', 'Expires', 'ETag', 'Last-Modified')
+
+# The index of responses on disk is written after this many responses have been moved to disk, or this many seconds
+# after it was last written (and by close).
+INDEX_BATCH = 64
+INDEX_INTERVAL = 30
+
+
+def parse_cache_control(value):
+    """
+    Split a Cache-Control header into its directives.
+    :param value: The header value, or None.
+    :return: Dictionary of directive names (lower case) and values (None for directives without one).
+    """
+    directives = dict()
+    if value is None:
+        return directives
+    for item in value.split(','):
+        name, sep, argument = item.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if sep else None
+    return directives
+
+
+def parse_date(value):
+    """
+    Read a HTTP date.
+    :param value: The date, or None.
+    :return: Seconds since the epoch, or None if there is no (valid) date.
+    """
+    if value is None:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class CacheEntry:
+    """
+    A cached response, and what is needed to decide whether it can still be used.
+    """
+
+    def __init__(self, url, body, headers, stored):
+        """
+        :param url: The url the response came from (after any redirects).
+        :param body: The response body.
+        :param headers: Dictionary of the response headers in KEPT_HEADERS.
+        :param stored: When the response was received or last revalidated, in seconds since the epoch.
+        """
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.stored = stored
+
+    @staticmethod
+    def from_response(response, now):
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if response.headers.get(name) is not None}
+        entry = CacheEntry(response.url, response.body, headers, now)
+        # Allow for time the response has already spent in other caches.
+        try:
+            entry.stored -= int(response.headers.get('Age', 0))
+        except ValueError:
+            pass
+        return entry
+
+    @property
+    def lifetime(self):
+        """
+        How long the response is fresh for, in seconds (None if the server didn't say).
+        """
+        directives = parse_cache_control(self.headers.get('Cache-Control'))
+        if 'no-cache' in directives:
+            return 0
+        if 'max-age' in directives:
+            try:
+                return int(directives['max-age'])
+            except (TypeError, ValueError):
+                return 0
+        expires = parse_date(self.headers.get('Expires'))
+        if expires is not None:
+            return expires - self.stored
+        return None
+
+    @property
+    def storable(self):
+        """
+        True if the response may be cached: it mustn't forbid it, and must be fresh for a while or have a validator.
+        """
+        if 'no-store' in parse_cache_control(self.headers.get('Cache-Control')):
+            return False
+        return (self.lifetime or 0) > 0 or len(self.validators()) > 0
+
+    def fresh(self, now):
+        lifetime = self.lifetime
+        return lifetime is not None and now - self.stored < lifetime
+
+    def validators(self):
+        """
+        Headers for a conditional request, which the server answers with 304 Not Modified if the response hasn't
+        changed.
+        :return: Dictionary of request headers (empty if the response can't be revalidated).
+        """
+        headers = dict()
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def revalidated(self, response, now):
+        """
+        Make an updated copy of the entry from a 304 Not Modified response. The entry itself isn't changed, as other
+        threads may be using it.
+        :param response: The response to the conditional request.
+        :param now: The current time.
+        :return: The new CacheEntry.
+        """
+        headers = dict(self.headers)
+        for name in KEPT_HEADERS:
+            if response.headers.get(name) is not None:
+                headers[name] = response.headers[name]
+        return CacheEntry(self.url, self.body, headers, now)
+
+    def response(self):
+        headers = HTTPMessage()
+        for name, value in self.headers.items():
+            headers[name] = value
+        return httpClient.Response(self.url, 200, 'OK', headers, self.body)
+
+
+class HttpCache:
+    """
+    Keeps responses to GET requests, so that pages and images which were visited recently aren't downloaded again.
+    Responses are used without asking the server while they are fresh (Cache-Control max-age, or Expires), and are
+    revalidated with a conditional request (ETag, Last-Modified) after that. The least recently used responses are
+    removed first, to a directory on disk if one is given.
+    Safe to use from many threads at once.
+    """
+
+    def __init__(self, size=MEMORY_SIZE, directory=None, disk_size=DISK_SIZE, client=None):
+        """
+        Create an empty cache.
+        :param size: Maximum total size of the responses kept in memory, in bytes.
+        :param directory: Where to keep responses which don't fit in memory, between sessions (optional).
+        :param disk_size: Maximum total size of the responses kept on disk, in bytes.
+        :param client: HttpClient used to make requests. The shared client is used if this is None.
+        """
+        self.size = size
+        self.used = 0
+        self.client = client if client is not None else httpClient.default_client
+        self.lock = threading.Lock()
+
+        # Url -> CacheEntry, least recently used first.
+        self.entries = OrderedDict()
+
+        # Responses on disk: the bodies are kept in a PageCache (by hash), and everything else in an index file.
+        self.directory = directory
+        self.bodies = None
+        self.index = dict()
+        # Responses moved to disk since the index was last written, and when that was.
+        self.unsaved = 0
+        self.saved_at = time.time()
+        if directory is not None:
+            self.bodies = PageCache(os.path.join(directory, 'bodies'), disk_size)
+            try:
+                with open(self.index_path(), 'r', encoding='utf-8') as file:
+                    self.index = json.load(file)
+            except (OSError, ValueError):
+                self.index = dict()
+
+        # Requests answered from the cache without the network, answered after a conditional request, and downloaded.
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def get(self, url, headers=None):
+        """
+        Fetch a url, from the cache if possible.
+        :param url: The url to fetch.
+        :param headers: Extra request headers (optional).
+        :return: The Response. Error statuses raise httpClient.HttpError, as for HttpClient.get.
+        """
+        now = time.time()
+        entry = self.lookup(url)
+        if entry is not None and entry.fresh(now):
+            with self.lock:
+                self.hits += 1
+            return entry.response()
+
+        request_headers = dict(headers) if headers is not None else dict()
+        if entry is not None:
+            request_headers.update(entry.validators())
+        response = self.client.get(url, request_headers)
+
+        now = time.time()
+        if response.status == 304 and entry is not None:
+            with self.lock:
+                entry = entry.revalidated(response, now)
+                self.revalidated += 1
+            self.store(url, entry)
+            return entry.response()
+
+        with self.lock:
+            self.misses += 1
+        if response.status == 200:
+            entry = CacheEntry.from_response(response, now)
+            if entry.storable:
+                self.store(url, entry)
+            else:
+                self.remove(url)
+        return response
+
+    def lookup(self, url):
+        """
+        Find a cached response, in memory or on disk.
+        :param url: The url requested.
+        :return: The CacheEntry, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+                return entry
+            saved = self.index.get(url)
+        if saved is None:
+            return None
+
+        body = self.bodies.get(saved['body'])
+        if body is None:
+            # Removed to make room
+            with self.lock:
+                self.index.pop(url, None)
+            return None
+        entry = CacheEntry(saved['url'], body, saved['headers'], saved['stored'])
+        self.store(url, entry)
+        return entry
+
+    def store(self, url, entry):
+        """
+        Keep a response in memory, moving the least recently used responses to disk (if there is one) to make room.
+        :param url: The url requested.
+        :param entry: The CacheEntry.
+        """
+        with self.lock:
+            old = self.entries.pop(url, None)
+            if old is not None:
+                self.used -= len(old.body)
+            self.entries[url] = entry
+            self.used += len(entry.body)
+
+            evicted = list()
+            while self.used > self.size and len(self.entries) > 1:
+                old_url, old = self.entries.popitem(last=False)
+                self.used -= len(old.body)
+                evicted.append((old_url, old))
+
+        if self.bodies is not None and len(evicted) > 0:
+            for old_url, old in evicted:
+                key = hashlib.sha256(old.body).hexdigest()
+                self.bodies.put(key, old.body)
+                with self.lock:
+                    self.index[old_url] = {'url': old.url, 'body': key, 'headers': old.headers, 'stored': old.stored}
+            with self.lock:
+                self.unsaved += len(evicted)
+                due = self.unsaved >= INDEX_BATCH or time.time() - self.saved_at >= INDEX_INTERVAL
+            if due:
+                self.save_index()
+
+    def remove(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is not None:
+                self.used -= len(entry.body)
+            self.index.pop(url, None)
+
+    def close(self):
+        """
+        Write the index of responses on disk, if it has changed since it was last written. Call this when the cache is
+        no longer needed, or responses moved to disk since then will be forgotten.
+        """
+        if self.directory is not None and self.unsaved > 0:
+            self.save_index()
+
+    def save_index(self):
+        """
+        Write the index of responses on disk, leaving out those whose bodies have been removed to make room.
+        """
+        temporary = self.index_path() + '.tmp'
+        with self.lock:
+            self.unsaved = 0
+            self.saved_at = time.time()
+            self.index = {url: saved for url, saved in self.index.items() if saved['body'] in self.bodies}
+            try:
+                with open(temporary, 'w', encoding='utf-8') as file:
+                    json.dump(self.index, file)
+                os.replace(temporary, self.index_path())
+            except OSError as e:
+                print(e)
+
+
+# Cache shared by everything which loads pages. It is kept in memory only.
+default_cache = HttpCache()
+
+
+def get(url, headers=None):
+    """
+    Fetch a url with the shared cache.
+    :param url: The url to fetch.
+    :param headers: Extra request headers (optional).
+    :return: The Response. Error statuses raise httpClient.HttpError.
+    """
+    return default_cache.get(url, headers)
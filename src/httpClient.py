@@ -0,0 +1,229 @@
+import http.client
+import ssl
+import threading
+import urllib.request
+from urllib.parse import urlsplit, urljoin
+
+# Most idle connections kept open to each server, for later requests to reuse.
+POOL_SIZE = 4
+
+# Seconds to wait for a server to respond.
+TIMEOUT = 10
+
+# Most redirects followed for one request.
+MAX_REDIRECTS = 10
+
+# Responses which send the client somewhere else.
+REDIRECTS = (301, 302, 303, 307, 308)
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/122.0.0.0 Safari/537.36 Edg/122.0.0.0')
+
+
+class HttpError(OSError):
+    """
+    A request failed: the server responded with an error status, or didn't respond properly.
+    """
+
+    def __init__(self, url, status, reason):
+        """
+        :param url: The url requested.
+        :param status: The HTTP status, or None if there wasn't a valid response.
+        :param reason: Description of the problem.
+        """
+        super().__init__(f'{url}: {status} {reason}' if status is not None else f'{url}: {reason}')
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+class Response:
+    """
+    A complete response to a GET request.
+    """
+
+    def __init__(self, url, status, reason, headers, body):
+        """
+        :param url: The url the response came from, after any redirects.
+        :param status: The HTTP status.
+        :param reason: The HTTP reason phrase.
+        :param headers: The response headers (an http.client.HTTPMessage).
+        :param body: The response body.
+        """
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class HttpClient:
+    """
+    Makes GET requests, keeping connections open so that later requests to the same server don't have to connect (and
+    negotiate TLS) again. Safe to use from many threads at once: each request has a connection to itself.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT, max_redirects=MAX_REDIRECTS):
+        """
+        Create a client with no open connections.
+        :param pool_size: Most idle connections kept open to each server.
+        :param timeout: Seconds to wait for a server to respond.
+        :param max_redirects: Most redirects followed for one request.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.ssl_context = ssl.create_default_context()
+
+        # (scheme, host, port) -> list of idle connections
+        self.idle = dict()
+        self.lock = threading.Lock()
+
+        # Number of connections opened, and of requests which reused one.
+        self.connections = 0
+        self.reused = 0
+
+    def get(self, url, headers=None):
+        """
+        Fetch a url, following redirects.
+        :param url: The url to fetch.
+        :param headers: Extra request headers (optional).
+        :return: The Response. Error statuses (400 and above) raise HttpError instead.
+        """
+        for _ in range(self.max_redirects + 1):
+            response = self.request(url, headers)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECTS or location is None:
+                if response.status >= 400:
+                    raise HttpError(url, response.status, response.reason)
+                return response
+            url = urljoin(url, location)
+        raise HttpError(url, response.status, 'Too many redirects')
+
+    def request(self, url, headers=None):
+        """
+        Make one GET request, on an idle connection to the server if there is one. Other kinds of url (such as file:)
+        are opened by urllib instead.
+        :param url: The url to fetch.
+        :param headers: Extra request headers (optional).
+        :return: The Response, whatever its status.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            return self.open(url)
+        if not parts.hostname:
+            raise ValueError(f'unknown url type: {url}')
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+        request_headers = {'User-Agent': USER_AGENT}
+        if headers is not None:
+            request_headers.update(headers)
+
+        connection, reused = self.take(key)
+        try:
+            return self.send(url, key, connection, path, request_headers)
+        except OSError:
+            if not reused:
+                raise
+        # The server may have closed the idle connection. Try again on a new one.
+        return self.send(url, key, self.connect(key), path, request_headers)
+
+    def send(self, url, key, connection, path, headers):
+        """
+        Send a request on a connection and read the whole response. The connection is kept for reuse if possible.
+        :param url: The url being fetched.
+        :param key: (scheme, host, port)
+        :param connection: The connection to use.
+        :param path: The path (and query) to request.
+        :param headers: The request headers.
+        :return: The Response.
+        """
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+        except http.client.HTTPException as e:
+            connection.close()
+            raise HttpError(url, None, str(e) or type(e).__name__) from e
+        except OSError:
+            connection.close()
+            raise
+
+        self.give(key, connection, response)
+        return Response(url, response.status, response.reason, response.headers, body)
+
+    def open(self, url):
+        """
+        Fetch a url which isn't http or https with urllib.
+        :param url: The url to fetch.
+        :return: The Response.
+        """
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            body = response.read()
+            # Only http responses have a status. Anything else which opened has succeeded.
+            status = response.status or 200
+            return Response(url, status, getattr(response, 'reason', 'OK'), response.headers, body)
+
+    def take(self, key):
+        """
+        Find a connection to a server, opening one if none are idle.
+        :param key: (scheme, host, port)
+        :return: The connection, and True if it has been used before.
+        """
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+        return self.connect(key), False
+
+    def connect(self, key):
+        scheme, host, port = key
+        with self.lock:
+            self.connections += 1
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def give(self, key, connection, response):
+        """
+        Keep a connection for reuse once a request has finished with it, unless the server is closing it.
+        :param key: (scheme, host, port)
+        :param connection: The connection.
+        :param response: The response just read from it.
+        """
+        if response.will_close:
+            connection.close()
+            return
+        with self.lock:
+            idle = self.idle.setdefault(key, list())
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        with self.lock:
+            idle = self.idle
+            self.idle = dict()
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+# Client shared by everything which loads pages.
+default_client = HttpClient()
+
+
+def get(url, headers=None):
+    """
+    Fetch a url with the shared client, following redirects.
+    :param url: The url to fetch.
+    :param headers: Extra request headers (optional).
+    :return: The Response. Error statuses raise HttpError.
+    """
+    return default_client.get(url, headers)
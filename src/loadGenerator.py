@@ -0,0 +1,419 @@
+import argparse
+import functools
+import http.server
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+import delta
+import serialiser
+from eventLoop import EventLoop
+from headless import HeadlessConductor
+from messageProtocol import MessageProtocol, FEATURES, NO_PAGE
+from messageType import *
+
+# Pages used when the load generator runs its own conductor.
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testing', 'HTML')
+
+# Operations issued by the simulated collaborators, and how often each is chosen by default.
+NAVIGATE = 'navigate'
+BACK = 'back'
+FORWARD = 'forward'
+MIX = {NAVIGATE: 0.8, BACK: 0.1, FORWARD: 0.1}
+
+# Seconds to wait for the response to an operation before giving up on it.
+TIMEOUT = 5.0
+
+# Percentiles included in the report.
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: list, p: float) -> float | None:
+    """
+    Find a percentile of some measurements, using the nearest rank method.
+    :param values: The measurements, sorted.
+    :param p: The percentile (0-100).
+    :return: The measurement at that percentile, or None if there are none.
+    """
+    if len(values) == 0:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def find_pages(directory: str) -> list:
+    """
+    List the Html documents in a directory.
+    :param directory: Where to look (including sub-directories).
+    :return: Paths relative to the directory, using '/', sorted so that the order is always the same.
+    """
+    pages = list()
+    for parent, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith('.html'):
+                pages.append(os.path.relpath(os.path.join(parent, name), directory).replace(os.sep, '/'))
+    return sorted(pages)
+
+
+def serve_directory(directory: str) -> tuple[http.server.HTTPServer, str]:
+    """
+    Serve a directory over http from a background thread.
+    :param directory: The directory to serve.
+    :return: The server, and the base url of the directory.
+    """
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        # Keep connections open, like most web servers.
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                             functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/'
+
+
+class SimulatedCollaborator:
+    """
+    A collaborator without a window. It keeps the current page (so that deltas can be applied) and times how long the
+    Conductor takes to respond to its navigation.
+    """
+
+    def __init__(self, number: int, address: tuple, loop: EventLoop, rng: random.Random, features: tuple,
+                 think: float):
+        """
+        Connect to a Conductor.
+        :param number: Identifies the collaborator in its greeting.
+        :param address: The Conductor's (host, port).
+        :param loop: EventLoop which handles the connection.
+        :param rng: Chooses this collaborator's operations, and the pauses between them.
+        :param features: Optional protocol features to advertise.
+        :param think: Average pause between operations, in seconds.
+        """
+        self.rng = rng
+        self.think = think
+        self.loop = loop
+        self.connection = socket.create_connection(address)
+        self.connection.setblocking(False)
+        self.protocol = MessageProtocol(self.connection, f'load{number}', loop=loop, features=features)
+        loop.add_reader(self.connection, self.check_network)
+
+        self.page_data = None
+        self.stream = None
+        self.last_navigation = None
+
+        # Operation waiting for a response: (operation, url, time sent), or None.
+        self.waiting = None
+        # True once the Conductor's notice of the url being navigated to has arrived.
+        self.notified = False
+        # True if a notice of some other url arrived first.
+        self.other_notice = False
+        self.next_operation = 0.0
+        self.operations = 0
+
+        # Measurements
+        self.latencies = list()
+        self.timeouts = list()
+        self.superseded = list()
+        self.messages = 0
+        self.bytes = 0
+
+    @property
+    def ready(self) -> bool:
+        """
+        True once the first page has arrived.
+        """
+        return self.page_data is not None
+
+    def issue(self, operation: str, url: str, now: float) -> None:
+        """
+        Send an operation to the Conductor.
+        :param operation: NAVIGATE, BACK or FORWARD.
+        :param url: The page to navigate to (ignored for BACK and FORWARD).
+        :param now: The current time, from time.perf_counter.
+        """
+        self.operations += 1
+        self.waiting = (operation, url, now)
+        self.notified = False
+        self.other_notice = False
+        if operation == NAVIGATE:
+            self.protocol.navigate(url)
+        elif operation == BACK:
+            self.protocol.back()
+        else:
+            self.protocol.forward()
+
+    def finish(self, now: float) -> None:
+        """
+        Stop waiting for the current operation, and choose when to issue the next one.
+        :param now: The current time, from time.perf_counter.
+        """
+        self.waiting = None
+        self.next_operation = now + self.rng.uniform(0, 2 * self.think)
+
+    def check_timeout(self, now: float, timeout: float) -> None:
+        if self.waiting is not None and now - self.waiting[2] > timeout:
+            self.timeouts.append(self.waiting[0])
+            self.finish(now)
+
+    def check_network(self) -> None:
+        """
+        Process messages from the Conductor.
+        """
+        for m in self.protocol.receive():
+            self.messages += 1
+            if m.data is not None:
+                self.bytes += len(m.data)
+
+            if m.message_type in (MESSAGE_DISCONNECTED, MESSAGE_INVALID, MESSAGE_TIMEOUT):
+                self.loop.remove_reader(self.connection)
+                self.loop.remove_writer(self.connection)
+                return
+            elif m.message_type == MESSAGE_NAVIGATION:
+                self.last_navigation = m.text()
+                self.check_superseded()
+            elif m.message_type == MESSAGE_PAGEDATA:
+                self.page_arrived(bytes(m.data))
+            elif m.message_type == MESSAGE_PAGEDELTA:
+                try:
+                    self.page_arrived(delta.apply(self.page_data, m.data))
+                except delta.DeltaError:
+                    self.page_arrived(None)
+                    # As a collaborator does, ask for the whole page.
+                    self.protocol.pagerequest(delta.target_hash(m.data), NO_PAGE)
+            elif m.message_type == MESSAGE_PAGESTART:
+                self.stream = list()
+            elif m.message_type == MESSAGE_PAGECHUNK and self.stream is not None:
+                self.stream.append(bytes(m.data))
+            elif m.message_type == MESSAGE_PAGEEND and self.stream is not None:
+                self.page_arrived(b''.join(self.stream))
+                self.stream = None
+            elif m.message_type == MESSAGE_PAGEAVAILABLE:
+                # Simulated collaborators have no page cache.
+                current = NO_PAGE if self.page_data is None else serialiser.page_hash(self.page_data)
+                self.protocol.pagerequest(bytes(m.data), current)
+            elif m.message_type == MESSAGE_ASSET:
+                self.protocol.assetack(bytes(m.data[0:32]).hex())
+
+    def check_superseded(self) -> None:
+        """
+        Stop waiting for a navigation if the Conductor has moved on to another page (eg. because another
+        collaborator navigated) before sending it.
+        """
+        if self.waiting is None or self.waiting[0] != NAVIGATE:
+            return
+        if self.last_navigation == self.waiting[1]:
+            self.notified = True
+        elif self.notified:
+            self.superseded.append(self.waiting[0])
+            self.finish(time.perf_counter())
+        else:
+            # Perhaps the Conductor has chosen another collaborator's navigation over this one.
+            self.other_notice = True
+
+    def page_arrived(self, page_data: bytes | None) -> None:
+        """
+        Record a new page, and the response time if it answers the operation being waited for.
+        A navigation is answered by the page following the Conductor's notice of that url. Back and forward don't
+        name a page, so are answered by the next page.
+        :param page_data: The serialised page, or None if it couldn't be rebuilt.
+        """
+        now = time.perf_counter()
+        if page_data is not None:
+            self.page_data = page_data
+        if self.waiting is None:
+            return
+        operation, url, sent = self.waiting
+        if operation != NAVIGATE or url == self.last_navigation:
+            self.latencies.append((operation, now - sent))
+            self.finish(now)
+        elif self.other_notice and not self.notified:
+            # Navigations arriving together are coalesced, and only the latest is carried out.
+            self.superseded.append(operation)
+            self.finish(now)
+
+
+class LoadGenerator:
+    """
+    Simulates many collaborators using one Conductor, and reports how quickly it responds.
+    Each collaborator repeatedly chooses an operation (navigate, back or forward), waits for the Conductor to respond,
+    then pauses. Choices are made with a seeded random number generator, so runs are repeatable.
+    """
+
+    def __init__(self, address: tuple, urls: list, clients: int = 10, operations: int = 20, mix: dict = None,
+                 think: float = 0.05, seed: int = 0, timeout: float = TIMEOUT, features: tuple = FEATURES,
+                 loop: EventLoop = None):
+        """
+        :param address: The Conductor's (host, port).
+        :param urls: Pages to navigate to.
+        :param clients: Number of simulated collaborators.
+        :param operations: Number of operations issued by each collaborator.
+        :param mix: Relative frequency of each operation.
+        :param think: Average pause between operations, in seconds.
+        :param seed: Random number generator seed.
+        :param timeout: Seconds to wait for a response.
+        :param features: Protocol features advertised by the simulated collaborators.
+        :param loop: EventLoop to use, eg. one shared with a HeadlessConductor. A new one is created if this is None.
+        """
+        self.address = address
+        self.urls = urls
+        self.clients = clients
+        self.operations = operations
+        self.mix = mix if mix is not None else MIX
+        self.think = think
+        self.seed = seed
+        self.timeout = timeout
+        self.features = features
+        self.loop = loop if loop is not None else EventLoop()
+
+    def run(self) -> dict:
+        """
+        Connect the simulated collaborators, wait for each of them to receive the first page, then issue operations.
+        :return: The report (see report).
+        """
+        collaborators = [SimulatedCollaborator(i, self.address, self.loop, random.Random(f'{self.seed}:{i}'),
+                                               self.features, self.think)
+                         for i in range(self.clients)]
+        deadline = time.perf_counter() + self.timeout
+        while not all(c.ready for c in collaborators) and time.perf_counter() < deadline:
+            self.loop.run_once(0.01)
+
+        operations = list(self.mix)
+        weights = [self.mix[o] for o in operations]
+        start = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            busy = False
+            for c in collaborators:
+                c.check_timeout(now, self.timeout)
+                if c.waiting is None and c.operations < self.operations:
+                    busy = True
+                    if now >= c.next_operation:
+                        operation = c.rng.choices(operations, weights)[0]
+                        c.issue(operation, self.urls[c.rng.randrange(len(self.urls))], now)
+                elif c.waiting is not None:
+                    busy = True
+            if not busy:
+                break
+            self.loop.run_once(0.001)
+        duration = time.perf_counter() - start
+
+        for c in collaborators:
+            self.loop.remove_reader(c.connection)
+            self.loop.remove_writer(c.connection)
+            c.connection.close()
+        return self.report(collaborators, duration)
+
+    def report(self, collaborators: list, duration: float) -> dict:
+        """
+        Summarise the measurements.
+        :param collaborators: The simulated collaborators.
+        :param duration: Seconds taken to issue every operation.
+        :return: Dictionary of settings, totals, throughput, and latency percentiles (in milliseconds) by operation.
+        """
+        latencies = dict()
+        timeouts = dict()
+        superseded = dict()
+        for c in collaborators:
+            for operation, latency in c.latencies:
+                latencies.setdefault(operation, []).append(latency * 1000)
+            for operation in c.timeouts:
+                timeouts[operation] = timeouts.get(operation, 0) + 1
+            for operation in c.superseded:
+                superseded[operation] = superseded.get(operation, 0) + 1
+
+        operations = dict()
+        for operation in self.mix:
+            values = sorted(latencies.get(operation, []))
+            summary = {'answered': len(values), 'superseded': superseded.get(operation, 0),
+                       'timeouts': timeouts.get(operation, 0)}
+            for p in PERCENTILES:
+                summary[f'p{p}'] = percentile(values, p)
+            summary['max'] = values[-1] if len(values) > 0 else None
+            operations[operation] = summary
+
+        answered = sum(len(c.latencies) for c in collaborators)
+        messages = sum(c.messages for c in collaborators)
+        received = sum(c.bytes for c in collaborators)
+        return {
+            'settings': {'clients': self.clients, 'operations': self.operations, 'mix': self.mix, 'think': self.think,
+                         'seed': self.seed, 'features': list(self.features), 'pages': len(self.urls)},
+            'duration': duration,
+            'throughput': {'operations_per_second': answered / duration if duration > 0 else None,
+                           'messages_per_second': messages / duration if duration > 0 else None,
+                           'bytes_per_second': received / duration if duration > 0 else None},
+            'totals': {'answered': answered, 'messages': messages, 'bytes': received},
+            'latency_ms': operations,
+        }
+
+
+def format_report(report: dict) -> str:
+    """
+    Lay out a report as a table.
+    :param report: Report from LoadGenerator.run.
+    :return: Text for printing.
+    """
+    def ms(value):
+        return '-' if value is None else f'{value:.1f}'
+
+    settings = report['settings']
+    throughput = report['throughput']
+    lines = [f"{settings['clients']} collaborators x {settings['operations']} operations, seed {settings['seed']}, "
+             f"{settings['pages']} pages, features {','.join(settings['features']) or 'none'}",
+             f"duration {report['duration']:.2f}s, {throughput['operations_per_second'] or 0:.1f} operations/s, "
+             f"{throughput['messages_per_second'] or 0:.1f} messages/s, "
+             f"{(throughput['bytes_per_second'] or 0) / 1024:.1f} KiB/s",
+             'operation  answered  superseded  timeouts' + ''.join(f'{"p" + str(p):>9}' for p in PERCENTILES) + '      max']
+    for operation, summary in report['latency_ms'].items():
+        lines.append(f"{operation:<9}  {summary['answered']:>8}  {summary['superseded']:>10}  {summary['timeouts']:>8}"
+                     + ''.join(f"{ms(summary['p' + str(p)]):>9}" for p in PERCENTILES)
+                     + f"{ms(summary['max']):>9}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how a Conductor copes with many collaborators.')
+    parser.add_argument('--connect', metavar='HOST:PORT',
+                        help='use a running Conductor (by default a HeadlessConductor is started in this process)')
+    parser.add_argument('--base-url', help='url of the page corpus (by default testing/HTML is served locally)')
+    parser.add_argument('--clients', type=int, default=10, help='number of simulated collaborators')
+    parser.add_argument('--operations', type=int, default=20, help='operations issued by each collaborator')
+    parser.add_argument('--mix', default='navigate=0.8,back=0.1,forward=0.1', help='relative frequency of operations')
+    parser.add_argument('--think', type=float, default=0.05, help='average pause between operations (seconds)')
+    parser.add_argument('--seed', type=int, default=0, help='random number generator seed')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT, help='seconds to wait for each response')
+    parser.add_argument('--features', default=','.join(FEATURES), help='protocol features to advertise')
+    parser.add_argument('--json', metavar='FILE', help='also write the report to FILE as JSON')
+    arguments = parser.parse_args()
+
+    pages = find_pages(CORPUS)
+    base_url = arguments.base_url
+    if base_url is None:
+        _, base_url = serve_directory(CORPUS)
+    urls = [base_url.rstrip('/') + '/' + page for page in pages]
+
+    event_loop = EventLoop()
+    if arguments.connect is None:
+        conductor = HeadlessConductor('Conductor', urls[0], '127.0.0.1', 0, event_loop)
+        conductor_address = conductor.address
+    else:
+        host, _, port = arguments.connect.rpartition(':')
+        conductor_address = (host, int(port))
+
+    mix = dict()
+    for item in arguments.mix.split(','):
+        name, _, weight = item.partition('=')
+        mix[name] = float(weight)
+    features = tuple(f for f in arguments.features.split(',') if f != '')
+
+    generator = LoadGenerator(conductor_address, urls, arguments.clients, arguments.operations, mix, arguments.think,
+                              arguments.seed, arguments.timeout, features, event_loop)
+    result = generator.run()
+    print(format_report(result))
+    if arguments.json is not None:
+        with open(arguments.json, 'w') as output:
+            json.dump(result, output, indent=2)
@@ -1,94 +1,625 @@
 from socket import socket
+from collections import deque
+import struct
 
+import assets
+import compression
 from messageType import *
 
 
+# Wire format versions.
+# Version 1 frames each message as 0xff <type> <data> 0xff <type + 0x80> and has to scan for the end sequence.
+# Version 2 frames each message with a fixed header carrying the version, type, flags and payload length.
+LEGACY_VERSION = 1
+PROTOCOL_VERSION = 2
+
+# Version 2 header: version, message type, flags, (reserved), payload length.
+HEADER = struct.Struct('!BBBxI')
+
+# Header flags: the low bits identify the codec used to compress the payload (0 for none).
+# Large payloads may be sent as several fragments, each with FLAG_FRAGMENT set. Every fragment but the last also has
+# FLAG_MORE set. Fragments of one message are never interleaved with fragments of another, but other (unfragmented)
+# messages may be sent between them.
+FLAG_CODEC = 0x0f
+FLAG_FRAGMENT = 0x10
+FLAG_MORE = 0x20
+
+# The first fragment of a message begins with the length of the whole payload, so that the fragments can be copied
+# straight into a buffer of that size as they arrive.
+FRAGMENT_START = struct.Struct('!I')
+
+# Message types whose payload may be compressed.
+COMPRESSIBLE = (MESSAGE_PAGEDATA, MESSAGE_PAGEDELTA, MESSAGE_PAGECHUNK)
+
+# Small control messages, which are sent ahead of any page data still waiting, and are never fragmented.
+PRIORITY = (MESSAGE_NAVIGATION, MESSAGE_BACK, MESSAGE_FORWARD, MESSAGE_PAGEREQUEST, MESSAGE_ASSETACK,
+            MESSAGE_ASSETRELEASE)
+
+# Largest payload sent in one piece to remotes which support fragments. Priority messages wait for at most one
+# fragment to finish sending.
+FRAME_SIZE = 16 * 1024
+
+# Optional features advertised in the greeting.
+#   delta: Understands MESSAGE_PAGEDELTA
+#   stream: Understands MESSAGE_PAGESTART, MESSAGE_PAGECHUNK and MESSAGE_PAGEEND
+#   assets: Understands pages which refer to assets by hash, and MESSAGE_ASSET, MESSAGE_ASSETACK, MESSAGE_ASSETRELEASE
+#   cache: Keeps pages, so is offered pages with MESSAGE_PAGEAVAILABLE and asks for them with MESSAGE_PAGEREQUEST
+#   frames: Reassembles payloads sent as fragments (FLAG_FRAGMENT and FLAG_MORE)
+FEATURES = ('delta', 'stream', 'assets', 'cache', 'frames')
+
+# MESSAGE_PAGESTART payload: hash of the whole page, and its length in bytes.
+PAGE_START = struct.Struct('!32sI')
+
+# MESSAGE_PAGEREQUEST payload: hash of the page wanted, and of the page being shown (NO_PAGE if none, or if the page
+# being shown can't be used as the base for a delta).
+PAGE_REQUEST = struct.Struct('!32s32s')
+NO_PAGE = bytes(32)
+
+# Default number of bytes to ask for with each recv_into call.
+RECV_SIZE = 65536
+
+# Outgoing queue limits, in bytes. A remote is lagging once more than HIGH_WATERMARK bytes are waiting to be sent,
+# until the queue drains below LOW_WATERMARK. Remotes are disconnected if QUEUE_LIMIT is reached.
+HIGH_WATERMARK = 4 * 1024 * 1024
+LOW_WATERMARK = 1024 * 1024
+QUEUE_LIMIT = 64 * 1024 * 1024
+
+# Largest payload accepted from a remote, in bytes, after it has been decompressed.
+PAYLOAD_LIMIT = QUEUE_LIMIT
+
+# What to do with a lagging remote:
+#   drop: A new page replaces any pages still waiting to be sent
+#   disconnect: Disconnect the remote
+LAG_DROP = 'drop'
+LAG_DISCONNECT = 'disconnect'
+
+# Messages which are replaced by a new page when the remote is lagging. Navigation notices are PRIORITY messages, so
+# are sent ahead of the pages and are never dropped.
+SUPERSEDED = (MESSAGE_PAGEDATA, MESSAGE_PAGEDELTA, MESSAGE_PAGESTART, MESSAGE_PAGECHUNK, MESSAGE_PAGEEND,
+              MESSAGE_PAGEAVAILABLE)
+
+# Separates the name from the capability list in a greeting.
+CAPABILITY_SEPARATOR = b'\x00'
+
+
 class MessageProtocolError(Exception):
     pass
 
 
 class Message:
     def __init__(self, message_type: int, data: bytes):
+        """
+        Create a message.
+        :param message_type: One of the MESSAGE_ constants.
+        :param data: The payload. Received messages may hold a read-only memoryview rather than bytes.
+        """
         self.message_type = message_type
         self.data = data
 
-    def as_bytes(self) -> bytes:
+    def text(self) -> str:
+        """
+        Decode the payload as UTF-8 text.
+        :return: The payload as a string.
+        """
+        return str(self.data, 'utf-8')
+
+    def as_bytes(self, version: int = LEGACY_VERSION, codec: compression.Codec = None,
+                 level: int = compression.DEFAULT_LEVEL) -> bytes:
+        """
+        Frame the message for sending.
+        :param version: The wire format version to use.
+        :param codec: Codec to compress the payload with, or None. Only used from version 2.
+        :param level: The compression level.
+        :return: The framed message.
+        """
         if self.message_type < 0:
             raise MessageProtocolError
-        b = bytearray()
-        b.append(0xff)
-        b.append(self.message_type)
-        b.extend(self.data)
-        b.append(0xff)
-        b.append(self.message_type + 0x80)
-        return bytes(b)
+        if version == LEGACY_VERSION:
+            b = bytearray()
+            b.append(0xff)
+            b.append(self.message_type)
+            b.extend(self.data)
+            b.append(0xff)
+            b.append(self.message_type + 0x80)
+            return bytes(b)
+
+        data, flags = self.compressed(codec, level)
+        # Join copies the payload only once.
+        return b''.join((HEADER.pack(version, self.message_type, flags, len(data)), data))
+
+    def as_frames(self, version: int = LEGACY_VERSION, codec: compression.Codec = None,
+                  level: int = compression.DEFAULT_LEVEL, frame_size: int = None) -> list[bytes]:
+        """
+        Frame the message for sending, splitting a large payload into fragments.
+        :param version: The wire format version to use.
+        :param codec: Codec to compress the payload with, or None. Only used from version 2.
+        :param level: The compression level.
+        :param frame_size: Largest payload to send in one frame, or None to always send the message in one frame.
+        :return: List of frames, to be sent in order.
+        """
+        if version == LEGACY_VERSION or frame_size is None:
+            return [self.as_bytes(version, codec, level)]
+
+        data, flags = self.compressed(codec, level)
+        if len(data) <= frame_size:
+            return [b''.join((HEADER.pack(version, self.message_type, flags, len(data)), data))]
+
+        # The whole payload is compressed before it is split, so fragments are simply joined back together.
+        data = memoryview(data)
+        frames = list()
+        for start in range(0, len(data), frame_size):
+            piece = data[start:start + frame_size]
+            fragment_flags = flags | FLAG_FRAGMENT | (FLAG_MORE if start + frame_size < len(data) else 0)
+            if start == 0:
+                frames.append(b''.join((HEADER.pack(version, self.message_type, fragment_flags,
+                                                    FRAGMENT_START.size + len(piece)),
+                                        FRAGMENT_START.pack(len(data)), piece)))
+            else:
+                frames.append(b''.join((HEADER.pack(version, self.message_type, fragment_flags, len(piece)), piece)))
+        return frames
+
+    def compressed(self, codec: compression.Codec = None, level: int = compression.DEFAULT_LEVEL) -> tuple:
+        """
+        Compress the payload, if that makes it smaller.
+        :param codec: Codec to compress the payload with, or None.
+        :param level: The compression level.
+        :return: The payload to send, and the header flags identifying its codec.
+        """
+        if codec is not None:
+            compressed = codec.compress(self.data, level)
+            # Keep the original if compression didn't help.
+            if len(compressed) < len(self.data):
+                return compressed, codec.codec_id
+        return self.data, 0
+
+    def encode_for(self, protocol) -> list[bytes]:
+        """
+        Frame the message in the format agreed with a remote.
+        :param protocol: The MessageProtocol the message will be sent with.
+        :return: List of frames, to be sent in order.
+        """
+        if self.message_type == MESSAGE_GREETING:
+            return [self.as_bytes(LEGACY_VERSION)]
+        return self.as_frames(protocol.version, protocol.choose_codec(self), protocol.compression_level,
+                              protocol.choose_frame_size(self))
 
     def __str__(self):
-        return "[Message " + str(self.message_type) + " " + str(self.data) + "]"
+        return "[Message " + str(self.message_type) + " " + str(bytes(self.data)) + "]"
+
+
+class Broadcast(Message):
+    """
+    A message sent to many remotes.
+    It is framed (and compressed) once for each combination of wire format, codec, level and frame size in use, and the
+    framed bytes are shared by every remote's outgoing queue.
+    """
+
+    def __init__(self, message_type: int, data: bytes):
+        super().__init__(message_type, data)
+        self.frames = dict()
+
+    def encode_for(self, protocol) -> list[bytes]:
+        codec = protocol.choose_codec(self)
+        key = (protocol.version, None if codec is None else codec.codec_id, protocol.compression_level,
+               protocol.choose_frame_size(self))
+        if key not in self.frames:
+            self.frames[key] = super().encode_for(protocol)
+        return self.frames[key]
+
+
+def encode_capabilities(name: str, capabilities: dict) -> bytes:
+    """
+    Build greeting data: the name, followed by a separator and a list of key=value capabilities.
+    Peers using the legacy wire format will treat the whole thing as the name.
+    :param name: The name of this end of the connection.
+    :param capabilities: Dictionary of capability names and values.
+    :return: Encoded greeting data.
+    """
+    data = bytearray(name.encode('utf-8'))
+    data.extend(CAPABILITY_SEPARATOR)
+    data.extend(';'.join(k + '=' + v for k, v in capabilities.items()).encode('utf-8'))
+    return bytes(data)
+
+
+def decode_capabilities(data: bytes) -> tuple[str, dict]:
+    """
+    Split greeting data into the remote name and capabilities.
+    Greetings without a capability list come from peers using the legacy wire format.
+    :param data: The greeting data.
+    :return: The name and dictionary of capabilities.
+    """
+    name, _, encoded = bytes(data).partition(CAPABILITY_SEPARATOR)
+    capabilities = dict()
+    for item in encoded.decode('utf-8').split(';'):
+        key, sep, value = item.partition('=')
+        if sep:
+            capabilities[key] = value
+    return name.decode('utf-8'), capabilities
+
+
+class ReceiveBuffer:
+    """
+    Reusable buffer that incoming data is received straight into with recv_into.
+    Data is consumed from the front. Unread data is moved back to the start when more space is needed, and the buffer
+    only grows when a message will not fit.
+    """
+
+    def __init__(self, size: int):
+        """
+        Create an empty buffer.
+        :param size: Initial capacity in bytes.
+        """
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def readable(self) -> memoryview:
+        """
+        Get the unread data. The view is only valid until the buffer is next written to.
+        :return: View of the unread data.
+        """
+        return self.view[self.start:self.end]
+
+    def consume(self, count: int) -> None:
+        """
+        Mark data at the front of the buffer as read.
+        :param count: Number of bytes read.
+        """
+        self.start += count
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+
+    def reserve(self, count: int) -> memoryview:
+        """
+        Make room for at least count more bytes.
+        :param count: Number of bytes required.
+        :return: View of the free space at the end of the buffer.
+        """
+        if len(self.data) - self.end < count:
+            unread = len(self)
+            if len(self.data) - unread >= count:
+                # Move the unread data to the front (memoryview copies handle the overlap).
+                self.view[0:unread] = self.view[self.start:self.end]
+            else:
+                data = bytearray(max(2 * len(self.data), unread + count))
+                data[0:unread] = self.view[self.start:self.end]
+                self.view.release()
+                self.data = data
+                self.view = memoryview(self.data)
+            self.start = 0
+            self.end = unread
+        return self.view[self.end:]
+
+    def commit(self, count: int) -> None:
+        """
+        Record that data has been written into the space returned by reserve.
+        :param count: Number of bytes written.
+        """
+        self.end += count
 
 
 class MessageProtocol:
-    def __init__(self, remote: socket, name: str):
+    def __init__(self, remote: socket, name: str, recv_size: int = RECV_SIZE,
+                 codecs: tuple = compression.PREFERENCE, compression_level: int = compression.DEFAULT_LEVEL,
+                 compression_threshold: int = compression.COMPRESSION_THRESHOLD, features: tuple = FEATURES,
+                 loop=None, high_watermark: int = HIGH_WATERMARK, low_watermark: int = LOW_WATERMARK,
+                 lag_policy: str = LAG_DROP, queue_limit: int = QUEUE_LIMIT, session: str = None,
+                 frame_size: int = FRAME_SIZE):
+        """
+        Start a conversation with a remote Conductor or Collaborator by sending a greeting.
+        :param remote: Connected, non-blocking socket.
+        :param name: The name of this end of the connection.
+        :param recv_size: Number of bytes to ask for with each recv_into call.
+        :param codecs: Names of the codecs to offer, best first. Use an empty tuple to disable compression.
+        :param compression_level: Compression level for outgoing payloads (0-9).
+        :param compression_threshold: Payloads smaller than this are sent uncompressed.
+        :param features: Optional features to advertise to the remote.
+        :param loop: EventLoop used to finish sending queued data when the socket is ready. Without one, queued data is
+            only sent when more messages are sent or received.
+        :param high_watermark: Queued bytes above which the remote is lagging.
+        :param low_watermark: Queued bytes below which the remote stops lagging.
+        :param lag_policy: LAG_DROP or LAG_DISCONNECT.
+        :param queue_limit: Queued bytes at which the remote is disconnected.
+        :param session: Session to join, when connecting to a SessionServer (optional).
+        :param frame_size: Largest payload to send in one frame, if the remote supports fragments.
+        """
         self.name = name
         self.remote = remote
-        self.buffer = bytearray()
+        self.recv_size = recv_size
+        self.buffer = ReceiveBuffer(recv_size)
         self.active = True
         self.disconnected = False
         self.remote_name = ''
+        self.remote_capabilities = dict()
+        self.features = features
+        self.session = session
+
+        # Hash of the page the remote is showing, as far as we know.
+        self.remote_page = None
+
+        # Assets which have been sent to the remote, by hash. True once the remote has acknowledged the asset.
+        self.remote_assets = dict()
+
+        # Large payloads are received directly into their own buffer, which is then handed to the Message.
+        self.payload = None
+        self.payload_received = 0
+        self.payload_header = None
+
+        # Fragments of a message still being received: (message type, buffer for the whole payload), and the number of
+        # bytes received so far.
+        self.fragments = None
+        self.fragments_received = 0
+        self.payload_limit = PAYLOAD_LIMIT
+
+        # Messages extracted from the incoming data, waiting to be returned by receive()
+        self.received = list()
+
+        # The greeting is always sent using the legacy format. Everything after it uses the version agreed by both
+        # ends, so other messages are held back until the remote greeting arrives.
+        self.version = None
+        self.pending = list()
+
+        # Compression settings. The codec is chosen once the remote greeting arrives.
+        self.codecs = codecs
+        self.codec = None
+        self.compression_level = compression_level
+        self.compression_threshold = compression_threshold
+
+        # Frames waiting to be sent: [data still to send, message type, True if more fragments of the message follow]
+        # Priority messages are sent before other messages, as soon as the frame being sent (if any) has finished.
+        # The socket is never blocked on - data is sent as the remote accepts it.
+        self.loop = loop
+        self.frame_size = frame_size
+        self.current = None
+        self.priority = deque()
+        self.outgoing = deque()
+        self.queued_bytes = 0
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.lag_policy = lag_policy
+        self.queue_limit = queue_limit
+        self.lagging = False
+        self.waiting_to_write = False
 
         self.hello()
 
     def receive(self) -> list[Message]:
+        if self.loop is None:
+            self.flush()
         self.read_incoming_data()
         messages = self.extract_messages()
         response = []
         for m in messages:
-            if m.message_type == MESSAGE_GREETING:
-                self.remote_name = m.data.decode('utf-8')
-            else:
+            if m.message_type != MESSAGE_GREETING:
                 response.append(m)
         return response
 
+    def greeted(self, data: bytes) -> None:
+        """
+        Handle the remote greeting: record the remote name, agree on a wire format and send any held messages.
+        :param data: The greeting data.
+        """
+        self.remote_name, self.remote_capabilities = decode_capabilities(data)
+        try:
+            remote_version = int(self.remote_capabilities.get('version', LEGACY_VERSION))
+        except ValueError:
+            remote_version = LEGACY_VERSION
+        self.version = min(PROTOCOL_VERSION, remote_version)
+
+        # Compress with the best codec both ends support.
+        if self.version > LEGACY_VERSION:
+            self.codec = compression.choose(self.codecs, self.remote_capabilities.get('codecs', '').split(','))
+
+        pending = self.pending
+        self.pending = list()
+        for message in pending:
+            self.send_message(message)
+
     def read_incoming_data(self) -> None:
-        while True:
+        """
+        Receive everything available on the socket, extracting messages as they are completed.
+        """
+        while self.active:
+            if self.payload is not None:
+                # Receive the rest of a large payload straight into its own buffer.
+                target = self.payload[self.payload_received:]
+            else:
+                target = self.buffer.reserve(self.recv_size)
             try:
-                response = self.remote.recv(4096, 0)
+                count = self.remote.recv_into(target, min(len(target), self.recv_size))
             except BlockingIOError:
                 break
-            if len(response) == 0:
+            except OSError:
+                self.disconnect()
+                break
+            if count == 0:
                 self.disconnect()
                 break
-            self.buffer.extend(response)
+
+            if self.payload is not None:
+                self.payload_received += count
+                if self.payload_received == len(self.payload):
+                    self.finish_payload()
+            else:
+                self.buffer.commit(count)
+            self.extract_available()
 
     def disconnect(self) -> None:
         if self.active:
             self.active = False
             self.disconnected = True
+            self.current = None
+            self.priority.clear()
+            self.outgoing.clear()
+            self.queued_bytes = 0
+            if self.loop is not None:
+                # Stop watching the socket before it is closed.
+                self.loop.remove_reader(self.remote)
+                self.loop.remove_writer(self.remote)
             self.remote.close()
 
     def extract_messages(self) -> list[Message]:
-        messages = []
-        while True:
-            m = self.extract_message()
-            if m is None:
-                break
-            messages.append(m)
+        messages = self.received
+        self.received = list()
         if self.disconnected:
             messages.append(Message(MESSAGE_DISCONNECTED, b''))
             self.disconnected = False
         return messages
 
+    def extract_available(self) -> None:
+        """
+        Extract all complete messages from the receive buffer.
+        """
+        while self.payload is None:
+            m = self.extract_message()
+            if m is None:
+                break
+            self.received.append(m)
+            if m.message_type == MESSAGE_GREETING:
+                # Everything after the greeting uses the agreed version.
+                self.greeted(m.data)
+
     def extract_message(self) -> Message | None:
+        if self.version is None or self.version == LEGACY_VERSION:
+            return self.extract_legacy_message()
+
+        while len(self.buffer) >= HEADER.size:
+            header = HEADER.unpack_from(self.buffer.readable())
+            length = header[3]
+            available = len(self.buffer) - HEADER.size
+
+            if length > self.payload_limit:
+                # Don't make room for it. The rest of the data can't be understood without reading the payload.
+                self.buffer.consume(len(self.buffer))
+                self.disconnect()
+                return Message(MESSAGE_INVALID, b'')
+
+            if available >= length:
+                # Small messages (or those that arrived all at once) are read from the receive buffer, and copied out of
+                # it by make_message.
+                message = self.make_message(header, self.buffer.readable()[HEADER.size:HEADER.size + length], True)
+                self.buffer.consume(HEADER.size + length)
+                if message is not None:
+                    return message
+                # A fragment of a larger message - carry on with the next frame.
+                continue
+
+            if length > self.recv_size:
+                # Large payloads get a buffer of their own, so that the data is only copied once.
+                self.payload = memoryview(bytearray(length))
+                self.payload[0:available] = self.buffer.readable()[HEADER.size:]
+                self.payload_received = available
+                self.payload_header = header
+                self.buffer.consume(HEADER.size + available)
+            break
+
+        # Wait for the rest of the message.
+        return None
+
+    def finish_payload(self) -> None:
+        """
+        A large payload has been received - turn it into a Message.
+        """
+        message = self.make_message(self.payload_header, self.payload.toreadonly())
+        if message is not None:
+            self.received.append(message)
+        self.payload = None
+        self.payload_received = 0
+        self.payload_header = None
+
+    def make_message(self, header: tuple, message_data, borrowed: bool = False) -> Message:
+        """
+        Create a Message from a version 2 header and its payload.
+        :param header: The unpacked header.
+        :param message_data: The payload.
+        :param borrowed: True if message_data is part of the receive buffer, so must be copied to be kept.
+        :return: The new Message, or None if the payload is a fragment and more fragments are to come.
+        """
+        version, message_type, flags, length = header
+        if version != self.version:
+            return Message(MESSAGE_INVALID, bytes(message_data))
+
+        if flags & FLAG_FRAGMENT:
+            message_data = self.add_fragment(message_type, flags, message_data)
+            if message_data is None:
+                return None
+            if len(message_data) == 0:
+                # Fragments of different messages were mixed, or they didn't add up to the length given.
+                return Message(MESSAGE_INVALID, b'')
+            borrowed = False
+
+        if flags & FLAG_CODEC:
+            codec = compression.by_id(flags & FLAG_CODEC)
+            if codec is None:
+                return Message(MESSAGE_INVALID, bytes(message_data))
+            try:
+                message_data = codec.decompress(message_data, self.payload_limit)
+            except compression.DECOMPRESSION_ERRORS:
+                return Message(MESSAGE_INVALID, bytes(message_data))
+        elif borrowed:
+            message_data = bytes(message_data)
+
+        return Message(message_type, message_data)
+
+    def add_fragment(self, message_type: int, flags: int, message_data) -> memoryview | None:
+        """
+        Copy a fragment into the buffer for the whole payload, which is made when the first fragment arrives.
+        :param message_type: The type of the message.
+        :param flags: The fragment's header flags.
+        :param message_data: The fragment.
+        :return: Read-only view of the whole payload once the last fragment has arrived, None if more fragments are
+            to come (or the message is being discarded), or an empty view if the fragments are invalid.
+        """
+        if self.fragments is None:
+            if len(message_data) < FRAGMENT_START.size:
+                return memoryview(b'')
+            total, = FRAGMENT_START.unpack_from(message_data)
+            if total > self.payload_limit:
+                # Refuse the message once, and discard the rest of its fragments.
+                if flags & FLAG_MORE:
+                    self.fragments = (message_type, None)
+                return memoryview(b'')
+            self.fragments = (message_type, memoryview(bytearray(total)))
+            self.fragments_received = 0
+            message_data = message_data[FRAGMENT_START.size:]
+        elif self.fragments[0] != message_type:
+            # Fragments of different messages must not be mixed.
+            self.fragments = None
+            return memoryview(b'')
+
+        payload = self.fragments[1]
+        if payload is None:
+            if not flags & FLAG_MORE:
+                self.fragments = None
+            return None
+        end = self.fragments_received + len(message_data)
+        if end > len(payload) or (not flags & FLAG_MORE and end != len(payload)):
+            self.fragments = None
+            return memoryview(b'')
+        payload[self.fragments_received:end] = message_data
+        self.fragments_received = end
+        if flags & FLAG_MORE:
+            return None
+        self.fragments = None
+        return payload.toreadonly()
+
+    def extract_legacy_message(self) -> Message | None:
         if len(self.buffer) < 4:
             return None
-        for i in range(len(self.buffer) - 1):
-            if self.buffer[i] == 0xff and self.buffer[i+1] > 0x7f:
-                message_end = self.buffer[i+1]
+        buffer = self.buffer.readable()
+        for i in range(len(buffer) - 1):
+            if buffer[i] == 0xff and buffer[i+1] > 0x7f:
+                message_end = buffer[i+1]
                 expected_start = message_end - 0x80
-                message_data = self.buffer[2:i]
-                start_seq = self.buffer[0:2]
-                # end_seq = self.buffer[i:i+2] # Ending sequence already validated
-                self.buffer = bytearray(self.buffer[i+2:])
+                message_data = bytes(buffer[2:i])
+                start_seq = bytes(buffer[0:2])
+                # end_seq = buffer[i:i+2] # Ending sequence already validated
+                self.buffer.consume(i + 2)
 
                 message_type = expected_start
 
@@ -99,13 +630,140 @@ class MessageProtocol:
         return None
 
     def send_message(self, message: Message) -> None:
-        try:
-            self.remote.sendall(message.as_bytes())
-        except OSError:
+        if message.message_type != MESSAGE_GREETING and self.version is None:
+            # Wait until the wire format has been agreed.
+            self.pending.append(message)
+            return
+        self.queue(message.encode_for(self), message.message_type)
+
+    def queue(self, frames: list[bytes], message_type: int) -> None:
+        """
+        Add a framed message to the outgoing queue, and send as much as the socket will take.
+        :param frames: The framed message, in one or more frames.
+        :param message_type: The type of the message.
+        """
+        if not self.active:
+            return
+
+        if self.lagging:
+            if self.lag_policy == LAG_DISCONNECT:
+                self.disconnect()
+                return
+            if message_type in (MESSAGE_PAGEDATA, MESSAGE_PAGESTART, MESSAGE_PAGEAVAILABLE):
+                self.drop_superseded()
+
+        lane = self.priority if message_type in PRIORITY else self.outgoing
+        for i, frame in enumerate(frames):
+            lane.append([memoryview(frame), message_type, i < len(frames) - 1])
+            self.queued_bytes += len(frame)
+        if self.queued_bytes >= self.queue_limit:
             self.disconnect()
+            return
+        self.flush()
+
+    def drop_superseded(self) -> bool:
+        """
+        Remove pages which have not started to be sent.
+        Only safe before queuing a complete page, as deltas depend on the pages before them.
+        A message which has started to be sent keeps its remaining fragments, and a page which is part way through
+        being streamed keeps its remaining chunks, so that the remote isn't left with half a page.
+        Priority messages are left alone, as they are sent ahead of pages anyway.
+        :return: True if anything was removed.
+        """
+        kept = deque()
+        continuing = self.current is not None and self.current[2]
+        streaming = self.current is not None and self.current[1] in (MESSAGE_PAGESTART, MESSAGE_PAGECHUNK)
+        for entry in self.outgoing:
+            if continuing or (streaming and entry[1] in (MESSAGE_PAGECHUNK, MESSAGE_PAGEEND)):
+                continuing = entry[2]
+                if entry[1] == MESSAGE_PAGEEND and not continuing:
+                    streaming = False
+                kept.append(entry)
+            elif entry[1] in SUPERSEDED:
+                streaming = False
+                self.queued_bytes -= len(entry[0])
+            else:
+                kept.append(entry)
+        dropped = len(kept) < len(self.outgoing)
+        self.outgoing = kept
+        return dropped
+
+    def flush(self) -> None:
+        """
+        Send queued data until the queue is empty or the socket would block.
+        Called by the event loop when the socket is ready for more.
+        """
+        while self.active:
+            if self.current is None:
+                # A frame is always finished before the next is started. Priority messages go first.
+                if len(self.priority) > 0:
+                    self.current = self.priority.popleft()
+                elif len(self.outgoing) > 0:
+                    self.current = self.outgoing.popleft()
+                else:
+                    break
+            entry = self.current
+            try:
+                count = self.remote.send(entry[0])
+            except BlockingIOError:
+                break
+            except OSError:
+                self.disconnect()
+                return
+            self.queued_bytes -= count
+            if count == len(entry[0]):
+                self.current = None
+            else:
+                entry[0] = entry[0][count:]
+
+        if self.queued_bytes > self.high_watermark:
+            self.lagging = True
+        elif self.queued_bytes < self.low_watermark:
+            self.lagging = False
+
+        # Only ask to be told about space to write when there is something waiting.
+        waiting = self.current is not None
+        if self.loop is not None and self.active and self.waiting_to_write != waiting:
+            self.waiting_to_write = waiting
+            if self.waiting_to_write:
+                self.loop.add_writer(self.remote, self.flush)
+            else:
+                self.loop.remove_writer(self.remote)
+
+    def supports(self, feature: str) -> bool:
+        """
+        Check whether both ends of the connection support an optional feature.
+        :param feature: The feature name.
+        :return: True if the feature can be used.
+        """
+        return feature in self.features and feature in self.remote_capabilities.get('features', '').split(',')
+
+    def choose_codec(self, message: Message) -> compression.Codec | None:
+        """
+        Decide whether to compress a message.
+        :param message: The message to be sent.
+        :return: The codec to compress it with, or None to send it as it is.
+        """
+        if message.message_type in COMPRESSIBLE and len(message.data) >= self.compression_threshold:
+            return self.codec
+        return None
+
+    def choose_frame_size(self, message: Message) -> int | None:
+        """
+        Decide whether a message may be split into fragments.
+        :param message: The message to be sent.
+        :return: The largest payload to send in one frame, or None to send the message in one frame.
+        """
+        if message.message_type not in PRIORITY and self.supports('frames'):
+            return self.frame_size
+        return None
 
     def hello(self) -> None:
-        self.send_message(Message(MESSAGE_GREETING, self.name.encode('utf-8')))
+        capabilities = {'version': str(PROTOCOL_VERSION), 'codecs': ','.join(self.codecs),
+                        'features': ','.join(self.features)}
+        if self.session is not None:
+            capabilities['session'] = self.session
+        self.send_message(Message(MESSAGE_GREETING, encode_capabilities(self.name, capabilities)))
 
     def navigate(self, url: str) -> None:
         self.send_message(Message(MESSAGE_NAVIGATION, url.encode('utf-8')))
@@ -118,3 +776,30 @@ class MessageProtocol:
 
     def pagedata(self, data: bytes) -> None:
         self.send_message(Message(MESSAGE_PAGEDATA, data))
+
+    def pagedelta(self, data: bytes) -> None:
+        self.send_message(Message(MESSAGE_PAGEDELTA, data))
+
+    def pagestart(self, page_hash: bytes, length: int) -> None:
+        self.send_message(Message(MESSAGE_PAGESTART, PAGE_START.pack(page_hash, length)))
+
+    def pagechunk(self, data: bytes) -> None:
+        self.send_message(Message(MESSAGE_PAGECHUNK, data))
+
+    def pageend(self) -> None:
+        self.send_message(Message(MESSAGE_PAGEEND, b''))
+
+    def pageavailable(self, page_hash: bytes) -> None:
+        self.send_message(Message(MESSAGE_PAGEAVAILABLE, page_hash))
+
+    def pagerequest(self, page_hash: bytes, current_hash: bytes) -> None:
+        self.send_message(Message(MESSAGE_PAGEREQUEST, PAGE_REQUEST.pack(page_hash, current_hash)))
+
+    def asset(self, key: str, data: bytes) -> None:
+        self.send_message(Message(MESSAGE_ASSET, assets.key_to_bytes(key) + data))
+
+    def assetack(self, key: str) -> None:
+        self.send_message(Message(MESSAGE_ASSETACK, assets.key_to_bytes(key)))
+
+    def assetrelease(self, key: str) -> None:
+        self.send_message(Message(MESSAGE_ASSETRELEASE, assets.key_to_bytes(key)))
@@ -6,3 +6,12 @@ MESSAGE_NAVIGATION = 1
 MESSAGE_PAGEDATA = 2
 MESSAGE_BACK = 3
 MESSAGE_FORWARD = 4
+MESSAGE_PAGEDELTA = 5
+MESSAGE_PAGESTART = 6
+MESSAGE_PAGECHUNK = 7
+MESSAGE_PAGEEND = 8
+MESSAGE_ASSET = 9
+MESSAGE_ASSETACK = 10
+MESSAGE_ASSETRELEASE = 11
+MESSAGE_PAGEAVAILABLE = 12
+MESSAGE_PAGEREQUEST = 13
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Where collaborators keep pages and assets between sessions.
+CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.gaudy', 'cache')
+
+# Default maximum size of a cache on disk, in bytes.
+CACHE_SIZE = 256 * 1024 * 1024
+
+
+class PageCache:
+    """
+    Size-bounded cache of serialised pages (or assets) on disk, keyed by the SHA-256 hash of their content.
+    The least recently used entries are removed first. Entries are kept between sessions.
+    Safe to use from many threads at once.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY, size: int = CACHE_SIZE):
+        """
+        Open a cache, creating its directory if necessary.
+        :param directory: Where the cached files are kept. Each entry is a file named after its hash.
+        :param size: Maximum total size of the cached files, in bytes.
+        """
+        self.directory = directory
+        self.size = size
+        self.used = 0
+        # Held while the entries or their files are used. Re-entrant, as eg. put calls get and make_room calls remove.
+        self.lock = threading.RLock()
+
+        # Hash -> size of the entry, least recently used first.
+        self.entries = OrderedDict()
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Find the entries saved by earlier sessions. The modification time records when each was last used.
+        found = list()
+        for name in os.listdir(directory):
+            if len(name) == 64 and all(c in '0123456789abcdef' for c in name):
+                info = os.stat(self.path(name))
+                found.append((info.st_mtime, name, info.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.used += size
+        self.make_room()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key: str):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key: str) -> bytes | None:
+        """
+        Read an entry from the cache.
+        :param key: The hexadecimal content hash.
+        :return: The entry's data, or None if it isn't cached (or the file has been damaged).
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            try:
+                with open(self.path(key), 'rb') as file:
+                    data = file.read()
+                os.utime(self.path(key))
+            except OSError as e:
+                print(e)
+                self.remove(key)
+                return None
+
+            if hashlib.sha256(data).hexdigest() != key:
+                self.remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Add an entry to the cache, removing the least recently used entries to make room.
+        :param key: The hexadecimal content hash of data.
+        :param data: The data to save.
+        """
+        with self.lock:
+            if key in self.entries:
+                # Already saved, just record that it has been used.
+                self.get(key)
+                return
+
+            # Write to a temporary file first, so that a partly written file is never mistaken for an entry.
+            temporary = self.path(key + '.tmp')
+            try:
+                with open(temporary, 'wb') as file:
+                    file.write(data)
+                os.replace(temporary, self.path(key))
+            except OSError as e:
+                print(e)
+                return
+
+            self.entries[key] = len(data)
+            self.used += len(data)
+            self.make_room()
+
+    def remove(self, key: str) -> None:
+        """
+        Remove an entry from the cache.
+        :param key: The hexadecimal content hash.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.used -= self.entries.pop(key)
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def make_room(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in its size limit. The newest entry is always kept.
+        """
+        with self.lock:
+            while self.used > self.size and len(self.entries) > 1:
+                self.remove(next(iter(self.entries)))
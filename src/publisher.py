@@ -0,0 +1,377 @@
+import serialiser
+import delta
+import assets
+
+import socket
+import struct
+
+from messageProtocol import MessageProtocol, Broadcast, PAGE_START, PAGE_REQUEST, NO_PAGE
+from messageType import *
+
+# Number of recently sent pages kept for making deltas.
+SENT_PAGES = 8
+
+# Pages larger than this are streamed, in chunks of about CHUNK_SIZE bytes, to collaborators who support it.
+STREAM_THRESHOLD = 64 * 1024
+CHUNK_SIZE = 16 * 1024
+
+# Where collaborators connect by default.
+HOST = '0.0.0.0'
+PORT = 10000
+
+
+class Publisher:
+    """
+    Sends the current page to collaborators, and handles their messages.
+    Subclasses decide where pages come from (by setting current_page_data and calling publish), and what to do when a
+    collaborator asks to navigate: Session loads pages itself, while a Relay passes requests on to its own Conductor.
+    """
+
+    def __init__(self, cid, loop, asset_store):
+        """
+        Create a publisher with no collaborators. Call listen to accept them.
+        :param cid: Name sent to collaborators in the greeting.
+        :param loop: EventLoop which calls the network handlers.
+        :param asset_store: AssetStore holding the images pages refer to.
+        """
+        self.cid = cid
+        self.loop = loop
+        self.server_socket = None
+
+        self.collaborators = list()
+        self.new_collaborators = list()
+        self.current_page_data = None
+        self.current_page_hash = None
+
+        # Images used by pages, by hash. Each one is sent to a collaborator once, the first time it is needed.
+        self.assets = asset_store
+        self.current_page_assets = list()
+
+        # Messages made for sending the current page, so that they are only made once however many collaborators
+        # need them: 'full', 'inline' (with images included), 'stream', ('delta', base hash) and ('asset', hash).
+        self.page_broadcasts = dict()
+
+        # Recently sent pages (by hash), which collaborators may be able to apply a delta to.
+        self.sent_pages = dict()
+
+        # Navigation asked for by a collaborator, waiting to be carried out: (method, arguments)
+        # Only the latest request received in each pass of the event loop is carried out.
+        self.navigation_request = None
+
+    def listen(self, host=HOST, port=PORT):
+        """
+        Start accepting collaborators. Network events are handled by the event loop as soon as they happen.
+        :param host: Address to listen on.
+        :param port: Port to listen on (0 to choose any free port).
+        :return: The address being listened on (host, port).
+        """
+        self.server_socket = socket.create_server((host, port))
+        self.server_socket.setblocking(False)
+        self.loop.add_reader(self.server_socket, self.accept_collaborators)
+        return self.server_socket.getsockname()
+
+    def close(self):
+        """
+        Stop accepting collaborators and disconnect everyone.
+        """
+        if self.server_socket is not None:
+            self.loop.remove_reader(self.server_socket)
+            self.server_socket.close()
+            self.server_socket = None
+        for c in self.collaborators:
+            c[0].active = False
+        self.remove_inactive()
+
+    def accept_collaborators(self):
+        """
+        Accept connections from collaborators and add them to a list to be updated when the page changes.
+        Called by the event loop when the server socket is ready.
+        """
+
+        while True:
+            # Accept a new collaborator
+            try:
+                connection, address = self.server_socket.accept()
+            except BlockingIOError:
+                # No-one else is waiting to connect
+                break
+            connection.setblocking(False)
+            self.add_collaborator(MessageProtocol(connection, self.cid, loop=self.loop), address, connection)
+
+    def add_collaborator(self, collaborator, address, connection, messages=()):
+        """
+        Start sending pages to a collaborator, and handling its messages.
+        :param collaborator: MessageProtocol for the collaborator's connection.
+        :param address: The collaborator's address.
+        :param connection: The collaborator's socket.
+        :param messages: Messages already received from the collaborator (eg. by a SessionServer).
+        """
+        c = (collaborator, address, connection)
+        self.collaborators.append(c)
+        self.loop.add_reader(connection, lambda c=c: self.check_network(c))
+
+        # Send current page data to the collaborator.
+        # The page itself waits for the collaborator's greeting, which says how it can be sent.
+        if self.current_page() is not None:
+            collaborator.navigate(self.current_page().address)
+        self.new_collaborators.append(c)
+        self.handle_messages(c, messages)
+
+    def check_network(self, c):
+        """
+        Process messages from a collaborator.
+        Called by the event loop as soon as the collaborator's connection is ready.
+        :param c: The collaborator (protocol, address, connection)
+        """
+        self.handle_messages(c, c[0].receive())
+
+    def handle_messages(self, c, messages):
+        """
+        Respond to messages from a collaborator.
+        :param c: The collaborator (protocol, address, connection)
+        :param messages: Messages received from the collaborator.
+        """
+        collaborator = c[0]
+        for m in messages:
+            if m.message_type == MESSAGE_DISCONNECTED:
+                collaborator.active = False
+            if m.message_type == MESSAGE_INVALID:
+                collaborator.active = False
+            elif m.message_type == MESSAGE_TIMEOUT:
+                collaborator.active = False
+            elif m.message_type == MESSAGE_NAVIGATION:
+                self.request_navigation(self.go, m.text())
+            elif m.message_type == MESSAGE_PAGEDATA:
+                collaborator.active = False
+            elif m.message_type == MESSAGE_BACK:
+                self.request_navigation(self.back)
+            elif m.message_type == MESSAGE_FORWARD:
+                self.request_navigation(self.forward)
+            elif m.message_type == MESSAGE_PAGEREQUEST:
+                self.page_requested(collaborator, m.data)
+            elif m.message_type == MESSAGE_ASSETACK:
+                # The collaborator has the asset, whether it was sent or found in its own cache.
+                collaborator.remote_assets[assets.key_from_bytes(m.data)] = True
+            elif m.message_type == MESSAGE_ASSETRELEASE:
+                # The collaborator no longer has the asset, so it must be sent again next time it's needed.
+                collaborator.remote_assets.pop(assets.key_from_bytes(m.data), None)
+            else:
+                collaborator.active = False
+
+        # Send the current page once the greeting has been received.
+        if c in self.new_collaborators and collaborator.version is not None:
+            self.new_collaborators.remove(c)
+            if self.current_page_data is not None:
+                self.send_page([c])
+
+        # Navigation may have caused other collaborators to disconnect, so check everyone.
+        self.remove_inactive()
+
+    def remove_inactive(self):
+        """
+        Stop listening to collaborators who have disconnected (or misbehaved), and close their connections.
+        """
+        for c in [c for c in self.collaborators if not c[0].active]:
+            self.loop.remove_reader(c[2])
+            self.loop.remove_writer(c[2])
+            c[2].close()
+            self.collaborators.remove(c)
+            if c in self.new_collaborators:
+                self.new_collaborators.remove(c)
+
+    def request_navigation(self, method, *args):
+        """
+        Navigate once every collaborator whose message has arrived has been heard. When several collaborators ask to
+        navigate at once, only the latest request is carried out, so that pages which would immediately be replaced
+        aren't loaded or sent.
+        :param method: go, back or forward.
+        :param args: Arguments for the method.
+        """
+        if self.navigation_request is None:
+            self.loop.call_soon(self.navigate_as_requested)
+        self.navigation_request = (method, args)
+
+    def navigate_as_requested(self):
+        """
+        Carry out the latest navigation request. Called by the event loop.
+        """
+        if self.navigation_request is None:
+            return
+        method, args = self.navigation_request
+        self.navigation_request = None
+        method(*args)
+        self.remove_inactive()
+
+    def current_page(self):
+        """
+        Get the page being published.
+        :return: The current HtmlPage, or None.
+        """
+        return None
+
+    def go(self, url):
+        """
+        Called when a collaborator asks to navigate.
+        :param url: The page to go to.
+        """
+        pass
+
+    def back(self):
+        """
+        Called when a collaborator asks to go back.
+        """
+        pass
+
+    def forward(self):
+        """
+        Called when a collaborator asks to go forward.
+        """
+        pass
+
+    def publish(self):
+        """
+        Send the current page to every collaborator, after current_page_data has changed.
+        """
+        # Remember the page, so that the next page can be sent as a delta against it.
+        self.current_page_hash = serialiser.page_hash(self.current_page_data)
+        self.sent_pages.pop(self.current_page_hash, None)
+        self.sent_pages[self.current_page_hash] = self.current_page_data
+        while len(self.sent_pages) > SENT_PAGES:
+            del self.sent_pages[next(iter(self.sent_pages))]
+        self.current_page_assets = self.current_page().asset_keys()
+        self.page_broadcasts = dict()
+
+        # Cancel pages which haven't been sent yet, as they have been replaced. Collaborators who were waiting for one
+        # can't have a delta against it, so are sent the whole page instead.
+        for collaborator in self.collaborators:
+            if collaborator[0].drop_superseded():
+                collaborator[0].remote_page = None
+
+        # Send the page data to each collaborator.
+        self.send_page(self.collaborators)
+
+    def send_page(self, collaborators):
+        """
+        Send the current page to some collaborators.
+        Collaborators with a page cache are only told the page's hash, and ask for the page if they don't have it.
+        :param collaborators: List of collaborators (protocol, address, connection)
+        """
+        for collaborator in collaborators:
+            protocol = collaborator[0]
+            if protocol.supports('cache'):
+                protocol.pageavailable(self.current_page_hash)
+                # Assume the page is cached until the collaborator asks for it.
+                protocol.remote_page = self.current_page_hash
+            else:
+                self.deliver_page(protocol)
+
+    def page_requested(self, collaborator, data):
+        """
+        Send the current page to a collaborator which doesn't have it cached, or which couldn't use the delta or
+        stream it was sent.
+        :param collaborator: The collaborator's MessageProtocol.
+        :param data: The hash of the page wanted, and of the page the collaborator is showing (NO_PAGE to be sent the
+            whole page).
+        """
+        try:
+            page_hash, base = PAGE_REQUEST.unpack(data)
+        except struct.error:
+            collaborator.active = False
+            return
+
+        # Whatever was assumed when the page was sent, the collaborator is showing base, so later deltas must be made
+        # against it (or the whole page sent).
+        collaborator.remote_page = None if base == NO_PAGE else base
+
+        # If the page has changed since it was offered, the new page has been offered already.
+        if page_hash == self.current_page_hash:
+            self.deliver_page(collaborator)
+
+    def deliver_page(self, collaborator):
+        """
+        Send the current page's data to a collaborator, in the smallest form it can use.
+        The full page, the stream of chunks, each delta and each asset, are only framed once however many collaborators
+        receive them.
+        :param collaborator: The collaborator's MessageProtocol.
+        """
+        if not collaborator.supports('assets') and len(self.current_page_assets) > 0:
+            # Send the whole page with its images included. It can't be used as the base for a delta.
+            if 'inline' not in self.page_broadcasts:
+                self.page_broadcasts['inline'] = Broadcast(MESSAGE_PAGEDATA, serialiser.bytes_from_html(
+                    self.current_page(), self.assets))
+            collaborator.send_message(self.page_broadcasts['inline'])
+            collaborator.remote_page = None
+            return
+
+        self.send_assets(collaborator)
+        message = self.page_delta(collaborator)
+        if message is not None:
+            collaborator.send_message(message)
+        elif collaborator.supports('stream') and len(self.current_page_data) > STREAM_THRESHOLD:
+            if 'stream' not in self.page_broadcasts:
+                self.page_broadcasts['stream'] = self.page_stream()
+            for message in self.page_broadcasts['stream']:
+                collaborator.send_message(message)
+        else:
+            if 'full' not in self.page_broadcasts:
+                self.page_broadcasts['full'] = Broadcast(MESSAGE_PAGEDATA, self.current_page_data)
+            collaborator.send_message(self.page_broadcasts['full'])
+        collaborator.remote_page = self.current_page_hash
+
+    def send_assets(self, collaborator):
+        """
+        Send a collaborator the assets used by the current page which it hasn't been sent already.
+        :param collaborator: The collaborator's MessageProtocol.
+        """
+        for key in self.current_page_assets:
+            if key not in collaborator.remote_assets and key in self.assets:
+                if ('asset', key) not in self.page_broadcasts:
+                    self.page_broadcasts[('asset', key)] = Broadcast(MESSAGE_ASSET, assets.key_to_bytes(key)
+                                                                     + self.assets.get(key))
+                collaborator.send_message(self.page_broadcasts[('asset', key)])
+                # Not acknowledged yet
+                collaborator.remote_assets[key] = False
+
+    def page_delta(self, collaborator):
+        """
+        Make a delta from the page a collaborator is showing to the current page, if that is smaller than the page.
+        Lagging collaborators always get the whole page, so that it can replace pages they haven't received yet.
+        Collaborators showing the same page share one delta.
+        :param collaborator: The collaborator's MessageProtocol.
+        :return: The delta message, or None if the whole page should be sent.
+        """
+        base = collaborator.remote_page
+        if (collaborator.supports('delta') and not collaborator.lagging and base in self.sent_pages
+                and base != self.current_page_hash):
+            if ('delta', base) not in self.page_broadcasts:
+                self.page_broadcasts[('delta', base)] = Broadcast(MESSAGE_PAGEDELTA, delta.encode(
+                    self.sent_pages[base], self.current_page_data))
+            message = self.page_broadcasts[('delta', base)]
+            if len(message.data) < len(self.current_page_data):
+                return message
+
+        # No usable base page, or the delta is no smaller.
+        return None
+
+    def page_stream(self):
+        """
+        Split the current page into messages which let collaborators draw it as it arrives.
+        Chunks follow the document order of the page, and each one begins at the start of a node.
+        :return: List of broadcasts: PAGESTART, a PAGECHUNK for each chunk, then PAGEEND.
+        """
+        messages = [Broadcast(MESSAGE_PAGESTART, PAGE_START.pack(self.current_page_hash, len(self.current_page_data)))]
+        for chunk in serialiser.chunks(self.current_page_data, CHUNK_SIZE):
+            messages.append(Broadcast(MESSAGE_PAGECHUNK, chunk))
+        messages.append(Broadcast(MESSAGE_PAGEEND, b''))
+        return messages
+
+    def broadcast(self, message_type, data):
+        """
+        Send the same message to every collaborator.
+        The message is framed once, and the framed bytes are shared by every collaborator's outgoing queue.
+        :param message_type: One of the MESSAGE_ constants.
+        :param data: The message payload.
+        """
+        message = Broadcast(message_type, data)
+        for collaborator in self.collaborators:
+            collaborator[0].send_message(message)
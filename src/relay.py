@@ -0,0 +1,75 @@
+import assets
+import serialiser
+
+from publisher import Publisher
+from messageType import *
+
+
+class Relay(Publisher):
+    """
+    Passes a Collaborator's pages on to collaborators connected to it, so that the Conductor only sends each page once
+    to the relay rather than once to every viewer.
+    Pages are sent on once they have been completely received, in whichever form each downstream collaborator can use
+    (delta, stream, or whole page). Navigation requests from downstream collaborators are passed up to the Conductor.
+    The relay keeps its own copy of the images the page it is sending uses, as the Collaborator's cache may forget them.
+    """
+
+    def __init__(self, cid, loop, upstream, find_asset):
+        """
+        Create a relay with no downstream collaborators. Call listen to accept them.
+        :param cid: Name sent to downstream collaborators in the greeting.
+        :param loop: EventLoop which calls the network handlers.
+        :param upstream: MessageProtocol for the connection to the Conductor.
+        :param find_asset: Function finding an image the Collaborator has received, by hash (returns None if it hasn't
+            got it).
+        """
+        super().__init__(cid, loop, assets.AssetStore())
+        self.upstream = upstream
+        self.find_asset = find_asset
+
+        # The page being sent on. This only changes once the Collaborator has received the whole of a new page.
+        self.page = None
+
+    def current_page(self):
+        return self.page
+
+    def go(self, url):
+        self.upstream.navigate(url)
+
+    def back(self):
+        self.upstream.back()
+
+    def forward(self):
+        self.upstream.forward()
+
+    def navigation_received(self, url):
+        """
+        Tell downstream collaborators that the Conductor is loading a new page.
+        :param url: Address of the page.
+        """
+        self.broadcast(MESSAGE_NAVIGATION, url.encode('utf-8'))
+
+    def page_received(self, page, page_data):
+        """
+        Send a page to downstream collaborators, once the Collaborator has received and loaded all of it.
+        :param page: The HtmlPage.
+        :param page_data: Serialised page data.
+        """
+        if serialiser.page_hash(page_data) == self.current_page_hash:
+            return
+
+        # Keep the page's images (and only those) until the next page arrives.
+        keys = page.asset_keys()
+        for key in keys:
+            if key not in self.assets:
+                data = self.find_asset(key)
+                if data is None:
+                    print('Missing image', key)
+                else:
+                    self.assets.add(data)
+        self.assets.retain(set(keys))
+
+        self.page = page
+        self.current_page_data = page_data
+        self.publish()
+        self.remove_inactive()
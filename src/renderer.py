@@ -6,6 +6,7 @@ from io import BytesIO
 
 from PIL import ImageTk, Image, UnidentifiedImageError
 
+from serialiser import NODE_START
 from styleDefaults import StyleDefaults
 
 
@@ -28,6 +29,30 @@ def load_font_style(styling):
     return font
 
 
+class OpenNode:
+    """
+    A node which has been started, but not finished, by the renderer.
+    """
+
+    def __init__(self, node, styling, new_styling, elements, block_level, link, hidden):
+        """
+        :param node: The node being rendered
+        :param styling: Style dictionary the node was rendered with
+        :param new_styling: Style dictionary for the node's children
+        :param elements: Elements created so far for this node and its children
+        :param block_level: True if a new line follows the node
+        :param link: True if the node's elements should be linked once it is finished
+        :param hidden: True if the node and its children are not drawn
+        """
+        self.node = node
+        self.styling = styling
+        self.new_styling = new_styling
+        self.elements = elements
+        self.block_level = block_level
+        self.link = link
+        self.hidden = hidden
+
+
 class Renderer:
     default_style = {
         'font': StyleDefaults.primaryFont,
@@ -45,7 +70,9 @@ class Renderer:
         'end_spacing': StyleDefaults.end_spacing
     }
 
-    def __init__(self, parent):
+    def __init__(self, parent, assets=None):
+        # where images referred to by hash are found (an AssetStore, or None)
+        self.assets = assets
         self.canvas = tk.Canvas(parent, bg=StyleDefaults.backgroundColour, )
 
         self.scrollbar = tk.Scrollbar(parent, orient="vertical", command=self.canvas.yview)
@@ -69,6 +96,8 @@ class Renderer:
             "a": [],
             "hr": []
         }
+        # nodes which have been started but not finished, innermost last
+        self.open_nodes = []
 
     def render(self, root):
         """
@@ -77,6 +106,14 @@ class Renderer:
         :param root: node to start rendering from
         """
         # print('render ' + root.tag)
+        self.begin()
+        self.render_node(root)
+
+    def begin(self):
+        """
+        clears the canvas, ready to render a page.
+        nodes can then be rendered one at a time, in document order, with start_node and end_node.
+        """
         # reset canvas
         self.canvas.delete('all')
         # reset position for rendering
@@ -88,16 +125,39 @@ class Renderer:
             "a": [],
             "hr": []
         }
+        self.open_nodes = []
 
-        self.render_node(root, self.default_style)
-
-    def render_node(self, node, styling):
+    def render_node(self, node):
         """
-        recursively renders each node in the DOM tree.
+        renders a node and each node inside it, in document order.
         :param node: node to be rendered
-        :param styling: style dictionary
         :return: nested tuples of elements from this node and its children
         """
+        elements = None
+        for event, child in node.walk_events():
+            if event == NODE_START:
+                self.start_node(child)
+            else:
+                elements = self.end_node(child)
+        # the last node finished is the node itself
+        return elements
+
+    def start_node(self, node):
+        """
+        renders a node, before any of its children.
+        the node is styled according to the node it is inside (the last node started and not yet ended).
+        :param node: node to be rendered
+        """
+        if len(self.open_nodes) > 0:
+            parent = self.open_nodes[-1]
+            styling = parent.new_styling
+            if parent.hidden:
+                # children of hidden nodes are hidden too
+                self.open_nodes.append(OpenNode(node, styling, styling, tuple(), False, False, True))
+                return
+        else:
+            styling = self.default_style
+
         new_styling = copy.deepcopy(styling)
         elements = tuple()
         # load font
@@ -110,7 +170,8 @@ class Renderer:
             pass
 
         elif node.tag == 'title':
-            return tuple()
+            self.open_nodes.append(OpenNode(node, styling, new_styling, tuple(), False, False, True))
+            return
 
         elif node.tag == 'body':
             pass
@@ -256,13 +317,27 @@ class Renderer:
 
             self.elements_in_page_order.append((text_element, bg_element))
 
-        for child in node.children:
-            elements += self.render_node(child, new_styling)
+        self.open_nodes.append(OpenNode(node, styling, new_styling, elements, block_level, link, False))
 
-        if block_level:
-            self.new_line(styling['bottom_spacing'] + styling['top_spacing'])
-        if link:
-            self.post_render["a"].append((node.get_attr('href'), elements))
+    def end_node(self, node):
+        """
+        finishes rendering a node, after all of its children.
+        :param node: node being finished - this must be the last node started
+        :return: nested tuples of elements from this node and its children
+        """
+        open_node = self.open_nodes.pop()
+        styling = open_node.styling
+        elements = open_node.elements
+
+        if not open_node.hidden:
+            if open_node.block_level:
+                self.new_line(styling['bottom_spacing'] + styling['top_spacing'])
+            if open_node.link:
+                self.post_render["a"].append((node.get_attr('href'), elements))
+
+        # the node's elements are also part of its parent's elements
+        if len(self.open_nodes) > 0:
+            self.open_nodes[-1].elements += elements
         # print(node)
         # print(elements)
         return elements
@@ -279,9 +354,15 @@ class Renderer:
         text = node.get_attr('title')
         alt = node.get_attr('alt')
 
+        # image data is either in the node, or in the asset store
+        data = None
         if node.get_attr('data') is not None:
+            data = base64.b64decode(node.get_attr('data'))
+        elif node.get_attr('asset') is not None and self.assets is not None:
+            data = self.assets.get(node.get_attr('asset'))
+
+        if data is not None:
             try:
-                data = base64.b64decode(node.get_attr('data'))
                 # print(data)
                 node.image = ImageTk.PhotoImage(data=data)
             except tk.TclError:
@@ -334,9 +415,9 @@ class Renderer:
         if bounds is not None:
             self.y_location = bounds[3] + line_spacing
 
-    def reconfigure_canvas(self, event):
+    def reconfigure_canvas(self, event=None):
         """
-        Canvas is being configured e.g. window size changes
+        Canvas is being configured e.g. window size changes, or more of the page has been drawn
         :param event: Tk event data
         """
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
@@ -0,0 +1,403 @@
+import heapq
+import re
+from functools import lru_cache
+
+# Most compiled selectors kept for reuse.
+CACHE_SIZE = 256
+
+# Tag, id, class and attribute names.
+NAME = re.compile(r'-?[_a-zA-Z0-9][-_a-zA-Z0-9]*')
+
+# Attribute value, quoted or not.
+VALUE = re.compile(r'"([^"]*)"|\'([^\']*)\'|(-?[_a-zA-Z0-9][-_a-zA-Z0-9]*)')
+
+# Tests for attribute selectors: [name<operator>value]
+OPERATORS = {
+    '=': lambda value, expected: value == expected,
+    '~=': lambda value, expected: expected in value.split(),
+    '|=': lambda value, expected: value == expected or value.startswith(expected + '-'),
+    '^=': lambda value, expected: expected != '' and value.startswith(expected),
+    '$=': lambda value, expected: expected != '' and value.endswith(expected),
+    '*=': lambda value, expected: expected != '' and expected in value,
+}
+
+DESCENDANT = ' '
+CHILD = '>'
+
+
+class SelectorError(Exception):
+    """
+    Thrown when a selector can't be understood.
+    """
+    pass
+
+
+class Compound:
+    """
+    The tests for a single node in a selector, eg. the 'a.external[href^="http"]' in 'p > a.external[href^="http"]'.
+    """
+
+    def __init__(self, tag, node_id, classes, attributes):
+        """
+        :param tag: Tag name to match, or None for any tag.
+        :param node_id: Value of the id attribute to match, or None.
+        :param classes: List of class names, all of which must be in the class attribute.
+        :param attributes: List of (name, operator, value) for attribute selectors. Operator is None (and value is
+            None) if the attribute only has to be present.
+        """
+        self.tag = tag
+        self.node_id = node_id
+        self.classes = classes
+        self.attributes = attributes
+
+    def matches(self, node):
+        """
+        :param node: A node.
+        :return: True if the node passes every test.
+        """
+        if self.tag is not None and node.tag != self.tag:
+            return False
+        if self.node_id is not None and node.get_attr('id') != self.node_id:
+            return False
+        if len(self.classes) > 0:
+            node_classes = (node.get_attr('class') or '').split()
+            for name in self.classes:
+                if name not in node_classes:
+                    return False
+        for name, operator, expected in self.attributes:
+            value = node.get_attr(name)
+            if operator is None:
+                # Attributes without a value (eg. <input disabled>) have the value None, so look for the name.
+                if value is None and name not in node.attrs:
+                    return False
+            elif value is None or not OPERATORS[operator](value, expected):
+                return False
+        return True
+
+    def candidates(self, page, index):
+        """
+        Find the nodes which might match, using the page's index.
+        :param page: The HtmlPage being searched.
+        :param index: The page's DomIndex.
+        :return: List of nodes, in document order, including at least every node which matches.
+        """
+        if self.node_id is not None and self.node_id not in index.duplicate_ids:
+            node = index.find_id(self.node_id)
+            return [node] if node is not None else []
+        if len(self.classes) > 0:
+            return index.find_class(self.classes[0])
+        if self.tag is not None:
+            return index.find(self.tag)
+        return page.find_nodes(None)
+
+
+class ComplexSelector:
+    """
+    A chain of Compounds joined by combinators, eg. 'div.main p > a'.
+    """
+
+    def __init__(self, compounds, combinators):
+        """
+        :param compounds: The Compounds, outermost first.
+        :param combinators: DESCENDANT or CHILD for each Compound after the first, saying how it is related to the one
+            before it.
+        """
+        self.compounds = compounds
+        self.combinators = combinators
+
+    def select(self, page, index):
+        """
+        Find the matching nodes. The index gives the nodes which might match the last Compound, and each one's
+        ancestors are then checked against the rest of the chain.
+        :param page: The HtmlPage being searched.
+        :param index: The page's DomIndex.
+        :return: List of matching nodes, in document order.
+        """
+        last = len(self.compounds) - 1
+        first = self.compounds[0]
+        if last > 0 and first.node_id is not None and first.node_id not in index.duplicate_ids:
+            # Everything matched is inside one node (eg. '#content a'), which usually has far fewer nodes inside it
+            # than the page has candidates.
+            anchor = index.find_id(first.node_id)
+            if anchor is None or not first.matches(anchor):
+                return list()
+            candidates = list()
+            anchor.find_nodes(candidates, self.compounds[last].tag)
+            if len(candidates) > 0 and candidates[0] == anchor:
+                candidates.pop(0)
+        else:
+            candidates = self.compounds[last].candidates(page, index)
+
+        # (node, position) -> True if the node matches the chain up to the Compound at position. Nodes on the same page
+        # share most of their ancestors, so each ancestor only has to be checked once.
+        known = dict()
+        return [node for node in candidates
+                if self.compounds[last].matches(node) and self.matches_before(node, last, known)]
+
+    def matches(self, node):
+        last = len(self.compounds) - 1
+        return self.compounds[last].matches(node) and self.matches_before(node, last, dict())
+
+    def matches_before(self, node, position, known):
+        """
+        Check the rest of the chain, for a node which matches the Compound at position.
+        :param node: The node.
+        :param position: Index of the Compound the node matches.
+        :param known: Results already found by this search.
+        :return: True if the node's ancestors match the Compounds before position.
+        """
+        if position == 0:
+            return True
+        compound = self.compounds[position - 1]
+        ancestor = node.parent
+        while ancestor is not None:
+            key = (ancestor, position - 1)
+            result = known.get(key)
+            if result is None:
+                result = compound.matches(ancestor) and self.matches_before(ancestor, position - 1, known)
+                known[key] = result
+            if result:
+                return True
+            if self.combinators[position - 1] == CHILD:
+                return False
+            ancestor = ancestor.parent
+        return False
+
+
+def document_positions(nodes):
+    """
+    Number nodes in document order without walking the whole page. Only the nodes and their ancestors are visited,
+    along with the children of ancestors which more than one of the nodes is inside.
+    :param nodes: Nodes in one page.
+    :return: Dictionary of each node's position (and each of its ancestors'), by node.
+    """
+    # Node -> its children which are, or are ancestors of, one of the nodes.
+    branches = dict()
+    root = None
+    for node in nodes:
+        child = None
+        while node is not None:
+            known = node in branches
+            if not known:
+                branches[node] = list()
+            if child is not None:
+                branches[node].append(child)
+            if known:
+                break
+            child = node
+            node = node.parent
+        else:
+            root = child
+
+    positions = dict()
+    stack = [root] if root is not None else []
+    while len(stack) > 0:
+        node = stack.pop()
+        positions[node] = len(positions)
+        children = branches[node]
+        if len(children) > 1:
+            siblings = {sibling: position for position, sibling in enumerate(node.children)}
+            children.sort(key=siblings.__getitem__)
+        # Pushed last child first, so that the first child is visited next.
+        stack.extend(reversed(children))
+    return positions
+
+
+class Selector:
+    """
+    A compiled selector, which finds nodes in a HtmlPage. Supported are tag names, '*', '#id', '.class', attribute
+    selectors ([name], [name=value], [name~=value], [name|=value], [name^=value], [name$=value], [name*=value]),
+    the descendant (' ') and child ('>') combinators, and lists of selectors separated by commas.
+    Use compile_selector to make one.
+    """
+
+    def __init__(self, text, selectors):
+        """
+        :param text: The selector's source.
+        :param selectors: The ComplexSelectors separated by commas.
+        """
+        self.text = text
+        self.selectors = selectors
+
+    def __str__(self):
+        return self.text
+
+    def select(self, page):
+        """
+        Find the nodes in a page which match.
+        :param page: The HtmlPage to search.
+        :return: List of matching nodes, in document order.
+        """
+        if page.root is None:
+            return list()
+        index = page.get_index()
+        if len(self.selectors) == 1:
+            return self.selectors[0].select(page, index)
+
+        # Each selector in the list finds nodes in document order, so the lists only have to be merged. A node found by
+        # more than one selector comes out of the merge once from each, one after the other.
+        found = [nodes for nodes in (selector.select(page, index) for selector in self.selectors) if len(nodes) > 0]
+        if len(found) <= 1:
+            return found[0] if len(found) > 0 else list()
+        positions = document_positions(node for nodes in found for node in nodes)
+        result = list()
+        for node in heapq.merge(*found, key=positions.__getitem__):
+            if len(result) == 0 or node != result[-1]:
+                result.append(node)
+        return result
+
+    def matches(self, node):
+        """
+        :param node: A node.
+        :return: True if the node matches.
+        """
+        for selector in self.selectors:
+            if selector.matches(node):
+                return True
+        return False
+
+
+class SelectorParser:
+    """
+    Reads the text of a selector.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.position = 0
+
+    def error(self, message):
+        return SelectorError(f'{message} at position {self.position} in selector {self.text!r}')
+
+    def at_end(self):
+        return self.position >= len(self.text)
+
+    def peek(self):
+        return self.text[self.position] if not self.at_end() else ''
+
+    def skip_space(self):
+        """
+        :return: True if there was any whitespace.
+        """
+        start = self.position
+        while not self.at_end() and self.peek().isspace():
+            self.position += 1
+        return self.position > start
+
+    def read(self, pattern, what):
+        match = pattern.match(self.text, self.position)
+        if match is None:
+            raise self.error(f'Expected {what}')
+        self.position = match.end()
+        return match
+
+    def name(self, what):
+        return self.read(NAME, what).group(0)
+
+    def selector_list(self):
+        selectors = list()
+        while True:
+            self.skip_space()
+            selectors.append(self.complex_selector())
+            if self.at_end():
+                return selectors
+            if self.peek() != ',':
+                raise self.error('Unexpected ' + repr(self.peek()))
+            self.position += 1
+
+    def complex_selector(self):
+        compounds = [self.compound()]
+        combinators = list()
+        while True:
+            space = self.skip_space()
+            if self.at_end() or self.peek() == ',':
+                return ComplexSelector(compounds, combinators)
+            if self.peek() == '>':
+                self.position += 1
+                self.skip_space()
+                combinators.append(CHILD)
+            elif space:
+                combinators.append(DESCENDANT)
+            else:
+                raise self.error('Unexpected ' + repr(self.peek()))
+            compounds.append(self.compound())
+
+    def compound(self):
+        tag = None
+        node_id = None
+        classes = list()
+        attributes = list()
+
+        universal = self.peek() == '*'
+        if universal:
+            self.position += 1
+        elif NAME.match(self.text, self.position):
+            tag = self.name('tag').lower()
+
+        while True:
+            character = self.peek()
+            if character == '#':
+                self.position += 1
+                name = self.name('id')
+                if node_id is None:
+                    node_id = name
+                else:
+                    attributes.append(('id', '=', name))
+            elif character == '.':
+                self.position += 1
+                classes.append(self.name('class'))
+            elif character == '[':
+                self.position += 1
+                attributes.append(self.attribute())
+            else:
+                break
+
+        if not universal and tag is None and node_id is None and len(classes) == 0 and len(attributes) == 0:
+            raise self.error('Expected a selector')
+        return Compound(tag, node_id, classes, attributes)
+
+    def attribute(self):
+        """
+        Read an attribute selector, after its '['.
+        :return: (name, operator, value)
+        """
+        self.skip_space()
+        name = self.name('attribute name').lower()
+        self.skip_space()
+        operator = None
+        value = None
+        if self.peek() != ']':
+            for candidate in OPERATORS:
+                if self.text.startswith(candidate, self.position):
+                    operator = candidate
+            if operator is None:
+                raise self.error('Expected an attribute operator')
+            self.position += len(operator)
+            self.skip_space()
+            match = self.read(VALUE, 'attribute value')
+            value = next(group for group in match.groups() if group is not None)
+            self.skip_space()
+        if self.peek() != ']':
+            raise self.error("Expected ']'")
+        self.position += 1
+        return name, operator, value
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_selector(text):
+    """
+    Compile a selector. Selectors used again are taken from a cache rather than compiled again.
+    :param text: The selector, eg. 'div#content > p a[href^="http"]'.
+    :return: The Selector.
+    """
+    return Selector(text, SelectorParser(text).selector_list())
+
+
+def select(page, text):
+    """
+    Find the nodes in a page which match a selector.
+    :param page: The HtmlPage to search.
+    :param text: The selector.
+    :return: List of matching nodes, in document order.
+    """
+    return compile_selector(text).select(page)
@@ -1,4 +1,7 @@
 from html.parser import HTMLParser
+import base64
+import hashlib
+import re
 
 # Constants for serialisation
 OBJECT = b'\x00'
@@ -8,6 +11,16 @@ TEXT_VALUE = b'\x03'
 LIST_VALUE = b'\x04'
 END_LIST_VALUE = b'\x05'
 
+# A control sequence followed by its text (if any). Text continues until the next byte below 0x20, except newline.
+TOKEN = re.compile(rb'([\x00-\x05])([\x0a\x20-\xff]*)')
+
+# An asset attribute (see assets.py) in serialised page data.
+ASSET_ATTR = re.compile(rb'\x02asset\x03([0-9a-f]{64})')
+
+# Events produced by HtmlStreamDeserialiser.
+NODE_START = 'start'
+NODE_END = 'end'
+
 
 class Serialiser:
     """
@@ -15,11 +28,14 @@ class Serialiser:
     Methods tend to return self so that we can write e.g. self.write(b'some data').write(b'more data').
     """
 
-    def __init__(self):
+    def __init__(self, inline_assets=None):
         """
         Prepare a Serialiser
+        :param inline_assets: AssetStore holding the images pages refer to by hash. If given, the images are written
+            into the page as 'data' attributes, for remotes which can't receive assets separately.
         """
         self.result = bytearray()
+        self.inline_assets = inline_assets
 
     def write(self, data: bytes):
         """
@@ -90,28 +106,45 @@ class Serialiser:
 
     def html_node(self, node):
         """
-        Write a HtmlNode.
+        Write a HtmlNode, and the nodes inside it.
         :param node:
         :return:
         """
 
-        self.object(node.tag.encode('utf-8'))
-
-        # Write the attribute list (list of text fields)
-        if len(node.attrs) > 0:
-            self.field(b'attr').start_list()
-            for attr in node.attrs:
-                self.field(attr[0].encode('utf-8')).text(attr[1])
-            self.end_list()
-
-        # Write the node's children (list of objects)
-        if len(node.children) > 0:
-            self.field(b'children').start_list()
-            for child in node.children:
-                self.html_node(child)
-            self.end_list()
+        # Nodes still to be written, in reverse order, with None where the children of a node end (and so the node).
+        # An explicit stack is used rather than recursion, so there is no limit on how deeply pages can be nested.
+        stack = [node]
+        pop = stack.pop
+        while stack:
+            node = pop()
+            if node is None:
+                self.end_list()
+                self.end_object()
+                continue
+
+            self.object(node.tag.encode('utf-8'))
+
+            # Write the attribute list (list of text fields)
+            if len(node.attrs) > 0:
+                self.field(b'attr').start_list()
+                for name, value in node.attrs.items():
+                    if name == 'asset' and self.inline_assets is not None:
+                        data = self.inline_assets.get(value)
+                        if data is not None:
+                            self.field(b'data').text(base64.b64encode(data).decode('utf-8'))
+                            continue
+                    self.field(name.encode('utf-8')).text(value)
+                self.end_list()
+
+            # Start the node's children (list of objects), which are written next
+            inside = node.children
+            if inside:
+                self.field(b'children').start_list()
+                stack.append(None)
+                stack.extend(reversed(inside))
+            else:
+                self.end_object()
 
-        self.end_object()
         return self
 
     def page(self, page):
@@ -136,17 +169,55 @@ class Serialiser:
         return bytes(self.result)
 
 
-def bytes_from_html(page) -> bytes:
+def bytes_from_html(page, inline_assets=None) -> bytes:
     """
     Serialise an HtmlPage
     :param page:
+    :param inline_assets: AssetStore to copy images from, for remotes which don't support assets (optional).
     :return:
     """
-    s = Serialiser()
+    s = Serialiser(inline_assets)
     s.page(page)
     return s.get_bytes()
 
 
+def chunks(data: bytes, size: int) -> list:
+    """
+    Split serialised page data into pieces for sending one at a time.
+    Each piece (after the first) begins at the start of a node, so the pieces follow the document order of the page.
+    :param data: The serialised page.
+    :param size: Minimum size of each piece. The last piece may be smaller.
+    :return: List of pieces, which join to give data.
+    """
+    result = list()
+    start = 0
+    while start < len(data):
+        end = data.find(OBJECT, start + size)
+        if end == -1:
+            end = len(data)
+        result.append(data[start:end])
+        start = end
+    return result
+
+
+def asset_keys(data: bytes) -> list:
+    """
+    Find the assets a serialised page refers to, without deserialising it.
+    :param data: The serialised page.
+    :return: List of asset hashes, without duplicates.
+    """
+    return list(dict.fromkeys(key.decode('ascii') for key in ASSET_ATTR.findall(data)))
+
+
+def page_hash(data: bytes) -> bytes:
+    """
+    Identify serialised page data by its content.
+    :param data: The serialised page.
+    :return: SHA-256 digest of the data.
+    """
+    return hashlib.sha256(data).digest()
+
+
 class SerialisationError(Exception):
     """
     Thrown to indicate an error in the serialised data.
@@ -332,26 +403,59 @@ class Deserialiser:
     def parse_object(self):
         """
         Parse an object by reading its name and fields.
+        Objects and lists inside it are read with an explicit stack rather than recursion, so that deeply nested pages
+        can be read.
         :return: A new DeserialisedObject
         """
 
-        # Objects begin with an OBJECT sequence and their name
-        name = self.read_text(OBJECT)
-
-        # Read the fields
-        fields = list()
-        while self.peek() != END_OBJECT:
-            fields.append(self.parse_field())
+        # Objects, lists and fields whose values are being read, innermost last. Each is [kind, name, items]: objects
+        # collect their fields, lists their items, and fields wait for their (object or list) value.
+        stack = list()
 
-        # Objects end with an END_OBJECT sequence
-        self.expect(END_OBJECT)
+        # Objects begin with an OBJECT sequence and their name
+        stack.append([OBJECT, self.read_text(OBJECT), list()])
+
+        while True:
+            kind, name, items = stack[-1]
+            if kind == OBJECT and self.peek() != END_OBJECT:
+                # Read the fields
+                self.start_field(stack)
+                continue
+            elif kind == LIST_VALUE and self.peek() != END_LIST_VALUE:
+                # Until we see an END_LIST_VALUE sequence, their must be more list items.
+                if self.peek() == FIELD:
+                    # This item is a field!
+                    self.start_field(stack)
+                elif self.peek() == OBJECT:
+                    # This item is an object!
+                    stack.append([OBJECT, self.read_text(OBJECT), list()])
+                else:
+                    # This item is not a field OR an object!!!!!?!??!?!?!???
+                    raise SerialisationError
+                continue
+
+            # Objects end with an END_OBJECT sequence, and lists with an END_LIST_VALUE sequence
+            stack.pop()
+            if kind == OBJECT:
+                self.expect(END_OBJECT)
+                value = DeserialisedObject(name, items)
+            else:
+                self.expect(END_LIST_VALUE)
+                value = DeserialisedList(items)
 
-        return DeserialisedObject(name, fields)
+            if len(stack) == 0:
+                return value
+            if stack[-1][0] == FIELD:
+                # This was a field's value, so the field is finished too.
+                _, field_name, value_type = stack.pop()
+                value = DeserialisedField(field_name, value_type, value)
+            stack[-1][2].append(value)
 
-    def parse_field(self):
+    def start_field(self, stack):
         """
-        Parse a field by reading its name and value.
-        :return: A DeserialisedField object.
+        Start to parse a field by reading its name. Text values are read straight away. Otherwise the field and its
+        value are pushed onto the stack, to be finished by parse_object.
+        :param stack: parse_object's stack.
         """
 
         # Fields begin with a FIELD sequence and their name
@@ -360,48 +464,19 @@ class Deserialiser:
         # Fields can have text, an object, or a list as their value.
         if self.peek() == TEXT_VALUE:
             # Text!
-            value = self.read_text(TEXT_VALUE)
-            value_type = TEXT_VALUE
+            stack[-1][2].append(DeserialisedField(field_name, TEXT_VALUE, self.read_text(TEXT_VALUE)))
         elif self.peek() == LIST_VALUE:
             # A list!
-            value = self.list_value()
-            value_type = LIST_VALUE
+            stack.append([FIELD, field_name, LIST_VALUE])
+            self.expect(LIST_VALUE)
+            stack.append([LIST_VALUE, None, list()])
         elif self.peek() == OBJECT:
             # An object!
-            value = self.parse_object()
-            value_type = OBJECT
+            stack.append([FIELD, field_name, OBJECT])
+            stack.append([OBJECT, self.read_text(OBJECT), list()])
         else:
             # Something else??!!?!?!?!?!
             raise SerialisationError
-        return DeserialisedField(field_name, value_type, value)
-
-    def list_value(self):
-        """
-        Parse a list value.
-        :return: A new DeserialisedList.
-        """
-
-        # Lists begin with a LIST_VALUE sequence.
-        self.expect(LIST_VALUE)
-
-        value = list()
-
-        # Until we see an END_LIST_VALUE sequence, their must be more list items.
-        while self.peek() != END_LIST_VALUE:
-            if self.peek() == FIELD:
-                # This item is a field!
-                value.append(self.parse_field())
-            elif self.peek() == OBJECT:
-                # This item is an object!
-                value.append(self.parse_object())
-            else:
-                # This item is not a field OR an object!!!!!?!??!?!?!???
-                raise SerialisationError
-
-        # Lists end with an END_LIST_VALUE sequence
-        self.expect(END_LIST_VALUE)
-
-        return DeserialisedList(value)
 
 
 def get_attrs(encoded_attrs):
@@ -417,6 +492,17 @@ def get_attrs(encoded_attrs):
     return attrs
 
 
+def deserialised_children(node):
+    """
+    :param node: A DeserialisedObject for a HtmlNode.
+    :return: DeserialisedObjects for the node's children.
+    """
+    children = node.find('children')
+    if children is None:
+        return ()
+    return children.list()
+
+
 class HtmlDeserialiser:
     """
     Convert a sequence of bytes into an HtmlPage.
@@ -447,22 +533,194 @@ class HtmlDeserialiser:
 
     def html_node(self, node):
         """
-        Recursively create html nodes by calling self.parser.handle_{start,end}tag.
+        Create html nodes by calling self.parser.handle_{start,end}tag, for a node and the nodes inside it.
         :param node: The DeserialisedObject being fed to the parser.
         """
-
         # Call parser.handle_starttag to create a HtmlNode
-        tag = node.name
-        attrs = get_attrs(node.find('attr'))
-        self.parser.handle_starttag(tag, attrs)
-
-        # Recursively create the node's children.
-        children = node.find('children')
-        if children is not None:
-            for child in children.list():
-                self.html_node(child)
-
-        # Call parser.handle_endtag to finish creating the node.
-        # Note that void tags like <hr> might not have called handle_endtag when they were first created!
-        # But when deserialising we ALWAYS call this method.
-        self.parser.handle_endtag(tag)
+        self.parser.handle_starttag(node.name, get_attrs(node.find('attr')))
+
+        # Nodes started but not finished, innermost last, with their children which haven't been created yet.
+        stack = [(node, iter(deserialised_children(node)))]
+        while len(stack) > 0:
+            node, remaining = stack[-1]
+            for child in remaining:
+                self.parser.handle_starttag(child.name, get_attrs(child.find('attr')))
+                # Create the child's children before the rest of node's.
+                stack.append((child, iter(deserialised_children(child))))
+                break
+            else:
+                # Call parser.handle_endtag to finish creating the node.
+                # Note that void tags like <hr> might not have called handle_endtag when they were first created!
+                # But when deserialising we ALWAYS call this method.
+                stack.pop()
+                self.parser.handle_endtag(node.name)
+
+
+class OpenObject:
+    """
+    An object which HtmlStreamDeserialiser has started reading, but not finished.
+    """
+
+    def __init__(self, kind, name):
+        """
+        :param kind: What is being read: 'page', 'node', 'attr' (list of attributes) or 'children' (list of nodes)
+        :param name: The object's name (for nodes, the tag)
+        """
+        self.kind = kind
+        self.name = name
+        self.attrs = list()
+        self.started = False
+        self.node = None
+
+
+class HtmlStreamDeserialiser:
+    """
+    Convert a sequence of bytes into an HtmlPage a piece at a time, as the data arrives.
+    Accepts the same data as HtmlDeserialiser, but calls parser.handle_starttag as soon as a node's attributes have been
+    read, so that the start of a page can be shown before the rest of it has arrived.
+    """
+
+    def __init__(self, parser: HTMLParser):
+        """
+        Create a streaming deserialiser.
+        :param parser: A GaudyParser (or compatible) to control Html Construction. handle_starttag must return the new
+            node.
+        """
+        self.parser = parser
+        self.address = None
+        self.title = None
+        self.finished = False
+
+        # Data which has not been read yet. It may end part way through a token.
+        self.buffer = bytearray()
+
+        # Objects being read, innermost last.
+        self.open = list()
+
+        # Name of the field waiting for its value, and the object it belongs to.
+        self.field = None
+
+        # (NODE_START or NODE_END, node) for each node started or finished by the current call to feed.
+        self.events = list()
+
+    def feed(self, data: bytes) -> list:
+        """
+        Read the next piece of serialised data.
+        :param data: The data following the previous piece.
+        :return: List of (NODE_START, node) and (NODE_END, node) pairs, in document order.
+        """
+        self.buffer.extend(data)
+        self.read_tokens(False)
+        return self.take_events()
+
+    def close(self) -> list:
+        """
+        Finish reading. Raises SerialisationError unless the whole page has been read.
+        :return: Events for nodes finished by the end of the data, as for feed.
+        """
+        self.read_tokens(True)
+        if not self.finished:
+            raise SerialisationError
+        return self.take_events()
+
+    def take_events(self) -> list:
+        events = self.events
+        self.events = list()
+        return events
+
+    def read_tokens(self, complete: bool) -> None:
+        """
+        Read every complete token in the buffer.
+        :param complete: True if no more data will arrive, so the last token is complete.
+        """
+        index = 0
+        while index < len(self.buffer):
+            match = TOKEN.match(self.buffer, index)
+            if match is None:
+                # Not a control sequence
+                raise SerialisationError
+            if match.end() == len(self.buffer) and not complete:
+                # More of this token's text may be on the way.
+                break
+            self.token(match.group(1), match.group(2))
+            index = match.end()
+        del self.buffer[:index]
+
+    def token(self, control: bytes, text: bytes) -> None:
+        """
+        Read one control sequence and the text following it.
+        :param control: The control sequence, e.g. OBJECT.
+        :param text: The text which follows (empty for sequences which don't have any).
+        """
+        if control in (LIST_VALUE, END_LIST_VALUE, END_OBJECT) and len(text) > 0:
+            raise SerialisationError
+        text = text.decode('utf-8')
+
+        if self.finished:
+            # Nothing may follow the page.
+            raise SerialisationError
+
+        if self.field is not None:
+            # This is the value of the last field.
+            self.field_value(control, text)
+            return
+
+        top = self.open[-1] if len(self.open) > 0 else None
+        if top is None:
+            # Each page must be represented by a single encoded Object named 'page'.
+            if control != OBJECT or text != 'page':
+                raise SerialisationError
+            self.open.append(OpenObject('page', text))
+        elif control == FIELD and top.kind in ('page', 'node', 'attr'):
+            self.field = text
+        elif control == OBJECT and top.kind == 'children':
+            self.open.append(OpenObject('node', text))
+        elif control == END_LIST_VALUE and top.kind in ('attr', 'children'):
+            self.open.pop()
+        elif control == END_OBJECT and top.kind == 'node':
+            self.start_node(top)
+            self.open.pop()
+            self.parser.handle_endtag(top.name)
+            self.events.append((NODE_END, top.node))
+        elif control == END_OBJECT and top.kind == 'page':
+            self.open.pop()
+            self.finished = True
+        else:
+            raise SerialisationError
+
+    def field_value(self, control: bytes, text: str) -> None:
+        """
+        Read the value of a field.
+        :param control: The control sequence starting the value.
+        :param text: The text which follows it.
+        """
+        name = self.field
+        self.field = None
+        owner = self.open[-1]
+
+        if control == TEXT_VALUE:
+            if owner.kind == 'attr':
+                self.open[-2].attrs.append((name, text))
+            elif owner.kind == 'page' and name == 'address':
+                self.address = text
+            elif owner.kind == 'page' and name == 'title':
+                self.title = text
+        elif control == LIST_VALUE and owner.kind == 'node' and name in ('attr', 'children'):
+            if name == 'children':
+                # All of the attributes have been read.
+                self.start_node(owner)
+            self.open.append(OpenObject(name, None))
+        elif control == OBJECT and owner.kind == 'page' and name == 'root':
+            self.open.append(OpenObject('node', text))
+        else:
+            raise SerialisationError
+
+    def start_node(self, node: OpenObject) -> None:
+        """
+        Call parser.handle_starttag to create a HtmlNode, unless it has already been created.
+        :param node: The node being read.
+        """
+        if not node.started:
+            node.started = True
+            node.node = self.parser.handle_starttag(node.name, node.attrs)
+            self.events.append((NODE_START, node.node))
@@ -0,0 +1,227 @@
+import serialiser
+import dom
+import assets
+
+from concurrent.futures import ThreadPoolExecutor
+
+from publisher import Publisher, HOST, PORT
+from messageType import *
+
+# Number of threads loading pages for each session.
+LOADING_THREADS = 2
+
+
+class Session(Publisher):
+    """
+    A browsing session shared with collaborators: loads pages from the internet, keeps the navigation history, and
+    sends pages to collaborators. Session has no user interface, and doesn't use Tk. Conductor adds a window to it, and
+    HeadlessConductor runs it without one.
+    Pages are downloaded, parsed and serialised on worker threads, so collaborators are still heard while a page loads.
+    Finished pages are shown and sent by the event loop.
+    """
+
+    pages = None
+    focused_page = 0
+
+    def __init__(self, cid, loop):
+        """
+        Create a session. Call go_to_page to load the first page, and listen to accept collaborators.
+        :param cid: The session name, sent to collaborators in the greeting.
+        :param loop: EventLoop which calls the network handlers.
+        """
+        super().__init__(cid, loop, assets.AssetStore())
+
+        # Setup navigation history
+        self.pages = [None]
+        self.page_history = list()
+        self.back_history = list()
+
+        # The page being loaded (a Future), if any. Pages which finish loading after they have been replaced by another
+        # navigation are thrown away.
+        self.loader = ThreadPoolExecutor(LOADING_THREADS, thread_name_prefix='PageLoader')
+        self.loading = None
+
+    def close(self):
+        self.loader.shutdown(wait=False, cancel_futures=True)
+        super().close()
+
+    def current_page(self):
+        """
+        Get the currently visible page
+        :return: The current page
+        """
+        return self.pages[self.focused_page]
+
+    def make_page_frame(self):
+        """
+        Create somewhere to draw a new page.
+        :return: A Tk frame, or None if pages aren't drawn.
+        """
+        return None
+
+    def show_page(self):
+        """
+        Draw the current page, after it has been loaded. Pages aren't drawn unless there is a user interface.
+        """
+        pass
+
+    def set_address(self, address):
+        """
+        Show the address of the page being loaded. There is nowhere to show it unless there is a user interface.
+        :param address: The page address.
+        """
+        pass
+
+    def go(self, url):
+        """
+        Update the navigation history and load a new page.
+        :param url: The URL of the page to load
+        """
+        # While another page is loading, the current page has already been added to the history.
+        if self.current_page() is not None and self.loading is None:
+            self.page_history.append((self.current_page().address, self.current_page_data))
+        self.go_to_page(url)
+
+    def finish_going(self):
+        """
+        Perform miscellaneous tasks required after a page has been loaded by go_to_page() or revisit().
+        """
+        self.show_page()
+        self.publish()
+        self.release_assets()
+
+    def release_assets(self):
+        """
+        Forget images which neither the current page nor any page in the history uses, so that a long session doesn't
+        keep every image it has shown. Pages in the history are rebuilt with their images when revisited.
+        """
+        keys = set(self.current_page_assets)
+        for _, page_data in self.page_history + self.back_history:
+            keys.update(serialiser.asset_keys(page_data))
+        self.assets.retain(keys)
+
+    def go_to_page(self, url):
+        """
+        Load a page from the internet. The page is shown and sent to collaborators once it has loaded.
+        :param url: The url of the page to load.
+        """
+
+        # Clear the forward navigation history
+        self.back_history = list()
+
+        # Set the url in the address bar
+        # Needed for non-user initiated navigation (e.g. homepage loaded).
+        self.set_address(url)
+
+        # Send a navigation message to each collaborator
+        self.broadcast(MESSAGE_NAVIGATION, url.encode('utf-8'))
+
+        self.load(self.fetch_page, url)
+
+    def revisit(self, page_data):
+        """
+        Reload a previously visited page
+        :param page_data: Serialised page data
+        """
+
+        # Set the address bar to the page's url
+        self.set_address(page_data[0])
+
+        # Send a navigation message to each collaborator
+        self.broadcast(MESSAGE_NAVIGATION, page_data[0].encode('utf-8'))
+
+        self.load(self.rebuild_page, page_data[1])
+
+    def fetch_page(self, url):
+        """
+        Download, parse and serialise a page. Called on a worker thread.
+        :param url: The url of the page to load.
+        :return: The page (without a frame), and its serialised data.
+        """
+        page = dom.create_page_from_url(url, None, self.assets)
+        return page, serialiser.bytes_from_html(page)
+
+    def rebuild_page(self, page_data):
+        """
+        Rebuild a page from serialised data. Called on a worker thread.
+        :param page_data: Serialised page data.
+        :return: The page (without a frame), and its serialised data.
+        """
+        return dom.deserialise_page(page_data, None, self.assets), page_data
+
+    def load(self, function, *args):
+        """
+        Load a page on a worker thread, replacing any page still being loaded.
+        :param function: fetch_page or rebuild_page.
+        :param args: Arguments for the function.
+        """
+        if self.loading is not None:
+            # Pages which haven't started loading yet are never loaded. Those which have are ignored when they finish.
+            self.loading.cancel()
+        future = self.loader.submit(function, *args)
+        self.loading = future
+        future.add_done_callback(lambda f: self.loop.call_soon_threadsafe(lambda: self.page_loaded(f)))
+
+    def page_loaded(self, future):
+        """
+        Show a page which has finished loading, and send it to collaborators. Called by the event loop.
+        :param future: The Future which loaded the page.
+        """
+        if future is not self.loading:
+            # Replaced by a later navigation
+            return
+        self.loading = None
+
+        try:
+            page, page_data = future.result()
+
+            # Destroy previous page (if any)
+            if self.current_page() is not None:
+                self.current_page().delete()
+
+            # Create frame to contain page components (if any)
+            page_frame = self.make_page_frame()
+            if page_frame is not None:
+                page.attach(page_frame)
+
+            self.pages[self.focused_page] = page
+            self.current_page_data = page_data
+
+            # Finalise loading
+            self.finish_going()
+
+        except (ValueError, OSError) as e:
+            print(e)
+
+        # Forget collaborators who disconnected while the page was being sent
+        self.remove_inactive()
+
+    def back(self):
+        """
+        Navigate backward through navigation history.
+        """
+        if len(self.page_history) > 0:
+            # Get previous page
+            prev = self.page_history.pop()
+
+            # Store current page for future 'forward' navigation, unless it was stored when the pending load began.
+            if self.current_page() is not None and self.loading is None:
+                self.back_history.append((self.current_page().address, self.current_page_data))
+
+            # Load the previous page
+            self.revisit(prev)
+
+    def forward(self):
+        """
+        Navigate forward through navigation history.
+        """
+        if len(self.back_history) > 0:
+            # Get next page
+            prev = self.back_history.pop()
+
+            # Store current page for future 'back' navigation, unless it was stored when the pending load began.
+            if self.current_page() is not None and self.loading is None:
+                self.page_history.append((self.current_page().address, self.current_page_data))
+
+            # Load the next page
+            self.revisit(prev)
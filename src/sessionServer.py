@@ -0,0 +1,151 @@
+import argparse
+import socket
+
+from eventLoop import EventLoop
+from messageProtocol import MessageProtocol
+from session import Session, HOST, PORT
+
+
+class SessionServer:
+    """
+    Hosts many independent Sessions in one process, on one port.
+    Collaborators choose a session with the 'session' capability in their greeting. Those which don't name a session
+    join the default session. Every session shares the server's event loop.
+    """
+
+    def __init__(self, name='Gaudy', loop=None):
+        """
+        Create a server with no sessions. Call create_session, then listen.
+        :param name: Name sent to collaborators in the greeting, before they have joined a session.
+        :param loop: EventLoop to use. A new one is created if this is None.
+        """
+        self.name = name
+        self.loop = loop if loop is not None else EventLoop()
+        self.server_socket = None
+
+        # Session id -> Session
+        self.sessions = dict()
+        self.default_session = None
+
+        # Connections whose greeting hasn't arrived yet: (protocol, address, connection)
+        self.greeting = list()
+
+    def create_session(self, session_id, home=None):
+        """
+        Start a new session.
+        :param session_id: Name collaborators use to join the session. The first session created is the default.
+        :param home: Url of the first page to load (optional).
+        :return: The new Session.
+        """
+        if session_id in self.sessions:
+            raise ValueError(f'Session {session_id} already exists')
+        if any(c in session_id for c in ';=\x00'):
+            raise ValueError(f'Session id {session_id} contains a reserved character')
+
+        session = Session(session_id, self.loop)
+        self.sessions[session_id] = session
+        if self.default_session is None:
+            self.default_session = session_id
+        if home is not None:
+            session.go_to_page(home)
+        return session
+
+    def remove_session(self, session_id):
+        """
+        End a session, disconnecting its collaborators.
+        :param session_id: The session to end.
+        """
+        session = self.sessions.pop(session_id)
+        session.close()
+        if self.default_session == session_id:
+            self.default_session = next(iter(self.sessions), None)
+
+    def listen(self, host=HOST, port=PORT):
+        """
+        Start accepting collaborators.
+        :param host: Address to listen on.
+        :param port: Port to listen on (0 to choose any free port).
+        :return: The address being listened on (host, port).
+        """
+        self.server_socket = socket.create_server((host, port))
+        self.server_socket.setblocking(False)
+        self.loop.add_reader(self.server_socket, self.accept_collaborators)
+        return self.server_socket.getsockname()
+
+    def accept_collaborators(self):
+        """
+        Accept connections, and wait for each one's greeting to find out which session it wants.
+        Called by the event loop when the server socket is ready.
+        """
+        while True:
+            try:
+                connection, address = self.server_socket.accept()
+            except BlockingIOError:
+                break
+            connection.setblocking(False)
+            c = (MessageProtocol(connection, self.name, loop=self.loop), address, connection)
+            self.greeting.append(c)
+            self.loop.add_reader(connection, lambda c=c: self.check_greeting(c))
+
+    def check_greeting(self, c):
+        """
+        Hand a connection over to the session it asks for, once its greeting has arrived.
+        :param c: The connection (protocol, address, connection)
+        """
+        collaborator, address, connection = c
+        messages = collaborator.receive()
+        if collaborator.active and collaborator.version is None:
+            # Still waiting
+            return
+
+        self.greeting.remove(c)
+        self.loop.remove_reader(connection)
+        session_id = collaborator.remote_capabilities.get('session', self.default_session)
+        if not collaborator.active or session_id not in self.sessions:
+            self.loop.remove_writer(connection)
+            connection.close()
+            return
+
+        # Any messages which arrived with the greeting are handled by the session.
+        self.sessions[session_id].add_collaborator(collaborator, address, connection, messages)
+
+    def close(self):
+        """
+        Stop accepting collaborators, and end every session.
+        """
+        if self.server_socket is not None:
+            self.loop.remove_reader(self.server_socket)
+            self.server_socket.close()
+            self.server_socket = None
+        for c in self.greeting:
+            self.loop.remove_reader(c[2])
+            self.loop.remove_writer(c[2])
+            c[2].close()
+        self.greeting = list()
+        for session_id in list(self.sessions):
+            self.remove_session(session_id)
+
+    def run(self):
+        """
+        Handle network events for every session until stop() is called.
+        """
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host several Gaudy sessions on one port.')
+    parser.add_argument('sessions', nargs='+', metavar='ID=URL',
+                        help='session id and the url of its first page. The first session is the default.')
+    parser.add_argument('--host', default=HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on')
+    arguments = parser.parse_args()
+
+    server = SessionServer()
+    for item in arguments.sessions:
+        name, _, url = item.partition('=')
+        server.create_session(name, url)
+    print('Listening on', server.listen(arguments.host, arguments.port))
+    server.run()
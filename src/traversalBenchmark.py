@@ -0,0 +1,248 @@
+import argparse
+import sys
+import time
+
+import dom
+import serialiser
+
+# Default shape of the generated pages: NODES nodes (roughly) in rows nested DEPTH deep, a page nested DEEP deep
+# which is too deep for recursive walkers, and a page with WIDE children of one node.
+NODES = 50000
+DEPTH = 20
+DEEP = 5000
+WIDE = 8000
+
+# Each measurement is the best of this many runs.
+REPEAT = 5
+
+
+# The recursive walkers which dom.collect and dom.walk_events replaced, kept here to compare against.
+
+def recursive_find_nodes(node, result, selector):
+    if selector is None or node.tag == selector:
+        result.append(node)
+    for child in node.children:
+        recursive_find_nodes(child, result, selector)
+
+
+def recursive_delete(node):
+    node.parent = None
+    for child in node.children:
+        recursive_delete(child)
+    node.children = dom.NO_CHILDREN
+
+
+def recursive_serialise(writer, node):
+    writer.object(node.tag.encode('utf-8'))
+    if len(node.attrs) > 0:
+        writer.field(b'attr').start_list()
+        for name, value in node.attrs.items():
+            if name == 'asset' and writer.inline_assets is not None:
+                data = writer.inline_assets.get(value)
+                if data is not None:
+                    writer.field(b'data').text(serialiser.base64.b64encode(data).decode('utf-8'))
+                    continue
+            writer.field(name.encode('utf-8')).text(value)
+        writer.end_list()
+    if len(node.children) > 0:
+        writer.field(b'children').start_list()
+        for child in node.children:
+            recursive_serialise(writer, child)
+        writer.end_list()
+    writer.end_object()
+
+
+def recursive_deserialise(parser, node):
+    parser.handle_starttag(node.name, serialiser.get_attrs(node.find('attr')))
+    for child in serialiser.deserialised_children(node):
+        recursive_deserialise(parser, child)
+    parser.handle_endtag(node.name)
+
+
+def recursive_str(node):
+    text = "<" + node.tag + ">"
+    for child in node.children:
+        text += recursive_str(child)
+    text += "</" + node.tag + ">"
+    return text
+
+
+# The current walkers.
+
+def find_nodes(node, result, selector):
+    node.find_nodes(result, selector)
+
+
+def delete(node):
+    node.delete()
+
+
+def serialise(writer, node):
+    writer.html_node(node)
+
+
+def deserialise(parser, node):
+    # Only the walk is measured: the data has already been parsed into DeserialisedObjects.
+    deserialiser = serialiser.HtmlDeserialiser.__new__(serialiser.HtmlDeserialiser)
+    deserialiser.parser = parser
+    deserialiser.html_node(node)
+
+
+def make_html(nodes, depth):
+    """
+    Generate a page.
+    :param nodes: Roughly how many nodes the page should have.
+    :param depth: How deeply the rows of the page are nested.
+    :return: The page's HTML.
+    """
+    rows = max(1, nodes // (depth + 4))
+    row = '<div class="row">' * depth + '<p>Row <a href="/next">link</a></p>' + '</div>' * depth
+    return '<html><body>' + row * rows + '</body></html>'
+
+
+def make_root(html, arena):
+    parser = dom.ArenaParser(None) if arena else dom.GaudyParser(None)
+    parser.feed(html)
+    return parser.root
+
+
+def best_times(before, after, repeat):
+    """
+    Time two functions, taking turns so that both are affected equally by anything else the machine is doing.
+    :param before: Function taking no arguments.
+    :param after: Function taking no arguments.
+    :param repeat: Number of runs of each.
+    :return: The shortest run of each, in seconds.
+    """
+    best = [None, None]
+    for _ in range(repeat):
+        for i, function in enumerate((before, after)):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            best[i] = elapsed if best[i] is None else min(best[i], elapsed)
+    return best
+
+
+def measure(html, arena, repeat):
+    """
+    Time each walker, before and after, on a page.
+    :return: List of (walker, nanoseconds per node before, nanoseconds per node after).
+    """
+    root = make_root(html, arena)
+    nodes = list()
+    root.find_nodes(nodes, None)
+    count = len(nodes)
+    data = serialiser.Serialiser().html_node(root).get_bytes()
+    parsed = serialiser.Deserialiser(data).parse_object()
+
+    def each(walker):
+        return {
+            'find_nodes': lambda: walker['find_nodes'](root, list(), 'a'),
+            'serialise': lambda: walker['serialise'](serialiser.Serialiser(), root),
+            'deserialise': lambda: walker['deserialise'](dom.GaudyParser(None), parsed),
+            'str': lambda: walker['str'](root),
+        }
+
+    before = each({'find_nodes': recursive_find_nodes, 'serialise': recursive_serialise,
+                   'deserialise': recursive_deserialise, 'str': recursive_str})
+    after = each({'find_nodes': find_nodes, 'serialise': serialise, 'deserialise': deserialise, 'str': str})
+
+    results = list()
+    for name in before:
+        before_time, after_time = best_times(before[name], after[name], repeat)
+        results.append((name, before_time / count * 1e9, after_time / count * 1e9))
+
+    # Deleting a page can only be done once, so each run needs a new page.
+    best = [None, None]
+    for _ in range(repeat):
+        for i, function in enumerate((recursive_delete, delete)):
+            if arena and function is recursive_delete:
+                # The recursive walker needs HtmlNodes.
+                continue
+            page_root = make_root(html, arena)
+            start = time.perf_counter()
+            function(page_root)
+            elapsed = time.perf_counter() - start
+            best[i] = elapsed if best[i] is None else min(best[i], elapsed)
+    results.append(('delete', best[0] / count * 1e9 if best[0] is not None else None, best[1] / count * 1e9))
+    return count, results
+
+
+def parse_times(html, repeat):
+    """
+    Time parsing a page into HtmlNodes and into a DomArena.
+    :return: List of (page layout, nanoseconds per node).
+    """
+    def parse(arena):
+        return lambda: make_root(html, arena)
+
+    nodes = list()
+    make_root(html, False).find_nodes(nodes, None)
+    node_time, arena_time = best_times(parse(False), parse(True), repeat)
+    return [('HtmlNode', node_time / len(nodes) * 1e9), ('DomArena', arena_time / len(nodes) * 1e9)]
+
+
+def deep_check(depth):
+    """
+    Check which walkers can cope with a page nested too deeply for recursion.
+    :return: List of (walker, True if the recursive walker failed, True if the current one succeeded).
+    """
+    html = '<html>' + '<div>' * depth + 'deep' + '</div>' * depth + '</html>'
+    root = make_root(html, False)
+
+    def succeeds(function):
+        try:
+            function()
+            return True
+        except RecursionError:
+            return False
+
+    # Made with the current walkers, which the recursive ones couldn't do.
+    data = serialiser.Serialiser().html_node(root).get_bytes()
+    parsed = serialiser.Deserialiser(data).parse_object()
+    return [
+        ('find_nodes', not succeeds(lambda: recursive_find_nodes(root, list(), None)),
+         succeeds(lambda: root.find_nodes(list(), None))),
+        ('serialise', not succeeds(lambda: recursive_serialise(serialiser.Serialiser(), root)),
+         succeeds(lambda: serialise(serialiser.Serialiser(), root))),
+        ('deserialise', not succeeds(lambda: recursive_deserialise(dom.GaudyParser(None), parsed)),
+         succeeds(lambda: deserialise(dom.GaudyParser(None), parsed))),
+        ('str', not succeeds(lambda: recursive_str(root)), succeeds(lambda: str(root))),
+        ('delete', not succeeds(lambda: recursive_delete(make_root(html, False))), succeeds(lambda: root.delete())),
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the per-node cost of the recursive DOM walkers with the '
+                                                 'explicit-stack walkers which replaced them.')
+    parser.add_argument('--nodes', type=int, default=NODES, help=f'nodes in the generated page (default {NODES})')
+    parser.add_argument('--depth', type=int, default=DEPTH, help=f'nesting of the generated page (default {DEPTH})')
+    parser.add_argument('--deep', type=int, default=DEEP,
+                        help=f'nesting of the page used to check for recursion errors (default {DEEP})')
+    parser.add_argument('--wide', type=int, default=WIDE,
+                        help=f'children of one node in the page used to time parsing (default {WIDE})')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help=f'runs of each measurement (default {REPEAT})')
+    parser.add_argument('--arena', action='store_true', help='keep the generated page in a DomArena')
+    args = parser.parse_args()
+
+    count, results = measure(make_html(args.nodes, args.depth), args.arena, args.repeat)
+    print(f'{count} nodes, nested {args.depth} deep' + (', in a DomArena' if args.arena else ''))
+    print(f'{"walker":<12} {"before":>12} {"after":>12}   (nanoseconds per node)')
+    for name, before, after in results:
+        before = f'{before:12.0f}' if before is not None else f'{"-":>12}'
+        print(f'{name:<12} {before} {after:12.0f}')
+
+    print()
+    print('Parsing (nanoseconds per node):')
+    pages = (('deep', '<html>' + '<div>' * args.deep + 'deep' + '</div>' * args.deep + '</html>'),
+             ('wide', '<html><body>' + '<br>wide' * args.wide + '</body></html>'))
+    for page, html in pages:
+        for layout, elapsed in parse_times(html, args.repeat):
+            print(f'{page + " " + layout:<20} {elapsed:12.0f}')
+
+    print()
+    print(f'Page nested {args.deep} deep (recursion limit {sys.getrecursionlimit()}):')
+    for name, recursive_failed, succeeded in deep_check(args.deep):
+        print(f'{name:<12} recursive: {"RecursionError" if recursive_failed else "ok":<15} now: '
+              f'{"ok" if succeeded else "failed"}')
@@ -0,0 +1,58 @@
+import assets
+import dom
+import serialiser
+from eventLoop import EventLoop
+from session import Session
+
+
+def page_with_images(store, *images):
+    """
+    Make a page whose images have been downloaded into store, and serialise it.
+    :return: The serialised page and the asset hashes of its images.
+    """
+    page = dom.HtmlPage(None, store)
+    page.address = 'http://example.com/'
+    parser = dom.GaudyParser(page.address, store)
+    parser.feed('<html><body>' + ''.join(f'<img src="/{i}.png">' for i in range(len(images))) + '</body></html>')
+    for node, data in zip(parser.images, images):
+        node.set_image(data)
+    page.finish_loading(parser)
+    return serialiser.bytes_from_html(page), page.asset_keys()
+
+
+def test_retain_releases_everything_else():
+    store = assets.AssetStore()
+    kept = store.add(b'kept')
+    released = store.add(b'released')
+    assert store.retain({kept}) == [released]
+    assert kept in store and released not in store
+
+
+def test_cache_size_follows_retain():
+    cache = assets.AssetCache(size=100)
+    kept = cache.add(b'k' * 10)
+    cache.add(b'r' * 20)
+    cache.retain({kept})
+    assert cache.used == 10
+
+
+def test_session_keeps_only_images_which_can_be_shown():
+    session = Session('test', EventLoop())
+    try:
+        history, history_keys = page_with_images(session.assets, b'back')
+        _, forward_keys = page_with_images(session.assets, b'forward', b'shared')
+        forward, _ = page_with_images(session.assets, b'forward', b'shared')
+        _, current_keys = page_with_images(session.assets, b'current', b'shared')
+        _, old_keys = page_with_images(session.assets, b'old')
+
+        session.page_history = [('http://example.com/back', history)]
+        session.back_history = [('http://example.com/forward', forward)]
+        session.current_page_assets = current_keys
+        session.release_assets()
+
+        for key in history_keys + forward_keys + current_keys:
+            assert key in session.assets
+        assert old_keys[0] not in session.assets
+        assert len(session.assets) == 4
+    finally:
+        session.close()
@@ -0,0 +1,119 @@
+import pytest
+
+import delta
+import dom
+import serialiser
+from messageProtocol import PAGE_REQUEST, NO_PAGE
+from messageType import *
+from publisher import Publisher
+
+
+def serialise(html, address='http://example.com/'):
+    """
+    Parse a page and serialise it, as the Conductor does before sending it.
+    :return: The serialised page.
+    """
+    page = dom.HtmlPage(None)
+    page.address = address
+    parser = dom.GaudyParser(address)
+    parser.feed(html)
+    page.finish_loading(parser)
+    return serialiser.bytes_from_html(page)
+
+
+def rows(count, changed=None):
+    cells = ''.join(f'<tr><td>Row {i}</td><td>{"changed" if i == changed else "value"}</td></tr>'
+                    for i in range(count))
+    return f'<html><head><title>Rows</title></head><body><table>{cells}</table></body></html>'
+
+
+BASE = serialise(rows(200))
+TARGET = serialise(rows(200, changed=100))
+
+
+def test_delta_rebuilds_the_target():
+    data = delta.encode(BASE, TARGET)
+    assert len(data) < len(TARGET) // 4
+    assert delta.apply(BASE, data) == TARGET
+    assert delta.base_hash(data) == serialiser.page_hash(BASE)
+    assert delta.target_hash(data) == serialiser.page_hash(TARGET)
+
+
+@pytest.mark.parametrize('base, target', [(b'', TARGET), (BASE, b''), (BASE, BASE), (TARGET, BASE)])
+def test_delta_edge_cases(base, target):
+    assert delta.apply(base, delta.encode(base, target)) == target
+
+
+def test_delta_against_another_page_is_refused():
+    data = delta.encode(BASE, TARGET)
+    with pytest.raises(delta.DeltaError):
+        delta.apply(TARGET, data)
+    with pytest.raises(delta.DeltaError):
+        delta.apply(None, data)
+
+
+def test_damaged_delta_is_refused():
+    data = bytearray(delta.encode(BASE, TARGET))
+    # Change the inserted text, so that the result doesn't match the target hash.
+    position = data.index(b'changed')
+    data[position] ^= 1
+    with pytest.raises(delta.DeltaError):
+        delta.apply(BASE, bytes(data))
+    with pytest.raises(delta.DeltaError):
+        delta.apply(BASE, bytes(data[:-3]))
+
+
+class FakeCollaborator:
+    """
+    Stands in for a collaborator's MessageProtocol, recording the messages sent to it.
+    """
+
+    def __init__(self):
+        self.remote_page = None
+        self.remote_assets = dict()
+        self.lagging = False
+        self.active = True
+        self.sent = list()
+
+    def supports(self, feature):
+        return feature in ('delta', 'assets', 'cache')
+
+    def send_message(self, message):
+        self.sent.append(message)
+
+
+class FakePublisher(Publisher):
+    def __init__(self):
+        super().__init__('test', None, dict())
+        for page in (BASE, TARGET):
+            self.current_page_data = page
+            self.current_page_hash = serialiser.page_hash(page)
+            self.sent_pages[self.current_page_hash] = page
+
+
+def test_page_request_with_a_base_gets_a_delta():
+    publisher = FakePublisher()
+    collaborator = FakeCollaborator()
+    publisher.page_requested(collaborator, PAGE_REQUEST.pack(publisher.current_page_hash, serialiser.page_hash(BASE)))
+    assert [m.message_type for m in collaborator.sent] == [MESSAGE_PAGEDELTA]
+    assert collaborator.remote_page == publisher.current_page_hash
+
+
+def test_failed_delta_is_followed_by_the_whole_page():
+    publisher = FakePublisher()
+    collaborator = FakeCollaborator()
+    # The page was offered, and assumed to be cached, but the collaborator couldn't rebuild it.
+    collaborator.remote_page = publisher.current_page_hash
+    publisher.page_requested(collaborator, PAGE_REQUEST.pack(publisher.current_page_hash, NO_PAGE))
+    assert [m.message_type for m in collaborator.sent] == [MESSAGE_PAGEDATA]
+    assert bytes(collaborator.sent[0].data) == TARGET
+
+
+def test_request_for_an_old_page_forgets_the_assumed_page():
+    publisher = FakePublisher()
+    collaborator = FakeCollaborator()
+    collaborator.remote_page = publisher.current_page_hash
+    publisher.page_requested(collaborator, PAGE_REQUEST.pack(serialiser.page_hash(BASE), NO_PAGE))
+    # The newer page has been offered already, so nothing is sent, but the next page mustn't be a delta.
+    assert collaborator.sent == []
+    assert collaborator.remote_page is None
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+import dom
+import serialiser
+
+HTML = ('<html><head><title>Arena</title></head><body>'
+        + ''.join(f'<div id="d{i}" class="row {"odd" if i % 2 else "even"}"><p>Paragraph {i} '
+                  f'<a href="/{i}">link</a><br>more</p><img src="/{i}.png" alt="{i}"></div>' for i in range(100))
+        + '<table><tr><td>cell</td></tr></table></body></html>')
+
+
+def parse(html, arena):
+    page = dom.HtmlPage(None, arena=arena)
+    page.address = 'http://example.com/'
+    parser = page.make_parser(len(html), page.address)
+    parser.feed(html)
+    page.finish_loading(parser)
+    return page
+
+
+def describe(page):
+    """
+    :return: Every node's tag, attributes and number of children, in document order.
+    """
+    return [(node.tag, node.attrs, len(node.children)) for node in page.find_nodes(None)]
+
+
+@pytest.fixture
+def pages():
+    return parse(HTML, False), parse(HTML, True)
+
+
+def test_parser_is_chosen_by_page(pages):
+    nodes, arena = pages
+    assert isinstance(nodes.root, dom.HtmlNode)
+    assert isinstance(arena.root, dom.ArenaNode)
+
+
+def test_same_tree(pages):
+    nodes, arena = pages
+    assert describe(arena) == describe(nodes)
+    assert str(arena.root) == str(nodes.root)
+    assert arena.title == nodes.title == 'Arena'
+
+
+@pytest.mark.parametrize('selector', ['div', 'a', 'img', 'data', 'td', 'missing'])
+def test_same_nodes_found(pages, selector):
+    nodes, arena = pages
+    assert [str(node) for node in arena.find_nodes(selector)] == [str(node) for node in nodes.find_nodes(selector)]
+    assert ([str(node) for node in arena.find_children('div', selector)] ==
+            [str(node) for node in nodes.find_children('div', selector)])
+
+
+def test_same_index(pages):
+    nodes, arena = pages
+    assert str(arena.find_id('d7')) == str(nodes.find_id('d7'))
+    assert len(arena.get_index().find_class('odd')) == len(nodes.get_index().find_class('odd')) == 50
+
+
+def test_images_have_sources(pages):
+    nodes, arena = pages
+    assert [node.source for node in arena.find_nodes('img')] == [node.source for node in nodes.find_nodes('img')]
+    assert arena.find_nodes('img')[3].source == 'http://example.com/3.png'
+
+
+def test_same_serialisation(pages):
+    nodes, arena = pages
+    assert serialiser.bytes_from_html(arena) == serialiser.bytes_from_html(nodes)
+
+
+def test_attributes_change_in_place(pages):
+    for page in pages:
+        node = page.find_id('d3')
+        page.set_attr(node, 'id', 'changed')
+        page.clear_attr(node, 'class')
+        assert page.find_id('changed') == node and page.find_id('d3') is None
+        assert node.attrs == {'id': 'changed'}
+
+
+def test_removed_nodes_are_gone(pages):
+    nodes, arena = pages
+    for page in pages:
+        page.remove_node(page.find_id('d3'))
+    assert describe(arena) == describe(nodes)
+    assert arena.find_id('d3') is None
+
+
+def test_arena_node_can_be_deleted_twice(pages):
+    _, arena = pages
+    node = arena.find_id('d3')
+    count = len(arena.root.arena)
+    node.delete()
+    node.delete()
+    assert node.parent is None and node.children == []
+    assert len(arena.root.arena) == count
+    arena.root.delete()
+    assert len(arena.root.arena) == 0
+
+
+def test_wide_page_is_parsed_in_linear_time():
+    def parse_time(children):
+        start = time.perf_counter()
+        # Text is added to the last child if that is text too, so the parser looks for the body's last child each time.
+        page = parse('<html><body>' + '<br>line' * children + '</body></html>', True)
+        assert len(page.find_nodes('br')) == children
+        return time.perf_counter() - start
+
+    # Eight times the children would take about sixty times as long if each child had to find the ones before it.
+    parse_time(1000)
+    assert parse_time(8000) < 20 * parse_time(1000)
+
+
+@pytest.mark.parametrize('arena', [False, True])
+def test_find_children_searches_inside_each_match(arena):
+    page = parse('<html><body><div id="a"><div id="b"><p>1</p></div></div><p>2</p><div id="c"></div></body></html>',
+                 arena)
+    # Each selector matches nodes inside, or the same as, those matching the one before, without duplicates.
+    assert [node.get_attr('id') for node in page.find_children('div', 'div')] == ['a', 'b', 'c']
+    assert [str(node) for node in page.find_children('div', 'p')] == ['<p><data></data></p>']
+    assert page.find_children('p', 'div') == []
+    assert len(page.find_children('body', None)) == 8
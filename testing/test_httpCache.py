@@ -0,0 +1,140 @@
+import hashlib
+from http.client import HTTPMessage
+
+import httpCache
+import httpClient
+from httpCache import HttpCache
+from pageCache import PageCache
+
+
+class FakeClient:
+    """
+    Answers requests with queued responses, and remembers the request headers.
+    """
+
+    def __init__(self):
+        self.responses = list()
+        self.requests = list()
+
+    def respond(self, status, body=b'', **headers):
+        message = HTTPMessage()
+        for name, value in headers.items():
+            message[name.replace('_', '-')] = value
+        self.responses.append((status, message, body))
+
+    def get(self, url, headers=None):
+        self.requests.append(dict(headers or {}))
+        status, message, body = self.responses.pop(0)
+        return httpClient.Response(url, status, 'OK' if status == 200 else 'Not Modified', message, body)
+
+
+def counts(cache):
+    return cache.hits, cache.revalidated, cache.misses
+
+
+def test_fresh_responses_are_used_without_asking():
+    client = FakeClient()
+    client.respond(200, b'page', Cache_Control='max-age=60')
+    cache = HttpCache(client=client)
+    assert cache.get('http://example.com/').body == b'page'
+    assert cache.get('http://example.com/').body == b'page'
+    assert len(client.requests) == 1
+    assert counts(cache) == (1, 0, 1)
+
+
+def test_stale_responses_are_revalidated():
+    client = FakeClient()
+    client.respond(200, b'page', ETag='"1"', Cache_Control='no-cache')
+    client.respond(304, ETag='"1"', Cache_Control='max-age=60')
+    cache = HttpCache(client=client)
+    cache.get('http://example.com/')
+    response = cache.get('http://example.com/')
+    assert (response.status, response.body) == (200, b'page')
+    assert client.requests[1]['If-None-Match'] == '"1"'
+    assert counts(cache) == (0, 1, 1)
+    # The 304 made the response fresh.
+    cache.get('http://example.com/')
+    assert counts(cache) == (1, 1, 1)
+
+
+def test_last_modified_is_a_validator():
+    client = FakeClient()
+    date = 'Mon, 01 Jan 2024 00:00:00 GMT'
+    client.respond(200, b'page', Last_Modified=date)
+    client.respond(304)
+    cache = HttpCache(client=client)
+    cache.get('http://example.com/')
+    cache.get('http://example.com/')
+    assert client.requests[1]['If-Modified-Since'] == date
+
+
+def test_revalidated_entries_are_copies():
+    client = FakeClient()
+    client.respond(200, b'page', ETag='"1"', Cache_Control='no-cache')
+    entry = httpCache.CacheEntry.from_response(client.get('http://example.com/'), 100)
+    client.respond(304, Cache_Control='max-age=60')
+    updated = entry.revalidated(client.get('http://example.com/'), 200)
+    assert updated is not entry
+    assert entry.headers['Cache-Control'] == 'no-cache' and entry.stored == 100
+    assert updated.headers == {'ETag': '"1"', 'Cache-Control': 'max-age=60'} and updated.stored == 200
+    assert updated.body is entry.body
+
+
+def test_changed_responses_replace_the_cached_one():
+    client = FakeClient()
+    client.respond(200, b'old', ETag='"1"', Cache_Control='no-cache')
+    client.respond(200, b'new', ETag='"2"', Cache_Control='no-cache')
+    cache = HttpCache(client=client)
+    cache.get('http://example.com/')
+    assert cache.get('http://example.com/').body == b'new'
+    assert counts(cache) == (0, 0, 2)
+    assert cache.used == 3
+
+
+def test_unstorable_responses_are_not_kept():
+    client = FakeClient()
+    client.respond(200, b'page', Cache_Control='no-store')
+    client.respond(200, b'page')
+    cache = HttpCache(client=client)
+    cache.get('http://example.com/')
+    cache.get('http://example.com/a')
+    assert len(cache.entries) == 0 and cache.used == 0
+
+
+def test_evicted_responses_are_kept_on_disk(tmp_path):
+    client = FakeClient()
+    client.respond(200, b'a' * 100, Cache_Control='max-age=60')
+    client.respond(200, b'b' * 100, Cache_Control='max-age=60')
+    cache = HttpCache(size=150, directory=str(tmp_path), client=client)
+    cache.get('http://example.com/a')
+    cache.get('http://example.com/b')
+    assert list(cache.entries) == ['http://example.com/b']
+    cache.close()
+
+    # A new cache finds the response on disk, and it is still fresh.
+    cache = HttpCache(size=150, directory=str(tmp_path), client=client)
+    assert cache.get('http://example.com/a').body == b'a' * 100
+    assert counts(cache) == (1, 0, 0)
+    assert len(client.requests) == 2
+
+
+def test_responses_removed_from_disk_are_forgotten(tmp_path):
+    client = FakeClient()
+    for name in 'abc':
+        client.respond(200, name.encode() * 100, Cache_Control='max-age=60')
+    # Room for one response in memory and one on disk.
+    cache = HttpCache(size=150, directory=str(tmp_path), disk_size=150, client=client)
+    for name in 'abc':
+        cache.get('http://example.com/' + name)
+    cache.close()
+    assert list(HttpCache(directory=str(tmp_path), client=client).index) == ['http://example.com/b']
+
+
+def test_page_cache_checks_its_files(tmp_path):
+    pages = PageCache(str(tmp_path))
+    key = hashlib.sha256(b'page').hexdigest()
+    pages.put(key, b'page')
+    assert PageCache(str(tmp_path)).get(key) == b'page'
+    with open(pages.path(key), 'wb') as file:
+        file.write(b'damaged')
+    assert pages.get(key) is None and key not in pages
@@ -0,0 +1,17 @@
+import urllib.error
+
+import pytest
+
+import httpClient
+
+
+def test_file_urls_are_opened_without_http(tmp_path):
+    path = tmp_path / 'image.png'
+    path.write_bytes(b'not really an image')
+    response = httpClient.HttpClient().get(path.as_uri())
+    assert (response.status, response.body) == (200, b'not really an image')
+
+
+def test_missing_files_raise_os_errors(tmp_path):
+    with pytest.raises(urllib.error.URLError):
+        httpClient.HttpClient().get((tmp_path / 'missing.png').as_uri())
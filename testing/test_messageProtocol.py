@@ -0,0 +1,182 @@
+import random
+import socket
+
+import pytest
+
+import compression
+from messageProtocol import (MessageProtocol, Message, ReceiveBuffer, encode_capabilities, decode_capabilities,
+                             LEGACY_VERSION, PROTOCOL_VERSION, HEADER)
+from messageType import *
+
+
+def connect(first=None, second=None):
+    """
+    Make two MessageProtocols talking to each other over a socket pair, and exchange greetings.
+    :param first: Keyword arguments for the first MessageProtocol.
+    :param second: Keyword arguments for the second.
+    :return: Both MessageProtocols.
+    """
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    b.setblocking(False)
+    left = MessageProtocol(a, 'left', **(first or dict()))
+    right = MessageProtocol(b, 'right', **(second or dict()))
+    left.receive()
+    right.receive()
+    return left, right
+
+
+def exchange(sender, receiver):
+    """
+    Pass everything queued by sender to receiver.
+    :return: The messages received.
+    """
+    messages = list()
+    for _ in range(1000):
+        sender.flush()
+        messages.extend(receiver.receive())
+        if sender.current is None and len(sender.priority) == 0 and len(sender.outgoing) == 0:
+            messages.extend(receiver.receive())
+            break
+    return messages
+
+
+def test_capabilities_round_trip():
+    data = encode_capabilities('name', {'version': '2', 'codecs': 'lzma,zlib'})
+    assert decode_capabilities(data) == ('name', {'version': '2', 'codecs': 'lzma,zlib'})
+
+
+def test_legacy_greeting_has_no_capabilities():
+    assert decode_capabilities(b'old peer') == ('old peer', dict())
+
+
+def test_version_and_codec_are_negotiated():
+    left, right = connect(dict(codecs=('lzma', 'zlib')), dict(codecs=('zlib',)))
+    assert left.version == right.version == PROTOCOL_VERSION
+    assert left.remote_name == 'right' and right.remote_name == 'left'
+    assert left.codec.name == 'zlib' and right.codec.name == 'zlib'
+
+
+def test_no_codec_in_common():
+    left, right = connect(dict(codecs=('lzma',)), dict(codecs=('bz2',)))
+    assert left.codec is None and right.codec is None
+
+
+def test_features_need_both_ends():
+    left, right = connect(dict(features=('delta', 'frames')), dict(features=('frames',)))
+    assert left.supports('frames') and right.supports('frames')
+    assert not left.supports('delta') and not right.supports('delta')
+
+
+def test_messages_wait_for_the_greeting():
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    b.setblocking(False)
+    left = MessageProtocol(a, 'left')
+    left.navigate('http://example.com/')
+    assert len(left.pending) == 1
+    right = MessageProtocol(b, 'right')
+    right.receive()
+    left.receive()
+    messages = exchange(left, right)
+    assert [(m.message_type, m.text()) for m in messages] == [(MESSAGE_NAVIGATION, 'http://example.com/')]
+
+
+@pytest.mark.parametrize('size', [0, 10, 70000, 1000000])
+def test_messages_arrive_intact(size):
+    left, right = connect()
+    data = bytes(i % 251 for i in range(size))
+    left.pagedata(data)
+    left.navigate('http://example.com/')
+    messages = exchange(left, right)
+    assert sorted((m.message_type, bytes(m.data)) for m in messages) == \
+        sorted([(MESSAGE_PAGEDATA, data), (MESSAGE_NAVIGATION, b'http://example.com/')])
+
+
+def test_large_payloads_are_compressed_and_fragmented():
+    left, right = connect(dict(frame_size=1024), dict(frame_size=1024))
+    # Compresses to about half its size, which is still several frames.
+    choose = random.Random(1).choice
+    data = bytes(choose(b'abcdefghijklmnop') for _ in range(100000))
+    message = Message(MESSAGE_PAGEDATA, data)
+    frames = message.encode_for(left)
+    assert len(frames) > 1
+    assert HEADER.unpack_from(frames[0])[2] & compression.by_name('lzma').codec_id
+    left.pagedata(data)
+    messages = exchange(left, right)
+    assert [(m.message_type, bytes(m.data)) for m in messages] == [(MESSAGE_PAGEDATA, data)]
+
+
+def test_fragments_are_reassembled_in_place():
+    left, right = connect(dict(frame_size=1024, codecs=()), dict(frame_size=1024, codecs=()))
+    data = bytes(range(256)) * 400
+    left.pagedata(data)
+    messages = exchange(left, right)
+    assert [(m.message_type, bytes(m.data)) for m in messages] == [(MESSAGE_PAGEDATA, data)]
+    # The fragments were copied into one buffer rather than joined.
+    assert isinstance(messages[0].data, memoryview)
+
+
+def test_oversized_fragmented_payload_is_refused():
+    left, right = connect(dict(frame_size=1024, codecs=()), dict(frame_size=1024, codecs=()))
+    right.payload_limit = 10000
+    left.pagedata(bytes(20000))
+    messages = exchange(left, right)
+    assert [m.message_type for m in messages] == [MESSAGE_INVALID]
+
+
+def test_priority_messages_overtake_page_data():
+    left, right = connect(dict(frame_size=1024, codecs=()), dict(frame_size=1024, codecs=()))
+    # Fill the socket so that the page is still queued when the navigation is sent.
+    left.pagedata(bytes(8 * 1024 * 1024))
+    left.navigate('http://example.com/')
+    messages = exchange(left, right)
+    assert [m.message_type for m in messages] == [MESSAGE_NAVIGATION, MESSAGE_PAGEDATA]
+
+
+def test_legacy_peer():
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    b.setblocking(False)
+    left = MessageProtocol(a, 'left')
+    # A legacy peer greets without capabilities.
+    b.send(Message(MESSAGE_GREETING, b'old').as_bytes(LEGACY_VERSION))
+    left.receive()
+    assert left.version == LEGACY_VERSION and left.remote_name == 'old'
+    left.navigate('http://example.com/')
+    left.flush()
+    received = b.recv(65536)
+    assert received.endswith(Message(MESSAGE_NAVIGATION, b'http://example.com/').as_bytes(LEGACY_VERSION))
+
+
+def test_receive_buffer_reuses_space():
+    buffer = ReceiveBuffer(16)
+    space = buffer.reserve(10)
+    space[0:10] = b'0123456789'
+    buffer.commit(10)
+    buffer.consume(8)
+    space = buffer.reserve(12)
+    space[0:4] = b'abcd'
+    buffer.commit(4)
+    assert bytes(buffer.readable()) == b'89abcd'
+    assert len(buffer.data) == 16
+
+
+@pytest.mark.parametrize('codec', [codec.name for codec in compression.CODECS])
+def test_compression_bomb_is_refused(codec):
+    left, right = connect()
+    right.payload_limit = 1024 * 1024
+    codec = compression.by_name(codec)
+    # A small payload which decompresses to far more than the limit.
+    bomb = codec.compress(bytes(16 * 1024 * 1024), 9)
+    left.queue([HEADER.pack(PROTOCOL_VERSION, MESSAGE_PAGEDATA, codec.codec_id, len(bomb)) + bomb], MESSAGE_PAGEDATA)
+    messages = exchange(left, right)
+    assert [m.message_type for m in messages] == [MESSAGE_INVALID]
+
+
+def test_payload_up_to_the_limit_is_accepted():
+    left, right = connect(dict(codecs=('zlib',)), dict(codecs=('zlib',)))
+    right.payload_limit = 100000
+    left.pagedata(bytes(100000))
+    messages = exchange(left, right)
+    assert [(m.message_type, len(m.data)) for m in messages] == [(MESSAGE_PAGEDATA, 100000)]
@@ -0,0 +1,77 @@
+import assets
+import dom
+import serialiser
+from eventLoop import EventLoop
+from messageType import *
+from relay import Relay
+
+
+class FakeCollaborator:
+    """
+    Stands in for a downstream collaborator's MessageProtocol, recording the messages sent to it.
+    """
+
+    def __init__(self):
+        self.remote_page = None
+        self.remote_assets = dict()
+        self.lagging = False
+        self.active = True
+        self.sent = list()
+
+    def supports(self, feature):
+        return feature in ('assets',)
+
+    def send_message(self, message):
+        self.sent.append(message)
+
+
+def received_page(cache, *images):
+    """
+    Make a page as the Collaborator would have it: its images are in cache.
+    :return: The page and its serialised data.
+    """
+    page = dom.HtmlPage(None, cache)
+    page.address = 'http://example.com/'
+    parser = dom.GaudyParser(page.address, cache)
+    parser.feed('<html><body>' + ''.join(f'<img src="/{i}.png">' for i in range(len(images))) + '</body></html>')
+    for node, data in zip(parser.images, images):
+        node.set_image(data)
+    page.finish_loading(parser)
+    return page, serialiser.bytes_from_html(page)
+
+
+def test_relay_keeps_images_the_collaborator_forgets():
+    cache = assets.AssetCache(size=100)
+    relay = Relay('relay', EventLoop(), None, cache.get)
+    page, data = received_page(cache, b'a' * 40, b'b' * 40)
+    relay.page_received(page, data)
+    keys = page.asset_keys()
+    assert all(key in relay.assets for key in keys)
+
+    # The Collaborator's cache makes room for something else.
+    cache.add(b'c' * 100)
+    assert not any(key in cache for key in keys)
+
+    collaborator = FakeCollaborator()
+    relay.deliver_page(collaborator)
+    sent = [m.message_type for m in collaborator.sent]
+    assert sent == [MESSAGE_ASSET, MESSAGE_ASSET, MESSAGE_PAGEDATA]
+
+
+def test_relay_releases_images_of_the_previous_page():
+    cache = assets.AssetCache()
+    relay = Relay('relay', EventLoop(), None, cache.get)
+    first, first_data = received_page(cache, b'first', b'shared')
+    relay.page_received(first, first_data)
+    second, second_data = received_page(cache, b'second', b'shared')
+    relay.page_received(second, second_data)
+    assert sorted(relay.assets.assets) == sorted(second.asset_keys())
+
+
+def test_relay_page_only_changes_when_a_page_is_complete():
+    cache = assets.AssetCache()
+    relay = Relay('relay', EventLoop(), None, cache.get)
+    assert relay.current_page() is None
+    page, data = received_page(cache)
+    relay.page_received(page, data)
+    assert relay.current_page() is page and relay.current_page_data == data
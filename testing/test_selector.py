@@ -0,0 +1,73 @@
+import pytest
+
+import dom
+import selector
+from selector import SelectorError, compile_selector
+
+HTML = ('<html><head><title>Selectors</title></head><body><div id="content" class="main wide">'
+        + ''.join(f'<div class="row{" odd" if i % 2 else ""}" lang="{"en-GB" if i % 3 else "fr"}">'
+                  f'<p>Row {i} <a href="{"http://example.com/" if i % 4 else "/local"}{i}">link</a></p>'
+                  f'<span><a class="odd" href="#{i}">anchor</a></span><input disabled></div>' for i in range(40))
+        + '</div><p id="content">second</p><ul><li><a>item</a></li></ul></body></html>')
+
+SELECTORS = ['a', '*', 'div', '#content', 'p#content', '.odd', 'div.row.odd', 'a.odd', '[disabled]', '[lang|=en]',
+             'a[href^="http"]', 'a[href$="7"]', 'a[href*=local]', '[class~=wide]', 'div p a', 'div > p > a',
+             '#content > div', '#content a', 'body > div span a', 'div.odd > span > a.odd', 'ul a', 'li > a',
+             'html > p', 'div a, p', 'li, title, .odd', 'span a, a.odd', 'missing', 'div missing, missing']
+
+
+def parse(html, arena):
+    page = dom.HtmlPage(None, arena=arena)
+    parser = page.make_parser(len(html))
+    parser.feed(html)
+    page.finish_loading(parser)
+    return page
+
+
+@pytest.fixture(params=[False, True], ids=['nodes', 'arena'])
+def page(request):
+    return parse(HTML, request.param)
+
+
+@pytest.mark.parametrize('text', SELECTORS)
+def test_select_finds_every_match(page, text):
+    compiled = compile_selector(text)
+    expected = [node for node in page.find_nodes(None) if compiled.matches(node)]
+    assert page.select(text) == expected
+
+
+def test_lists_are_in_document_order_without_duplicates(page):
+    found = page.select('p, div, p, a')
+    everything = page.find_nodes(None)
+    assert found == [node for node in everything if node.tag in ('p', 'div', 'a')]
+    assert len(set(found)) == len(found)
+
+
+def test_lists_follow_changes_to_the_page(page):
+    item = page.find_nodes('li')[0]
+    if isinstance(item, dom.ArenaNode):
+        node = item.arena.add(item, 'p', [])
+    else:
+        node = dom.HtmlNode(item, 'p', [])
+    page.add_node(item, node)
+    assert page.select('li > p, ul, li') == [page.find_nodes('ul')[0], item, node]
+
+
+def test_empty_page():
+    assert dom.HtmlPage(None).select('div, p') == []
+
+
+@pytest.mark.parametrize('text', ['', ' ', 'div >', 'div,', ', div', 'a[href', 'a[href=]', 'a[href!=x]', '#', '.',
+                                  'div)', 'a > > b'])
+def test_bad_selectors_are_errors(text):
+    with pytest.raises(SelectorError):
+        compile_selector(text)
+
+
+def test_selectors_are_compiled_once():
+    assert compile_selector('div > p a') is compile_selector('div > p a')
+    assert str(compile_selector('div > p a')) == 'div > p a'
+
+
+def test_module_select(page):
+    assert selector.select(page, '#content')[0].tag == 'div'
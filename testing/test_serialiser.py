@@ -0,0 +1,107 @@
+import pytest
+
+import dom
+import serialiser
+
+HTML = ('<html><head><title>Stream</title></head><body>'
+        + ''.join(f'<div id="d{i}" class="row"><p>Paragraph {i} <a href="/{i}">link</a></p><hr></div>'
+                  for i in range(300))
+        + '</body></html>')
+
+
+def parse(html, address='http://example.com/'):
+    page = dom.HtmlPage(None)
+    page.address = address
+    parser = dom.GaudyParser(address)
+    parser.feed(html)
+    page.finish_loading(parser)
+    return page
+
+
+def serialise(html):
+    return serialiser.bytes_from_html(parse(html))
+
+
+DATA = serialise(HTML)
+
+
+def describe(page):
+    """
+    :return: Every node's tag and attributes, in document order.
+    """
+    return [(node.tag, dict(node.attrs)) for node in page.find_nodes(None)]
+
+
+def loaded(data, arena=None):
+    page = dom.HtmlPage(None, arena=arena)
+    page.load_data(data)
+    return page
+
+
+def streamed(pieces, arena=None):
+    page = dom.HtmlPage(None, arena=arena)
+    page.start_stream()
+    for piece in pieces:
+        page.feed(piece)
+    page.finish_stream()
+    return page
+
+
+def test_round_trip():
+    page = loaded(DATA)
+    assert page.address == 'http://example.com/'
+    assert page.title == 'Stream'
+    # HtmlDeserialiser names the root node after its field ('root') rather than its tag.
+    assert describe(page)[1:] == describe(parse(HTML))[1:]
+
+
+@pytest.mark.parametrize('size', [1, 7, 1024, 16 * 1024])
+def test_stream_matches_whole_page(size):
+    pieces = [DATA[i:i + size] for i in range(0, len(DATA), size)]
+    page = streamed(pieces)
+    expected = parse(HTML)
+    assert describe(page) == describe(expected)
+    assert page.title == expected.title and page.address == expected.address
+
+
+@pytest.mark.parametrize('arena', [False, True])
+def test_stream_of_chunks(arena):
+    pieces = serialiser.chunks(DATA, 1024)
+    assert b''.join(pieces) == DATA
+    assert all(piece.startswith(serialiser.OBJECT) for piece in pieces[1:])
+    assert describe(streamed(pieces, arena)) == describe(parse(HTML))
+
+
+def test_stream_events_are_in_document_order():
+    parser = dom.GaudyParser(None)
+    stream = serialiser.HtmlStreamDeserialiser(parser)
+    events = list()
+    for piece in serialiser.chunks(DATA, 512):
+        events.extend(stream.feed(piece))
+    events.extend(stream.close())
+    expected = list(parse(HTML).root.walk_events())
+    assert [(event, node.tag) for event, node in events] == [(event, node.tag) for event, node in expected]
+
+
+def test_nodes_are_available_before_the_page_ends():
+    page = dom.HtmlPage(None)
+    page.start_stream()
+    page.feed(DATA[:len(DATA) // 2])
+    assert page.root is not None
+    assert 0 < len(page.find_nodes('a')) < 300
+
+
+def test_truncated_stream_is_an_error():
+    page = dom.HtmlPage(None)
+    page.start_stream()
+    page.feed(DATA[:len(DATA) - 10])
+    with pytest.raises(serialiser.SerialisationError):
+        page.finish_stream()
+
+
+def test_deeply_nested_page():
+    depth = 5000
+    html = '<html>' + '<div>' * depth + 'deep' + '</div>' * depth + '</html>'
+    page = streamed(serialiser.chunks(serialise(html), 4096))
+    assert len(page.find_nodes('div')) == depth
+    assert describe(page) == describe(parse(html))
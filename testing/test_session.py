@@ -0,0 +1,63 @@
+from concurrent.futures import Future
+
+import dom
+import serialiser
+from eventLoop import EventLoop
+from session import Session
+
+
+class PendingSession(Session):
+    """
+    A session whose pages never finish loading, so navigations can be made while a load is pending.
+    """
+
+    def __init__(self):
+        super().__init__('test', EventLoop())
+
+    def load(self, function, *args):
+        self.loading = Future()
+
+
+def show(session, address):
+    page = dom.HtmlPage(None, session.assets)
+    page.address = address
+    parser = dom.GaudyParser(address, session.assets)
+    parser.feed(f'<html><body><p>{address}</p></body></html>')
+    page.finish_loading(parser)
+    session.pages[session.focused_page] = page
+    session.current_page_data = serialiser.bytes_from_html(page)
+
+
+def addresses(history):
+    return [address for address, _ in history]
+
+
+def test_back_while_loading_does_not_store_the_page_twice():
+    session = PendingSession()
+    show(session, 'http://a.example/')
+    session.go('http://b.example/')
+    session.back()
+    assert addresses(session.page_history) == []
+    assert addresses(session.back_history) == []
+    session.close()
+
+
+def test_forward_while_loading_does_not_store_the_page_twice():
+    session = PendingSession()
+    show(session, 'http://a.example/')
+    session.back_history.append(('http://c.example/', session.current_page_data))
+    session.back_history.append(('http://b.example/', session.current_page_data))
+    session.forward()
+    assert addresses(session.page_history) == ['http://a.example/']
+    session.forward()
+    assert addresses(session.page_history) == ['http://a.example/']
+    session.close()
+
+
+def test_back_stores_the_page_for_forward():
+    session = PendingSession()
+    show(session, 'http://a.example/')
+    session.page_history.append(('http://p.example/', session.current_page_data))
+    session.back()
+    assert addresses(session.back_history) == ['http://a.example/']
+    session.close()